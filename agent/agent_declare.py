@@ -1,33 +1,15 @@
-from langgraph.prebuilt import create_react_agent
-from langgraph_supervisor import create_supervisor
+import threading
+from typing import Any, Optional
 
 from tools.answer_question import book_interview, answer_from_documents
 
 from dotenv import load_dotenv
-import os
-from langchain_google_genai import ChatGoogleGenerativeAI
-from pydantic import SecretStr
+from services.llm_client import get_llm_client
 
 
 load_dotenv()
 
-# Get API key
-api_key = os.getenv("GEMINI_API_KEY")
-if not api_key:
-    raise ValueError("GEMINI_API_KEY environment variable is not set")
-
-
-# Create the model with proper API key
-model = ChatGoogleGenerativeAI(
-    model="gemini-1.5-pro",
-    temperature=0.7,
-    api_key=SecretStr(api_key)
-)
-
-question_answering_agent = create_react_agent(
-    model=model,
-    tools=[answer_from_documents, book_interview],
-    prompt="""You are a conversational assistant with access to conversation history and tools. 
+AGENT_PROMPT = """You are a conversational assistant with access to conversation history and tools. 
 
 CRITICAL: You MUST check the conversation context first before using any tools.
 
@@ -44,6 +26,31 @@ EXAMPLES:
 - "I want to book an interview" → Use book_interview tool
 - "Tell me about Nepal" → Use answer_from_documents tool
 
-NEVER use tools for questions about previous conversation details.""",
-    name="question_answering_agent"
-)
+NEVER use tools for questions about previous conversation details."""
+
+
+def create_question_answering_agent():
+    # langgraph is slow to import, it is only loaded when the agent is built
+    from langgraph.prebuilt import create_react_agent
+
+    return create_react_agent(
+        # the process-wide chat model (LLM_BACKEND), shared with the document answering tool
+        model=get_llm_client().model,
+        tools=[answer_from_documents, book_interview],
+        prompt=AGENT_PROMPT,
+        name="question_answering_agent"
+    )
+
+
+_question_answering_agent: Optional[Any] = None
+_agent_lock = threading.Lock()
+
+
+def get_question_answering_agent():
+    """Return the process-wide question answering agent, built on first use"""
+    global _question_answering_agent
+    if _question_answering_agent is None:
+        with _agent_lock:
+            if _question_answering_agent is None:
+                _question_answering_agent = create_question_answering_agent()
+    return _question_answering_agent
@@ -1,32 +1,328 @@
+import asyncio
+import json
+import os
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 from fastapi import APIRouter, Request
+from fastapi.responses import StreamingResponse
+from langchain_core.runnables import RunnableLambda
 from pydantic import BaseModel
-from agent.agent_declare import question_answering_agent
-from services.redis_service import redis_service
+from agent.agent_declare import get_question_answering_agent
+from services.conversation_context import context_builder
+from services.corpus_collections import Scope, make_scope, set_scope
+from services.intent_router import INTENT_ROUTER_ENABLED, RouteDecision, intent_router
+from services.metrics import record_cache, timed_stage
+from services.redis_service import get_redis_service
+from tools.answer_question import (ANSWER_LLM_TAG, REDIS_TIMEOUT_SECONDS, UNKNOWN_CORPUS_VERSION, aretrieve_and_answer,
+                                   is_failed_response)
 
 router = APIRouter()
 
+# upper bound for one whole agent run (tool calls included), in seconds
+CHAT_TIMEOUT_SECONDS = float(os.getenv("CHAT_TIMEOUT_SECONDS", 120))
+
 class Query(BaseModel):
     query: str
     # sesion is changed per user or per session
     session_id: str = "default"
+    # collections searched (the default collection when not given), optionally narrowed to some documents
+    collections: Optional[List[str]] = None
+    document_ids: Optional[List[str]] = None
+
+# status event sent when the agent starts a tool
+TOOL_STAGES = {
+    "answer_from_documents": "retrieving",
+    "book_interview": "booking",
+}
+
+
+def _enhanced_query(user_query: str, conversation_context: str) -> str:
+    if conversation_context:
+        return f"Context: {conversation_context}\n\nCurrent question: {user_query}"
+    return user_query
+
+
+async def _route(user_query: str) -> Optional[RouteDecision]:
+    """Intent router decision, None when the router is disabled or fails (the agent handles the message)"""
+    if not INTENT_ROUTER_ENABLED:
+        return None
+    try:
+        with timed_stage("route"):
+            decision = await intent_router.aroute(user_query)
+        print(f"Intent router: {decision.route} ({decision.intent} {decision.score:.2f}, margin {decision.margin:.2f}, {decision.reason})")
+        return decision
+    except Exception as e:
+        print(f"Intent router error: {e}")
+        return None
+
+
+async def _prepare(user_query: str, session_id: str, scope: Scope) -> Tuple[int, Optional[RouteDecision], str, Optional[Dict[str, Any]]]:
+    """
+    Corpus version, route, conversation context and cached answer of a /chat message.
+
+    The response cache is checked before the agent runs, so a hit costs no LLM call. Its key holds
+    the normalized query, the context the answer depends on (none for the retrieval fast path,
+    which does not read the conversation), the retrieval scope and the corpus version, which every
+    ingestion bumps. When the corpus version cannot be read in time it is UNKNOWN_CORPUS_VERSION and
+    no cache is read or written for the message.
+    """
+    try:
+        with timed_stage("corpus_version"):
+            corpus_version = await asyncio.wait_for(get_redis_service().aget_corpus_version(), REDIS_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        print("Corpus version read timed out, answering without the response caches")
+        corpus_version = UNKNOWN_CORPUS_VERSION
+    decision = await _route(user_query)
+    fast_path = decision is not None and decision.route == "documents"
+    # recent turns verbatim plus a summary of older ones, within the context token budget
+    context = ""
+    if not fast_path:
+        try:
+            with timed_stage("context"):
+                context = await context_builder.abuild(session_id, timeout=REDIS_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            print("Conversation history read timed out, answering without context")
+    cached = None
+    if corpus_version != UNKNOWN_CORPUS_VERSION:
+        try:
+            with timed_stage("cache_chat"):
+                cached = await asyncio.wait_for(get_redis_service().aget_chat_response(user_query, context, corpus_version, scope.key),
+                                              REDIS_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        record_cache("chat", hits=int(bool(cached)), misses=int(not cached))
+    if cached:
+        print(f"Chat cache hit (corpus version {corpus_version})")
+    return corpus_version, decision, context, cached
+
+
+async def _remember(session_id: str, user_query: str, response: str, agent_name: str) -> None:
+    """Append the turn to the conversation; turns leaving the verbatim window are summarized in the background"""
+    with timed_stage("remember"):
+        await get_redis_service().astore_conversation(session_id, user_query, response, agent_name)
+    context_builder.schedule_update(session_id)
+
+
+async def _cache_answer(user_query: str, context: str, corpus_version: int, response: str, agent_name: str, scope: Scope) -> None:
+    # only document answers are reused: a booking must never be confirmed from the cache
+    if agent_name != "answer_from_documents" or corpus_version == UNKNOWN_CORPUS_VERSION or is_failed_response(response):
+        return
+    try:
+        await asyncio.wait_for(
+            get_redis_service().acache_chat_response(user_query, context, corpus_version, response, agent_name, scope.key),
+            REDIS_TIMEOUT_SECONDS
+        )
+    except asyncio.TimeoutError:
+        print("Chat cache write timed out")
+
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    """Format one server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def _text(content: Any) -> str:
+    if isinstance(content, list):
+        return "".join(item if isinstance(item, str) else str(item.get("text", "")) for item in content)
+    return str(content or "")
+
+
+async def _stream_chat(user_query: str, session_id: str, collections: Optional[List[str]] = None,
+                       document_ids: Optional[List[str]] = None) -> AsyncIterator[str]:
+    """
+    Run the agent and yield its progress as server-sent events.
+
+    Events: `status` when a stage starts, `token` for each generated piece of the answer and a final
+    `done` (or `error`) with the full response. Answers produced by a tool are streamed from the
+    tool's own LLM call, or sent whole when they came from the cache, and the agent's closing
+    restatement of them is not streamed again. The agent's own text is sent when its turn ends
+    without a tool call, so the preamble of a tool call never reaches the client. Messages the intent router recognises as document
+    questions skip the agent and stream the retrieval answer directly; cached answers are sent
+    whole without running either.
+
+    The scope is set in the generator, whose context is the one the agent's tools run in.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + CHAT_TIMEOUT_SECONDS
+    final_response = None
+    agent_name = "question_answering_agent"
+    agent_tokens = []
+    streamed_tool_tokens = False
+    events = None
+
+    try:
+        try:
+            scope = make_scope(collections, document_ids)
+        except ValueError as e:
+            yield _sse("error", {"response": str(e), "session_id": session_id})
+            return
+        # read by the answer_from_documents tool
+        set_scope(scope)
+        yield _sse("status", {"stage": "thinking"})
+        corpus_version, decision, context, cached = await _prepare(user_query, session_id, scope)
+        if cached:
+            await _remember(session_id, user_query, cached["response"], cached["agent_used"])
+            yield _sse("token", {"text": cached["response"]})
+            yield _sse("done", {
+                "response": cached["response"],
+                "session_id": session_id,
+                "status": "success",
+                "agent_used": cached["agent_used"]
+            })
+            return
+
+        fast_path = decision is not None and decision.route == "documents"
+        if fast_path:
+            yield _sse("status", {"stage": "retrieving"})
+            async def answer_question(query: str) -> str:
+                return await aretrieve_and_answer(query, session_id=session_id, query_embedding=decision.embedding,
+                                                  corpus_version=corpus_version, scope=scope)
+
+            # a runnable, so the answer LLM's tokens surface as stream events
+            answer = RunnableLambda(answer_question, name="answer_from_documents")
+            events = answer.astream_events(user_query, version="v2").__aiter__()
+        else:
+            enhanced_query = _enhanced_query(user_query, context)
+            events = get_question_answering_agent().astream_events(
+                {"messages": [{"role": "user", "content": enhanced_query}]},
+                version="v2"
+            ).__aiter__()
+
+        while True:
+            try:
+                event = await asyncio.wait_for(events.__anext__(), max(deadline - loop.time(), 0))
+            except StopAsyncIteration:
+                break
+            kind = event["event"]
+            tags = event.get("tags") or []
+
+            if kind == "on_tool_start" and final_response is None:
+                yield _sse("status", {"stage": TOOL_STAGES.get(event["name"], event["name"])})
+
+            elif kind == "on_chat_model_stream":
+                token = _text(getattr(event["data"]["chunk"], "content", ""))
+                if not token:
+                    continue
+                if ANSWER_LLM_TAG in tags:
+                    streamed_tool_tokens = True
+                    yield _sse("token", {"text": token})
+                elif final_response is None:
+                    # held until the turn ends: it may still turn out to be a tool call's preamble
+                    agent_tokens.append(token)
+
+            elif kind == "on_chat_model_start" and ANSWER_LLM_TAG not in tags and final_response is None:
+                agent_tokens = []
+
+            elif kind == "on_chat_model_end" and ANSWER_LLM_TAG not in tags and final_response is None:
+                if getattr(event["data"].get("output"), "tool_calls", None):
+                    agent_tokens = []
+                else:
+                    for token in agent_tokens:
+                        yield _sse("token", {"text": token})
+
+            elif fast_path and kind == "on_chain_end" and not event.get("parent_ids"):
+                final_response = _text(event["data"].get("output"))
+                agent_name = "answer_from_documents"
+                if not streamed_tool_tokens:
+                    yield _sse("token", {"text": final_response})
+
+            elif kind == "on_tool_end" and final_response is None:
+                output = event["data"].get("output")
+                content = _text(getattr(output, "content", output))
+                if content and not any(keyword in content.lower() for keyword in ['transfer', 'routing', 'assign']):
+                    final_response = content
+                    agent_name = event["name"]
+                    if not streamed_tool_tokens:
+                        yield _sse("token", {"text": content})
+
+        if final_response is None:
+            final_response = "".join(agent_tokens)
+        if not final_response:
+            yield _sse("error", {"response": "I apologize, but I couldn't get a proper response from the agents.", "session_id": session_id})
+            return
+
+        # history and the entry response cache are written once the answer is complete
+        await _remember(session_id, user_query, final_response, agent_name)
+        await _cache_answer(user_query, context, corpus_version, final_response, agent_name, scope)
+        yield _sse("done", {
+            "response": final_response,
+            "session_id": session_id,
+            "status": "success",
+            "agent_used": agent_name
+        })
+
+    except asyncio.TimeoutError:
+        yield _sse("error", {"response": "The request timed out. Please try again.", "session_id": session_id})
+    except Exception as e:
+        yield _sse("error", {"response": f"An error occurred: {str(e)}", "session_id": session_id})
+    finally:
+        # on timeout, error or client disconnect too: stops the agent run and its LLM calls
+        if events is not None:
+            await events.aclose()
+
+
+@router.post("/chat/stream")
+async def chat_stream(payload: Query):
+    """Same as /chat, answered as a text/event-stream of status, token and done events"""
+    return StreamingResponse(
+        _stream_chat(payload.query, payload.session_id, payload.collections, payload.document_ids),
+        media_type="text/event-stream",
+        # no buffering by proxies, tokens must reach the client as they are generated
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 
 @router.post("/chat")
 async def chat(payload: Query):
     user_query = payload.query
     session_id = payload.session_id
+    try:
+        scope = make_scope(payload.collections, payload.document_ids)
+    except ValueError as e:
+        return {
+            "response": str(e),
+            "session_id": session_id,
+            "status": "error"
+        }
+    # read by the answer_from_documents tool, the agent runs in this request's context
+    set_scope(scope)
     
     try:
-        conversation_context = redis_service.get_conversation_context(session_id)
-        
-        if conversation_context:
-            enhanced_query = f"Context: {conversation_context}\n\nCurrent question: {user_query}"
-        else:
-            enhanced_query = user_query
+        corpus_version, decision, context, cached = await _prepare(user_query, session_id, scope)
+        if cached:
+            await _remember(session_id, user_query, cached["response"], cached["agent_used"])
+            return {
+                "response": cached["response"],
+                "session_id": session_id,
+                "status": "success",
+                "agent_used": cached["agent_used"]
+            }
+
+        # fast path: clear document questions go straight to retrieval, skipping the agent's planning LLM call
+        if decision is not None and decision.route == "documents":
+            final_response = await asyncio.wait_for(
+                aretrieve_and_answer(user_query, session_id=session_id, query_embedding=decision.embedding, corpus_version=corpus_version,
+                                     scope=scope),
+                CHAT_TIMEOUT_SECONDS
+            )
+            await _remember(session_id, user_query, final_response, "answer_from_documents")
+            await _cache_answer(user_query, context, corpus_version, final_response, "answer_from_documents", scope)
+            return {
+                "response": final_response,
+                "session_id": session_id,
+                "status": "success",
+                "agent_used": "answer_from_documents"
+            }
+
+        enhanced_query = _enhanced_query(user_query, context)
         
-        # invoke the question answering agent to handle user query
-        response = question_answering_agent.invoke({
-            "messages": [{"role": "user", "content": enhanced_query}]
-        })
+        # invoke the question answering agent to handle user query, without blocking the event loop
+        with timed_stage("agent"):
+            response = await asyncio.wait_for(
+                get_question_answering_agent().ainvoke({
+                    "messages": [{"role": "user", "content": enhanced_query}]
+                }),
+                CHAT_TIMEOUT_SECONDS
+            )
         
         #  final response from the agent
         if response and "messages" in response:
@@ -49,6 +345,7 @@ async def chat(payload: Query):
                 if hasattr(message, '__class__') and 'ToolMessage' in str(message.__class__):
                     if content and not any(keyword in content.lower() for keyword in ['transfer', 'routing', 'assign']):
                         final_response = content
+                        agent_name = getattr(message, 'name', None) or agent_name
                         break
 
                 # if no tools is used, then it is a direct AI response
@@ -73,7 +370,8 @@ async def chat(payload: Query):
             
             if final_response:
                 # redis implementation for storing conversation 
-                redis_service.store_conversation(session_id, user_query, final_response, agent_name)
+                await _remember(session_id, user_query, final_response, agent_name)
+                await _cache_answer(user_query, context, corpus_version, final_response, agent_name, scope)
                 
                 return {
                     "response": final_response,
@@ -94,6 +392,12 @@ async def chat(payload: Query):
                 "status": "error"
             }
             
+    except asyncio.TimeoutError:
+        return {
+            "response": "The request timed out. Please try again.",
+            "session_id": session_id,
+            "status": "error"
+        }
     except Exception as e:
         return {
             "response": f"An error occurred: {str(e)}",
@@ -0,0 +1,50 @@
+import asyncio
+import os
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+
+from database.db_conn import check_database
+from services.redis_service import get_redis_service
+from services.warmup import warmup
+
+router = APIRouter()
+
+# upper bound for each dependency check of the readiness probe, in seconds
+HEALTH_CHECK_TIMEOUT_SECONDS = float(os.getenv("HEALTH_CHECK_TIMEOUT_SECONDS", 2))
+
+
+@router.get("/health/live")
+async def live():
+    """Liveness: the process serves requests; dependencies are not checked, so an outage never restarts the workers"""
+    return {"status": "alive"}
+
+
+async def _redis_status() -> str:
+    redis_service = get_redis_service()
+    if redis_service.async_redis_client is None:
+        return "memory fallback"
+    try:
+        await asyncio.wait_for(redis_service.async_redis_client.ping(), HEALTH_CHECK_TIMEOUT_SECONDS)
+        return "ok"
+    except Exception as e:
+        return f"unreachable: {e}"
+
+
+@router.get("/health/ready")
+async def ready():
+    """Readiness: warmup has finished and the database answers; 503 otherwise"""
+    checks = {}
+    if warmup.finished:
+        try:
+            database = await asyncio.wait_for(asyncio.to_thread(check_database), HEALTH_CHECK_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            database = False
+        checks["database"] = "ok" if database else "failed"
+        # Redis is reported, not required: the service falls back to in-memory storage
+        checks["redis"] = await _redis_status()
+        # steps that failed at startup (e.g. the database was still starting) are retried
+        warmup.retry_failed()
+
+    is_ready = warmup.ready and checks.get("database") == "ok"
+    body = {"status": "ready" if is_ready else "not ready", "checks": checks, "warmup": warmup.status()}
+    return JSONResponse(body, status_code=200 if is_ready else 503)
@@ -0,0 +1,42 @@
+from typing import Optional
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import PlainTextResponse, Response
+from prometheus_client import CONTENT_TYPE_LATEST
+
+from services.metrics import render_metrics
+from services.profiler import PROFILER_ENABLED, profiler
+
+router = APIRouter()
+
+
+@router.get("/metrics")
+async def metrics():
+    """Prometheus scrape endpoint"""
+    return Response(render_metrics(), media_type=CONTENT_TYPE_LATEST)
+
+
+def _require_profiler() -> None:
+    if not PROFILER_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+
+
+@router.post("/debug/profiler/start")
+async def start_profiler(interval_ms: Optional[float] = None):
+    """Start sampling the stacks of every thread"""
+    _require_profiler()
+    if not profiler.start(interval_ms):
+        raise HTTPException(status_code=409, detail="The profiler is already running.")
+    return profiler.status()
+
+
+@router.get("/debug/profiler")
+async def profiler_status():
+    _require_profiler()
+    return profiler.status()
+
+
+@router.post("/debug/profiler/stop", response_class=PlainTextResponse)
+async def stop_profiler():
+    """Stop sampling; answered with the folded stacks, e.g. for flamegraph.pl or speedscope"""
+    _require_profiler()
+    return PlainTextResponse(profiler.stop())
@@ -1,44 +1,80 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
+import asyncio
+import uuid
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException
 from typing import List
 
-from services.extract_text import extract_text_from_pdf, extract_text_from_txt
-from services.chunk_text import chunk_text_by_tokens
-from services.embed_store import generate_embeddings
-
-from sentence_transformers import SentenceTransformer
+from database.documents import list_collections
+from services.chunk_text import DEFAULT_CHUNKING_METHOD, get_chunker
+from services.corpus_collections import DEFAULT_COLLECTION, validate_collection
+from services.ingestion import delete_collection, get_ingestion_service, save_uploads
 
 router= APIRouter()
 
-model = SentenceTransformer('all-MiniLM-L6-v2')
+
+def _collection(collection: str) -> str:
+    try:
+        return validate_collection(collection)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
-@router.post("/upload")
-async def upload_file(file: UploadFile = File(...)):
-    if not file.filename.endswith((".pdf", ".txt")):  #type: ignore
-        raise HTTPException(status_code=400, detail="Only .pdf and .txt files are supported.")
+async def _queue_uploads(files: List[UploadFile], collection: str, chunking_method: str):
+    if not files:
+        raise HTTPException(status_code=400, detail="No files uploaded.")
+    collection = _collection(collection)
+    try:
+        get_chunker(chunking_method)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
+    job_id = str(uuid.uuid4())
     try:
-        # extract text from pdf or txt file 
-        if file.filename.endswith(".pdf"): #type: ignore
-            text = extract_text_from_pdf(file.file)
-        else:
-            text = extract_text_from_txt(file.file)
-
-        # chunk the extracted text 
-        chunks = chunk_text_by_tokens(text)
-
-        # generate embeddings
-        embeddings=generate_embeddings(chunks, file.filename or "unknown")
-        
-        # the model returns embedding in 384 dimensions
-        embedding_dims = 384
-
-        return {
-            "filename": file.filename,
-            "num_chunks": len(chunks),
-            "embedding_dims": embedding_dims,
-            "status": "successfully embedded"
-        }
+        # spooling (and unzipping) is blocking file I/O
+        documents = await asyncio.to_thread(save_uploads, job_id, [(file.filename or "unknown", file.file) for file in files])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not documents:
+        raise HTTPException(status_code=400, detail="No .pdf or .txt documents found in the upload.")
 
+    try:
+        job = await asyncio.to_thread(get_ingestion_service().submit, job_id, documents, collection, chunking_method)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    return {**job, "status_url": f"/jobs/{job_id}"}
+
+
+@router.post("/upload", status_code=202)
+async def upload_file(file: UploadFile = File(...), collection: str = Form(DEFAULT_COLLECTION),
+                      chunking_method: str = Form(DEFAULT_CHUNKING_METHOD)):
+    """Queue one .pdf, .txt or .zip file for ingestion into a collection; poll the returned job for progress"""
+    return await _queue_uploads([file], collection, chunking_method)
+
+
+@router.post("/upload/batch", status_code=202)
+async def upload_files(files: List[UploadFile] = File(...), collection: str = Form(DEFAULT_COLLECTION),
+                       chunking_method: str = Form(DEFAULT_CHUNKING_METHOD)):
+    """Queue several files (and the documents inside .zip archives) as one ingestion job"""
+    return await _queue_uploads(files, collection, chunking_method)
+
+
+@router.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    job = await asyncio.to_thread(get_ingestion_service().status, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job
+
+
+@router.get("/collections")
+async def collections():
+    """Collections holding documents, with their document and chunk counts"""
+    return await asyncio.to_thread(list_collections)
+
+
+@router.delete("/collections/{collection}")
+async def remove_collection(collection: str):
+    """Delete a collection's documents: chunk rows, vectors and lexical index entries, in bulk"""
+    deleted = await asyncio.to_thread(delete_collection, _collection(collection))
+    if deleted is None:
+        raise HTTPException(status_code=404, detail="Collection not found.")
+    return {"collection": collection, **deleted}
@@ -0,0 +1,74 @@
+"""
+Benchmark the offset-based chunker against the original encode/decode chunker.
+
+Usage:
+    python -m benchmarks.bench_chunk_text --words 200000 --repeat 3
+"""
+import argparse
+import random
+import time
+
+from transformers import AutoTokenizer
+
+from services.chunk_text import DEFAULT_TOKENIZER_MODEL, chunk_text_by_tokens, get_tokenizer
+
+WORDS = (
+    "the interview process includes a technical round and a final discussion with the team "
+    "Kathmandu Nepal documents retrieval embeddings vector database tokenization 2024 results"
+).split()
+
+
+def legacy_chunk_text_by_tokens(text: str, model: str, chunk_size: int = 200, overlap: int = 50):
+    """The chunker as it was before the tokenizer cache: load, encode everything, decode per window"""
+    tokenizer = AutoTokenizer.from_pretrained(model)
+    tokens = tokenizer.encode(text, verbose=False)
+    chunks = []
+    i = 0
+    while i < len(tokens):
+        chunks.append(tokenizer.decode(tokens[i: i + chunk_size]))
+        i += chunk_size - overlap
+    return chunks
+
+
+def make_document(n_words: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    lines = []
+    for start in range(0, n_words, 12):
+        lines.append(" ".join(rng.choice(WORDS) for _ in range(min(12, n_words - start))))
+    return "\n".join(lines)
+
+
+def best_of(fn, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=DEFAULT_TOKENIZER_MODEL)
+    parser.add_argument("--words", type=int, nargs="+", default=[10_000, 100_000, 500_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    # warm the process-wide tokenizer, the legacy path pays a load on every call
+    get_tokenizer(args.model)
+
+    print(f"{'words':>10} {'chunks':>8} {'legacy (s)':>12} {'offsets (s)':>12} {'speedup':>8}")
+    for n_words in args.words:
+        text = make_document(n_words)
+        legacy = legacy_chunk_text_by_tokens(text, args.model)
+        chunks = chunk_text_by_tokens(text, model=args.model)
+        if len(legacy) != len(chunks):
+            raise SystemExit(f"chunk count mismatch: legacy={len(legacy)} offsets={len(chunks)}")
+
+        legacy_time = best_of(lambda: legacy_chunk_text_by_tokens(text, args.model), args.repeat)
+        offsets_time = best_of(lambda: chunk_text_by_tokens(text, model=args.model), args.repeat)
+        print(f"{n_words:>10} {len(chunks):>8} {legacy_time:>12.3f} {offsets_time:>12.3f} {legacy_time / offsets_time:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+"""
+Retrieval accuracy, ingestion throughput and query latency of each chunking strategy and embedding model.
+
+The question/answer set is a JSONL file of {"question": ..., "answer": ...} lines. `answer` is a
+passage of the corpus that answers the question, and a chunk is relevant when it holds the whole
+passage (case and whitespace are ignored). Without --qa, a synthetic corpus is generated: filler
+paragraphs with one-sentence facts written at random positions, and a question per fact. The
+--corpus documents are then added as distractors.
+
+For every strategy the corpus is chunked once. For every embedding model the chunks are then
+embedded into a local vector store in a temporary directory, so the harness needs no network
+access; the models and the tokenizer must already be in the Hugging Face cache. Reported per
+strategy and model:
+- answerable: share of questions whose passage lies whole in at least one chunk
+- recall@k: share of questions with a relevant chunk among the first k results, and MRR
+- ingest: chunking plus embedding plus storing, in KB of text per second
+- query p50/p95: embedding the question plus the vector store query
+
+Usage:
+    python -m benchmarks.bench_chunking_strategies
+    python -m benchmarks.bench_chunking_strategies --corpus docs/ --qa docs/qa.jsonl --models all-MiniLM-L6-v2 all-mpnet-base-v2
+    python -m benchmarks.bench_chunking_strategies --methods token sentence --chunk-size 128 --overlap 32 --output results.json
+"""
+import argparse
+import json
+import os
+import random
+import re
+import statistics
+import tempfile
+import time
+from typing import Any, Dict, List, Sequence, Tuple
+
+FIRST_NAMES = ["Asha", "Bikram", "Chen", "Dolma", "Elena", "Farid", "Gita", "Hiro", "Ines", "Jonas", "Kamala", "Luis"]
+LAST_NAMES = ["Adhikari", "Berg", "Castillo", "Dahal", "Eriksen", "Fujita", "Gurung", "Haddad", "Ito", "Jensen"]
+MONTHS = ["January", "February", "March", "April", "May", "June", "July", "August", "September", "October", "November", "December"]
+CITIES = ["Kathmandu", "Pokhara", "Lisbon", "Osaka", "Lima", "Oslo", "Nairobi", "Hanoi"]
+
+# (fact sentence, question, answer passage), filled with the same values
+FACT_TEMPLATES = [
+    ("The {code} project was approved by {name} in {month}.", "Who approved the {code} project?", "{code} project was approved by {name}"),
+    ("Support for contract {code} moved to the {city} office last year.", "Which office handles contract {code}?", "contract {code} moved to the {city} office"),
+    ("The audit of account {code} found {count} missing invoices.", "How many invoices were missing in the {code} audit?",
+     "account {code} found {count} missing invoices"),
+    ("Release {code} is owned by {name}, who signs off every change.", "Who owns release {code}?", "Release {code} is owned by {name}"),
+]
+
+_spaces = re.compile(r"\s+")
+
+
+def normalize(text: str) -> str:
+    return _spaces.sub(" ", text).strip().lower()
+
+
+def synthetic_corpus(documents: int, words: int, facts: int, rng: random.Random) -> Tuple[List[str], List[Dict[str, str]]]:
+    """Documents of filler paragraphs with facts written between their sentences, and a question per fact"""
+    from benchmarks.suite import make_text
+
+    sentences = [make_text(words, rng).split("\n") for _ in range(documents)]
+    qa = []
+    for i in range(facts):
+        sentence, question, answer = rng.choice(FACT_TEMPLATES)
+        values = {
+            "code": f"{rng.choice('ABCDEFGHJKLMNPQRSTUVWXYZ')}{rng.choice('ABCDEFGHJKLMNPQRSTUVWXYZ')}-{1000 + i}",
+            "name": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+            "month": rng.choice(MONTHS),
+            "city": rng.choice(CITIES),
+            "count": str(rng.randint(2, 99)),
+        }
+        document = sentences[rng.randrange(documents)]
+        document.insert(rng.randrange(len(document) + 1), sentence.format(**values))
+        qa.append({"question": question.format(**values), "answer": answer.format(**values)})
+
+    texts = []
+    for document in sentences:
+        # a blank line every few sentences, so the recursive strategy sees paragraphs
+        paragraphs = []
+        start = 0
+        while start < len(document):
+            size = rng.randint(3, 12)
+            paragraphs.append(" ".join(document[start:start + size]))
+            start += size
+        texts.append("\n\n".join(paragraphs))
+    return texts, qa
+
+
+def load_corpus(paths: Sequence[str]) -> List[List[str]]:
+    """Text of every .pdf and .txt document under `paths`, as lists of pieces (pages) for the streaming chunkers"""
+    from services.extract_text import iter_text_from_pdf, iter_text_from_txt
+
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(root, name) for root, _, names in os.walk(path) for name in sorted(names))
+        else:
+            files.append(path)
+    documents = []
+    for path in files:
+        if path.lower().endswith(".pdf"):
+            documents.append(list(iter_text_from_pdf(path)))
+        elif path.lower().endswith(".txt"):
+            with open(path, "rb") as file:
+                documents.append(list(iter_text_from_txt(file)))
+    return documents
+
+
+def load_qa(path: str) -> List[Dict[str, str]]:
+    with open(path, encoding="utf-8") as file:
+        qa = [json.loads(line) for line in file if line.strip()]
+    for item in qa:
+        if not item.get("question") or not item.get("answer"):
+            raise ValueError(f"{path}: every line needs a question and an answer, got {item}")
+    return qa
+
+
+def relevant_rows(chunks: List[str], answers: List[str]) -> List[set]:
+    """Rows of the chunks holding each answer passage"""
+    normalized = [normalize(chunk) for chunk in chunks]
+    return [{row for row, chunk in enumerate(normalized) if normalize(answer) in chunk} for answer in answers]
+
+
+def evaluate(method: str, chunks: List[str], chunk_seconds: float, corpus_bytes: int, qa: List[Dict[str, str]], model: str,
+             ks: List[int], workdir: str) -> Dict[str, Any]:
+    from services.embedding_engine import encode_documents, encode_queries
+    from services.vector_store import LocalVectorStore
+
+    relevant = relevant_rows(chunks, [item["answer"] for item in qa])
+    ids = [f"chunk-{row}" for row in range(len(chunks))]
+
+    start = time.perf_counter()
+    vectors = encode_documents(chunks, model_name=model)
+    store = LocalVectorStore(os.path.join(workdir, f"{model.replace('/', '_')}-{method}"), dimension=vectors.shape[1])
+    store.upsert(ids, vectors, [{"chunk_index": row} for row in range(len(chunks))])
+    ingest_seconds = chunk_seconds + time.perf_counter() - start
+
+    # one query at a time, as the /chat path embeds and searches them
+    encode_queries([qa[0]["question"]], model_name=model)
+    ranks = []
+    latencies = []
+    depth = max(ks)
+    for item, rows in zip(qa, relevant):
+        start = time.perf_counter()
+        embedding = encode_queries([item["question"]], model_name=model)[0]
+        matches = store.query(embedding, top_k=depth)
+        latencies.append(time.perf_counter() - start)
+        found = [int(match.id.split("-")[1]) for match in matches]
+        # 0 when no relevant chunk is in the results
+        ranks.append(next((rank for rank, row in enumerate(found, start=1) if row in rows), 0))
+    latencies.sort()
+
+    words = [len(chunk.split()) for chunk in chunks]
+    result = {
+        "method": method,
+        "model": model,
+        "chunks": len(chunks),
+        "mean_chunk_words": round(statistics.mean(words), 1) if words else 0,
+        "answerable": sum(bool(rows) for rows in relevant) / len(qa),
+        "mrr": sum(1 / rank for rank in ranks if rank) / len(qa),
+        "chunk_kb_per_s": corpus_bytes / 1024 / chunk_seconds if chunk_seconds else 0.0,
+        "ingest_kb_per_s": corpus_bytes / 1024 / ingest_seconds,
+        "query_p50_ms": statistics.median(latencies) * 1000,
+        "query_p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000,
+    }
+    for k in ks:
+        result[f"recall@{k}"] = sum(0 < rank <= k for rank in ranks) / len(qa)
+    return result
+
+
+def main():
+    from services.chunk_text import CHUNKERS, DEFAULT_TOKENIZER_MODEL, iter_chunks
+    from services.embedding_engine import DEFAULT_EMBEDDING_MODEL
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", nargs="*", default=[], help=".pdf and .txt documents, or directories of them")
+    parser.add_argument("--qa", help="JSONL question/answer set over the corpus; synthetic facts when omitted")
+    parser.add_argument("--methods", nargs="+", default=sorted(CHUNKERS), choices=sorted(CHUNKERS))
+    parser.add_argument("--models", nargs="+", default=[DEFAULT_EMBEDDING_MODEL], help="sentence-transformers embedding models")
+    parser.add_argument("--tokenizer", default=DEFAULT_TOKENIZER_MODEL, help="tokenizer counting chunk sizes")
+    parser.add_argument("--chunk-size", type=int, default=200)
+    parser.add_argument("--overlap", type=int, default=50)
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 3, 5, 10])
+    parser.add_argument("--synthetic-documents", type=int, default=40)
+    parser.add_argument("--synthetic-words", type=int, default=2000)
+    parser.add_argument("--synthetic-facts", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="also write the results as JSON")
+    args = parser.parse_args()
+    if args.qa and not args.corpus:
+        parser.error("--qa needs the --corpus it was written for")
+
+    os.environ.setdefault("HF_HUB_OFFLINE", "1")
+    rng = random.Random(args.seed)
+    documents = load_corpus(args.corpus)
+    if args.qa:
+        qa = load_qa(args.qa)
+    else:
+        texts, qa = synthetic_corpus(args.synthetic_documents, args.synthetic_words, args.synthetic_facts, rng)
+        documents = [[text] for text in texts] + documents
+    corpus_bytes = sum(len(piece.encode("utf-8")) for pieces in documents for piece in pieces)
+    print(f"{len(documents)} documents ({corpus_bytes / 1024:.0f} KB), {len(qa)} questions, "
+          f"chunks of {args.chunk_size} tokens with {args.overlap} overlap\n")
+
+    workdir = tempfile.mkdtemp(prefix="bench_chunking_")
+    results = []
+    header = (f"{'method':<10} {'model':<24}{'chunks':>8}{'answerable':>11}" + "".join(f"{f'recall@{k}':>11}" for k in args.k)
+              + f"{'MRR':>7}{'ingest KB/s':>13}{'p50 ms':>9}{'p95 ms':>9}")
+    print(header)
+    for method in args.methods:
+        start = time.perf_counter()
+        chunks = [chunk for pieces in documents
+                  for chunk in iter_chunks(pieces, method, model=args.tokenizer, chunk_size=args.chunk_size, overlap=args.overlap)]
+        chunk_seconds = time.perf_counter() - start
+        for model in args.models:
+            result = evaluate(method, chunks, chunk_seconds, corpus_bytes, qa, model, args.k, workdir)
+            results.append(result)
+            recalls = "".join(f"{result[f'recall@{k}']:>11.3f}" for k in args.k)
+            print(f"{method:<10} {model[-24:]:<24}{result['chunks']:>8}{result['answerable']:>11.3f}{recalls}{result['mrr']:>7.3f}"
+                  f"{result['ingest_kb_per_s']:>13.1f}{result['query_p50_ms']:>9.2f}{result['query_p95_ms']:>9.2f}")
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"args": vars(args), "corpus_kb": corpus_bytes / 1024, "questions": len(qa), "results": results}, file, indent=2)
+        print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Benchmark the prompt size of long chat sessions: the last 5 full turns (as /chat did before)
+against the token-budgeted context with a rolling summary.
+
+For every turn it reports the prompt tokens of both, the time to build the budgeted context and
+the time of the summary update that follows the turn. With --llm both prompts are also sent to
+the configured LLM client and its latency is reported (LLM_BACKEND=stub only measures overhead).
+
+Usage:
+    python -m benchmarks.bench_conversation_context --turns 40 --summary-mode extractive
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from typing import Any, Dict, List, Optional
+
+from services.conversation_context import ConversationContextBuilder
+from services.llm_client import get_llm_client
+
+WORDS = (
+    "the interview process includes a technical round and a final discussion with the team "
+    "Kathmandu Nepal documents retrieval embeddings vector database tokenization 2024 results "
+    "according to the report revenue grew while the project timeline moved to the next quarter"
+).split()
+
+LEGACY_TURNS = 5
+MAX_MESSAGES = 20
+
+
+def sentence(rng: random.Random, n_words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(n_words)).capitalize() + "."
+
+
+def make_turn(rng: random.Random, answer_words: int) -> Dict[str, Any]:
+    answer = " ".join(sentence(rng, rng.randint(10, 20)) for _ in range(max(answer_words // 15, 1)))
+    return {"user_query": sentence(rng, rng.randint(8, 20)).rstrip(".") + "?", "response": answer}
+
+
+def legacy_context(messages: List[Dict[str, Any]]) -> str:
+    """RedisService._format_context over the last 5 turns, as /chat used it"""
+    recent = messages[-LEGACY_TURNS:]
+    if not recent:
+        return ""
+    context = "Previous conversation:\n"
+    for msg in recent:
+        context += f"User: {msg['user_query']}\n"
+        context += f"Assistant: {msg['response']}\n\n"
+    return context.strip()
+
+
+def enhanced_query(query: str, context: str) -> str:
+    return f"Context: {context}\n\nCurrent question: {query}" if context else query
+
+
+async def timed_llm(prompt: str) -> float:
+    start = time.perf_counter()
+    await get_llm_client().ainvoke(prompt)
+    return time.perf_counter() - start
+
+
+async def run(args) -> None:
+    rng = random.Random(args.seed)
+    builder = ConversationContextBuilder(token_budget=args.budget, summary_tokens=args.summary_tokens, summary_mode=args.summary_mode)
+    # warm the tokenizer so turn 1 does not pay for loading it
+    builder.count_tokens("warm up")
+
+    messages: List[Dict[str, Any]] = []
+    record: Optional[Dict[str, Any]] = None
+    rows = []
+    header = f"{'turn':>5} {'legacy tok':>11} {'budget tok':>11} {'build ms':>9} {'summary ms':>11}"
+    if args.llm:
+        header += f" {'legacy llm ms':>14} {'budget llm ms':>14}"
+    print(header)
+
+    for turn in range(1, args.turns + 1):
+        query = make_turn(rng, 0)["user_query"]
+        legacy_prompt = enhanced_query(query, legacy_context(messages))
+
+        start = time.perf_counter()
+        budget_prompt = enhanced_query(query, builder.compose(messages, record))
+        build_ms = (time.perf_counter() - start) * 1000
+
+        row = [turn, builder.count_tokens(legacy_prompt), builder.count_tokens(budget_prompt), build_ms]
+        if args.llm:
+            row += [await timed_llm(legacy_prompt) * 1000, await timed_llm(budget_prompt) * 1000]
+
+        # the turn is stored (trimmed like the Redis list) and the summary is updated, as after a /chat response
+        messages.append({**make_turn(rng, rng.randint(args.answer_words // 2, args.answer_words)), "timestamp": float(turn)})
+        messages = messages[-MAX_MESSAGES:]
+        start = time.perf_counter()
+        record = await builder.afold(messages, record) or record
+        summary_ms = (time.perf_counter() - start) * 1000
+        row.insert(4, summary_ms)
+        rows.append(row)
+
+        line = f"{row[0]:>5} {row[1]:>11} {row[2]:>11} {row[3]:>9.2f} {row[4]:>11.2f}"
+        if args.llm:
+            line += f" {row[5]:>14.1f} {row[6]:>14.1f}"
+        print(line)
+
+    tail = rows[len(rows) // 2:]
+    print(f"\nsecond half of the session: legacy {statistics.mean(r[1] for r in tail):.0f} tokens/turn, "
+          f"budgeted {statistics.mean(r[2] for r in tail):.0f} tokens/turn (max {max(r[2] for r in rows)}, budget {args.budget} + query)")
+    if args.llm:
+        print(f"LLM latency: legacy {statistics.mean(r[5] for r in tail):.1f} ms, budgeted {statistics.mean(r[6] for r in tail):.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=40)
+    parser.add_argument("--answer-words", type=int, default=250, help="longest assistant answer, in words")
+    parser.add_argument("--budget", type=int, default=800)
+    parser.add_argument("--summary-tokens", type=int, default=200)
+    parser.add_argument("--summary-mode", choices=["extractive", "llm"], default="extractive")
+    parser.add_argument("--llm", action="store_true", help="also time both prompts against the configured LLM client")
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Cold import time of the application: `import main` in a fresh interpreter, as a worker does on boot.
+
+Each run starts a new process with `python -X importtime`, so nothing is cached in memory (the OS
+file cache stays warm after the first run). Reports the median wall time, the slowest modules by
+cumulative import time and which heavy modules, which should only be loaded at warmup, were
+imported. Exits with status 1 when the median exceeds --max-seconds or a heavy module was imported.
+
+Usage:
+    python -m benchmarks.bench_import_time --repeat 5 --max-seconds 3
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+# loaded by the warmup (or the first request that needs them), never by importing the application
+HEAVY_MODULES = ["torch", "sentence_transformers", "transformers", "langgraph", "langchain_google_genai", "pinecone"]
+
+PROBE = """
+import sys, time
+start = time.perf_counter()
+import {module}
+print("WALL", time.perf_counter() - start)
+print("LOADED", " ".join(name for name in {heavy!r} if name in sys.modules))
+"""
+
+
+def run_once(module: str) -> Tuple[float, List[str], Dict[str, int]]:
+    """Wall time, heavy modules loaded and cumulative import time (us) per module of one cold import"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE.format(module=module, heavy=HEAVY_MODULES)],
+        capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+    wall = 0.0
+    loaded: List[str] = []
+    for line in result.stdout.splitlines():
+        if line.startswith("WALL "):
+            wall = float(line.split()[1])
+        elif line.startswith("LOADED"):
+            loaded = line.split()[1:]
+    cumulative: Dict[str, int] = {}
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        cumulative[name.strip()] = int(cumulative_us)
+    return wall, loaded, cumulative
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the cold import time of the application")
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="slowest modules to list")
+    parser.add_argument("--max-seconds", type=float, help="fail when the median import time is above this")
+    args = parser.parse_args()
+
+    walls = []
+    loaded: List[str] = []
+    cumulative: Dict[str, int] = {}
+    for _ in range(args.repeat):
+        wall, loaded, cumulative = run_once(args.module)
+        walls.append(wall)
+
+    median = statistics.median(walls)
+    print(f"import {args.module}: median {median:.3f}s, min {min(walls):.3f}s, max {max(walls):.3f}s over {args.repeat} runs")
+    print(f"\nSlowest imports (cumulative, last run):")
+    for name, us in sorted(cumulative.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+        print(f"  {us / 1e6:8.3f}s  {name}")
+    print(f"\nHeavy modules imported: {', '.join(loaded) if loaded else 'none'}")
+
+    failed = bool(loaded)
+    if args.max_seconds is not None and median > args.max_seconds:
+        print(f"Import time {median:.3f}s is above the limit of {args.max_seconds:.3f}s")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
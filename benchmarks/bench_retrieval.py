@@ -0,0 +1,142 @@
+"""
+Recall and latency of dense, lexical (BM25) and hybrid (reciprocal rank fusion) retrieval.
+
+The corpus is chunked like an upload: the given documents (by default the bundled PDF) plus
+synthetic filler documents as distractors. Unique reference codes such as "QX-48213" are
+written into some chunks. Each query has exactly one relevant chunk:
+- identifier: a question about one of the reference codes
+- passage: a few words from a chunk of the given documents, with some left out
+
+Chunks go to a local vector store and lexical index in a temporary directory, so the benchmark
+needs no network access. The embedding model and tokenizer must already be in the Hugging Face
+cache. Recall@k is the share of queries whose chunk is among the first k results. Latency
+excludes embedding the query, which is reported separately.
+
+Usage:
+    python -m benchmarks.bench_retrieval
+    python -m benchmarks.bench_retrieval --corpus docs/a.pdf docs/b.txt --filler-documents 200 --queries 300
+"""
+import argparse
+import os
+import random
+import statistics
+import string
+import tempfile
+import time
+from typing import Dict, List, Sequence, Tuple
+
+MODES = ("dense", "lexical", "hybrid")
+
+DEFAULT_CORPUS = ["Assessment_Documentation-PalmMind.pdf"]
+
+
+def reference_code(rng: random.Random) -> str:
+    return f"{rng.choice(string.ascii_uppercase)}{rng.choice(string.ascii_uppercase)}-{rng.randint(10000, 99999)}"
+
+
+def load_chunks(paths: Sequence[str], filler_documents: int, filler_words: int, rng: random.Random) -> Tuple[List[str], int]:
+    """Chunks of the documents followed by the filler chunks; returns (chunks, number of document chunks)"""
+    from benchmarks.suite import make_text
+    from services.chunk_text import iter_chunks_by_tokens
+    from services.extract_text import iter_text_from_pdf, iter_text_from_txt
+
+    chunks: List[str] = []
+    for path in paths:
+        if path.lower().endswith(".pdf"):
+            chunks.extend(iter_chunks_by_tokens(iter_text_from_pdf(path)))
+        else:
+            with open(path, "rb") as file:
+                chunks.extend(iter_chunks_by_tokens(iter_text_from_txt(file)))
+    document_chunks = len(chunks)
+    for _ in range(filler_documents):
+        chunks.extend(iter_chunks_by_tokens([make_text(filler_words, rng)]))
+    return chunks, document_chunks
+
+
+def make_queries(chunks: List[str], document_chunks: int, n_queries: int, rng: random.Random) -> List[Tuple[str, str, int]]:
+    """(kind, query, relevant chunk) triples; writes the reference codes into `chunks`"""
+    queries = []
+    for row in rng.sample(range(len(chunks)), min(n_queries // 2, len(chunks))):
+        code = reference_code(rng)
+        chunks[row] = f"{chunks[row]} Reference {code} applies to this section."
+        queries.append(("identifier", f"What does reference {code} say?", row))
+    for _ in range(n_queries - len(queries)):
+        row = rng.randrange(document_chunks)
+        words = chunks[row].split()
+        if len(words) < 12:
+            continue
+        start = rng.randrange(len(words) - 10)
+        span = words[start:start + 10]
+        for _ in range(2):
+            span.pop(rng.randrange(len(span)))
+        queries.append(("passage", " ".join(span), row))
+    return queries
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", nargs="*", default=DEFAULT_CORPUS, help=".pdf and .txt documents")
+    parser.add_argument("--filler-documents", type=int, default=100)
+    parser.add_argument("--filler-words", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 2, 5, 10])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_retrieval_")
+    # read by the stores when they are first used
+    os.environ["VECTOR_STORE_BACKEND"] = "local"
+    os.environ["LOCAL_VECTOR_STORE_PATH"] = os.path.join(workdir, "vector_store")
+    os.environ["LEXICAL_INDEX_PATH"] = os.path.join(workdir, "lexical_index")
+    os.environ.setdefault("HF_HUB_OFFLINE", "1")
+
+    from services.embedding_engine import encode_documents, encode_queries
+    from services.lexical_index import get_lexical_index
+    from services.retrieval import retrieve
+    from services.vector_store import get_vector_store
+
+    rng = random.Random(args.seed)
+    chunks, document_chunks = load_chunks(args.corpus, args.filler_documents, args.filler_words, rng)
+    queries = make_queries(chunks, document_chunks, args.queries, rng)
+    ids = [f"chunk-{row}" for row in range(len(chunks))]
+    metadata = [{"chunk_uuid": id, "chunk_index": row} for row, id in enumerate(ids)]
+    print(f"{len(chunks)} chunks ({document_chunks} from the corpus), {len(queries)} queries")
+
+    start = time.perf_counter()
+    get_vector_store().upsert(ids, encode_documents(chunks), metadata)
+    print(f"Embedded and stored in {time.perf_counter() - start:.1f}s")
+    start = time.perf_counter()
+    get_lexical_index().upsert(ids, chunks, metadata)
+    print(f"Lexical index built in {time.perf_counter() - start:.2f}s")
+
+    start = time.perf_counter()
+    embeddings = encode_queries([query for _, query, _ in queries])
+    print(f"Query embedding: {(time.perf_counter() - start) / len(queries) * 1000:.2f}ms per query\n")
+
+    depth = max(args.k)
+    kinds = sorted({kind for kind, _, _ in queries})
+    header = f"{'mode':<8} {'queries':<11}" + "".join(f"{f'recall@{k}':>11}" for k in args.k) + f"{'MRR':>7}{'p50 ms':>9}{'p95 ms':>9}"
+    print(header)
+    for mode in MODES:
+        ranks: Dict[str, List[int]] = {kind: [] for kind in kinds}
+        latencies: List[float] = []
+        for (kind, query, row), embedding in zip(queries, embeddings):
+            start = time.perf_counter()
+            matches = retrieve(query, embedding, depth, mode=mode)
+            latencies.append(time.perf_counter() - start)
+            found = [match.id for match in matches]
+            # 0 when the relevant chunk is not in the results
+            ranks[kind].append(found.index(ids[row]) + 1 if ids[row] in found else 0)
+        latencies.sort()
+        p50 = statistics.median(latencies) * 1000
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000
+        for kind in kinds + ["all"]:
+            kind_ranks = [rank for values in ranks.values() for rank in values] if kind == "all" else ranks[kind]
+            recalls = "".join(f"{sum(0 < rank <= k for rank in kind_ranks) / len(kind_ranks):>11.3f}" for k in args.k)
+            mrr = sum(1 / rank for rank in kind_ranks if rank) / len(kind_ranks)
+            timing = f"{p50:>9.2f}{p95:>9.2f}" if kind == "all" else ""
+            print(f"{mode:<8} {kind:<11}{recalls}{mrr:>7.3f}{timing}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Offline environment for the benchmark suite: a local stand-in for every external service.
+
+- Gemini: the stub chat model (LLM_BACKEND=stub)
+- Pinecone: LocalVectorStore in the work directory (VECTOR_STORE_BACKEND=local), next to the
+  lexical index
+- Redis: fakeredis when it is installed, otherwise RedisService's in-memory fallback
+- Postgres: a throwaway server in the work directory started with pgserver when it is installed,
+  otherwise the (local) database in BENCH_POSTGRES_URI
+- Hugging Face: HF_HUB_OFFLINE=1, the embedding model and tokenizer must be in the local cache
+
+setup() must run before anything from the application is imported.
+"""
+import os
+from typing import Dict
+
+try:
+    import fakeredis
+except ImportError:  # optional, the in-memory fallback is used without it
+    fakeredis = None
+
+try:
+    import pgserver
+except ImportError:  # optional, BENCH_POSTGRES_URI is used without it
+    pgserver = None
+
+# the chunks table is not created by the application (see the README schema)
+CHUNKS_SQL = """
+    CREATE TABLE IF NOT EXISTS chunks (
+        chunk_id UUID PRIMARY KEY,
+        document_id UUID,
+        chunk_index INTEGER,
+        chunk_text TEXT NOT NULL,
+        embedding_model TEXT NOT NULL,
+        chunking_method TEXT NOT NULL,
+        chunk_hash TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+"""
+
+_postgres_server = None
+
+
+def _install_fake_redis() -> None:
+    import redis
+    import redis.asyncio as aioredis
+
+    server = fakeredis.FakeServer()
+
+    def sync_client(**kwargs):
+        # RedisService passes decode_responses, the semantic cache's seeding client a connection pool
+        pool = kwargs.get("connection_pool")
+        decode = pool.connection_kwargs.get("decode_responses", False) if pool is not None else kwargs.get("decode_responses", False)
+        return fakeredis.FakeRedis(server=server, decode_responses=decode)
+
+    redis.Redis = sync_client
+    aioredis.Redis = lambda **kwargs: fakeredis.aioredis.FakeRedis(server=server, decode_responses=kwargs.get("decode_responses", False))
+
+
+def _start_postgres(workdir: str) -> str:
+    global _postgres_server
+    uri = os.getenv("BENCH_POSTGRES_URI")
+    if uri:
+        return uri
+    if pgserver is None:
+        raise RuntimeError("install pgserver or set BENCH_POSTGRES_URI to a local database")
+    _postgres_server = pgserver.get_server(os.path.join(workdir, "pgdata"), cleanup_mode="stop")
+    return _postgres_server.get_uri()
+
+
+def setup(workdir: str, redis_backend: str = "auto") -> Dict[str, str]:
+    """Point the application at local stand-ins; returns the backend used for each service"""
+    os.makedirs(workdir, exist_ok=True)
+    backends = {"llm": "stub", "vector_store": "local"}
+
+    os.environ["LLM_BACKEND"] = "stub"
+    os.environ["VECTOR_STORE_BACKEND"] = "local"
+    os.environ["LOCAL_VECTOR_STORE_PATH"] = os.path.join(workdir, "vector_store")
+    os.environ["LEXICAL_INDEX_PATH"] = os.path.join(workdir, "lexical_index")
+    os.environ["INGEST_WORKER_MODE"] = "local"
+    os.environ["INGEST_SPOOL_DIR"] = os.path.join(workdir, "uploads")
+    os.environ["MAILER_MODE"] = "external"
+    os.environ.setdefault("HF_HUB_OFFLINE", "1")
+    os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+
+    if redis_backend == "auto":
+        redis_backend = "fakeredis" if fakeredis is not None else "memory"
+    if redis_backend == "fakeredis":
+        if fakeredis is None:
+            raise RuntimeError("fakeredis is not installed")
+        _install_fake_redis()
+    elif redis_backend == "memory":
+        # nothing listens there: RedisService falls back to in-memory storage at once
+        os.environ["REDIS_HOST"] = "127.0.0.1"
+        os.environ["REDIS_PORT"] = "1"
+    backends["redis"] = redis_backend
+
+    os.environ["POSTGRES_URI"] = _start_postgres(workdir)
+    backends["postgres"] = "BENCH_POSTGRES_URI" if os.getenv("BENCH_POSTGRES_URI") else "pgserver"
+
+    from database.db_conn import get_raw_connection, init_db
+    from database.documents import ensure_schema
+
+    with get_raw_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(CHUNKS_SQL)
+        conn.commit()
+    ensure_schema()
+    init_db()
+    return backends
@@ -0,0 +1,459 @@
+"""
+Offline benchmark suite: every pipeline stage on its own, then /upload and /chat under concurrent load.
+
+External services are replaced by local stand-ins (see benchmarks/offline.py), so the suite needs
+no network. Results are written as JSON: metrics ending in `_ms` are latencies (lower is better),
+metrics ending in `_per_s` are throughputs (higher is better). With --baseline the run is compared
+with a saved result and changes beyond --threshold are reported as regressions.
+
+Usage:
+    python -m benchmarks.suite --output benchmarks/results/latest.json
+    python -m benchmarks.suite --baseline benchmarks/results/baseline.json --fail-on-regression
+    python -m benchmarks.suite --stages chunk embed vector --save-baseline benchmarks/results/baseline.json
+    python -m benchmarks.suite --compare benchmarks/results/baseline.json benchmarks/results/latest.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from benchmarks import offline
+
+WORDS = (
+    "the selection process includes a technical round and a final discussion with the team "
+    "Kathmandu Nepal documents retrieval embeddings vector database tokenization 2024 results "
+    "according to the report revenue grew while the project timeline moved to the next quarter "
+    "customers pricing benefits requirements history company founded mountains rivers climate"
+).split()
+
+DEFAULT_PDF = "Assessment_Documentation-PalmMind.pdf"
+
+
+def make_text(n_words: int, rng: random.Random) -> str:
+    lines = []
+    for start in range(0, n_words, 12):
+        lines.append(" ".join(rng.choice(WORDS) for _ in range(min(12, n_words - start))).capitalize() + ".")
+    return "\n".join(lines)
+
+
+def make_question(rng: random.Random) -> str:
+    return f"What does the document say about {' '.join(rng.choice(WORDS) for _ in range(5))}?"
+
+
+def percentiles(samples_s: Sequence[float], prefix: str) -> Dict[str, float]:
+    """p50/p95 of durations in seconds, as `<prefix>_p50_ms` and `<prefix>_p95_ms`"""
+    ordered = sorted(samples_s)
+    if not ordered:
+        return {}
+    p95 = ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))]
+    return {f"{prefix}_p50_ms": round(statistics.median(ordered) * 1000, 3), f"{prefix}_p95_ms": round(p95 * 1000, 3)}
+
+
+def timed(fn: Callable[[], Any], repeat: int, warmup: int = 1) -> List[float]:
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+async def atimed(fn: Callable[[], Awaitable[Any]], repeat: int, warmup: int = 1) -> List[float]:
+    for _ in range(warmup):
+        await fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+async def load(send: Callable[[Any], Awaitable[Any]], payloads: Sequence[Any], concurrency: int) -> Tuple[List[float], float, List[Any]]:
+    """Send payloads from `concurrency` concurrent clients; (latencies, wall time, results in payload order)"""
+    queue: asyncio.Queue = asyncio.Queue()
+    for i, payload in enumerate(payloads):
+        queue.put_nowait((i, payload))
+    latencies: List[float] = []
+    results: List[Any] = [None] * len(payloads)
+
+    async def client() -> None:
+        while not queue.empty():
+            i, payload = queue.get_nowait()
+            start = time.perf_counter()
+            results[i] = await send(payload)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return latencies, time.perf_counter() - start, results
+
+
+# Stages: each returns {metric: value}
+
+
+def bench_pdf(args) -> Dict[str, Any]:
+    from services.extract_text import iter_pdf_pages
+
+    pages = list(iter_pdf_pages(args.pdf))
+    samples = timed(lambda: list(iter_pdf_pages(args.pdf)), args.repeat)
+    return {"pages": len(pages), **percentiles(samples, "extract"), "pages_per_s": round(len(pages) / statistics.median(samples), 1)}
+
+
+def bench_chunk(args) -> Dict[str, Any]:
+    from services.chunk_text import chunk_text_by_tokens
+
+    text = make_text(args.words, random.Random(args.seed))
+    chunks = chunk_text_by_tokens(text)
+    samples = timed(lambda: chunk_text_by_tokens(text), args.repeat)
+    return {"words": args.words, "chunks": len(chunks), **percentiles(samples, "chunk"),
+            "words_per_s": round(args.words / statistics.median(samples), 1)}
+
+
+def bench_embed(args) -> Dict[str, Any]:
+    from services.chunk_text import chunk_text_by_tokens
+    from services.embedding_engine import encode_documents, encode_queries
+    from services.query_batcher import query_batcher
+
+    rng = random.Random(args.seed)
+    chunks = chunk_text_by_tokens(make_text(args.embed_chunks * 150, rng))[:args.embed_chunks]
+    documents = timed(lambda: encode_documents(chunks), args.repeat)
+    query = make_question(rng)
+    single = timed(lambda: encode_queries([query]), args.repeat * 10)
+
+    questions = [make_question(rng) for _ in range(args.requests)]
+
+    async def batched() -> float:
+        start = time.perf_counter()
+        await asyncio.gather(*(query_batcher.aencode(question) for question in questions))
+        return time.perf_counter() - start
+
+    batched_time = min(asyncio.run(batched()) for _ in range(args.repeat))
+    return {
+        "chunks": len(chunks),
+        **percentiles(documents, "documents"),
+        "document_chunks_per_s": round(len(chunks) / statistics.median(documents), 1),
+        **percentiles(single, "query"),
+        "batched_queries_per_s": round(len(questions) / batched_time, 1)
+    }
+
+
+def bench_vector(args) -> Dict[str, Any]:
+    from services.vector_store import LocalVectorStore
+
+    rng = np.random.default_rng(args.seed)
+    vectors = rng.standard_normal((args.vectors, 384)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    ids = [str(uuid.UUID(int=i)) for i in range(args.vectors)]
+    metadata = [{"document_id": "bench", "chunk_uuid": chunk_id} for chunk_id in ids]
+
+    with tempfile.TemporaryDirectory() as path:
+        store = LocalVectorStore(path)
+        start = time.perf_counter()
+        for i in range(0, args.vectors, 1000):
+            store.upsert(ids[i:i + 1000], vectors[i:i + 1000], metadata[i:i + 1000])
+        upsert_time = time.perf_counter() - start
+        queries = iter(vectors[rng.integers(0, args.vectors, args.repeat * 60 + 1)])
+        samples = timed(lambda: store.query(next(queries), top_k=5), args.repeat * 50)
+        filtered = timed(lambda: store.query(next(queries), top_k=5, filter={"document_id": "bench"}), args.repeat * 10, warmup=0)
+    return {
+        "vectors": args.vectors,
+        "upsert_vectors_per_s": round(args.vectors / upsert_time, 1),
+        **percentiles(samples, "query"),
+        **percentiles(filtered, "filtered_query")
+    }
+
+
+def bench_hydration(args) -> Dict[str, Any]:
+    from database.chunks import insert_chunks
+    from services.chunk_hydration import ChunkTextCache, ahydrate_matches, hydrate_matches
+    from services.vector_store import VectorMatch
+
+    rng = random.Random(args.seed)
+    document_id = str(uuid.uuid4())
+    chunk_ids = [str(uuid.uuid4()) for _ in range(args.hydration_rows)]
+    insert_chunks([(chunk_id, document_id, i, make_text(150, rng), "bench", "token", None) for i, chunk_id in enumerate(chunk_ids)])
+
+    def matches() -> List[VectorMatch]:
+        return [VectorMatch(chunk_id, 0.9, {"chunk_uuid": chunk_id}) for chunk_id in rng.sample(chunk_ids, 2)]
+
+    cold = timed(lambda: hydrate_matches(matches(), cache=ChunkTextCache()), args.repeat * 20)
+    warm_cache = ChunkTextCache()
+    hydrate_matches([VectorMatch(chunk_id, 0.9, {"chunk_uuid": chunk_id}) for chunk_id in chunk_ids], cache=warm_cache)
+    warm = timed(lambda: hydrate_matches(matches(), cache=warm_cache), args.repeat * 20)
+
+    async def async_cold() -> List[float]:
+        return await atimed(lambda: ahydrate_matches(matches(), cache=ChunkTextCache()), args.repeat * 20)
+
+    return {
+        "rows": args.hydration_rows,
+        **percentiles(cold, "cold"),
+        **percentiles(warm, "warm"),
+        **percentiles(asyncio.run(async_cold()), "async_cold")
+    }
+
+
+def bench_cache(args) -> Dict[str, Any]:
+    from services.redis_service import get_redis_service
+
+    redis_service = get_redis_service()
+    rng = random.Random(args.seed)
+    dimension = 384
+    vectors = np.random.default_rng(args.seed).standard_normal((args.cache_entries, dimension)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    queries = [f"{make_question(rng)} #{i}" for i in range(args.cache_entries)]
+    version = redis_service.get_corpus_version()
+
+    start = time.perf_counter()
+    for query, vector in zip(queries, vectors):
+        redis_service.cache_response(query, "cached answer " * 20, 0.9, embedding=vector, corpus_version=version)
+    store_time = time.perf_counter() - start
+
+    picks = iter(rng.randrange(args.cache_entries) for _ in range(10 ** 6))
+    exact_hit = timed(lambda: redis_service.get_cached_response(queries[next(picks)], version), args.repeat * 50)
+    exact_miss = timed(lambda: redis_service.get_cached_response(make_question(rng), version), args.repeat * 50)
+    semantic = timed(lambda: redis_service.find_similar_cached_queries("q", embedding=vectors[next(picks)], corpus_version=version), args.repeat * 50)
+
+    async def chat_cache() -> List[float]:
+        await redis_service.acache_chat_response(queries[0], "", version, "cached answer", "answer_from_documents")
+        return await atimed(lambda: redis_service.aget_chat_response(queries[0], "", version), args.repeat * 50)
+
+    return {
+        "entries": args.cache_entries,
+        "store_entries_per_s": round(args.cache_entries / store_time, 1),
+        **percentiles(exact_hit, "exact_hit"),
+        **percentiles(exact_miss, "exact_miss"),
+        **percentiles(semantic, "semantic_lookup"),
+        **percentiles(asyncio.run(chat_cache()), "chat_cache_hit")
+    }
+
+
+def _client():
+    import httpx
+
+    from main import app
+
+    # requests go straight to the ASGI app, no sockets
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=600)
+
+
+async def _ingest(client, documents: List[Tuple[str, str]], concurrency: int) -> Dict[str, Any]:
+    async def upload(document: Tuple[str, str]) -> Dict[str, Any]:
+        name, text = document
+        response = await client.post("/upload", files={"file": (name, text.encode("utf-8"), "text/plain")})
+        response.raise_for_status()
+        return response.json()
+
+    start = time.perf_counter()
+    accept, _, jobs = await load(upload, documents, concurrency)
+    pending = {job["job_id"] for job in jobs}
+    chunks = 0
+    failed = 0
+    while pending:
+        await asyncio.sleep(0.05)
+        for job_id in list(pending):
+            job = (await client.get(f"/jobs/{job_id}")).json()
+            if job["status"] in ("completed", "failed", "completed_with_errors"):
+                pending.discard(job_id)
+                chunks += job["progress"]["chunks_total"]
+                failed += sum(document["status"] == "failed" for document in job["documents"])
+    elapsed = time.perf_counter() - start
+    return {"accept": accept, "elapsed": elapsed, "chunks": chunks, "failed": failed}
+
+
+def bench_upload(args) -> Dict[str, Any]:
+    rng = random.Random(args.seed)
+    documents = [(f"bench-{uuid.uuid4().hex[:8]}.txt", make_text(args.document_words, rng)) for _ in range(args.documents)]
+
+    async def run() -> Dict[str, Any]:
+        async with _client() as client:
+            return await _ingest(client, documents, args.concurrency)
+
+    result = asyncio.run(run())
+    return {
+        "documents": args.documents,
+        "failed": result["failed"],
+        **percentiles(result["accept"], "accept"),
+        "documents_per_s": round(args.documents / result["elapsed"], 2),
+        "chunks_per_s": round(result["chunks"] / result["elapsed"], 1)
+    }
+
+
+def bench_chat(args) -> Dict[str, Any]:
+    from services.vector_store import get_vector_store
+
+    rng = random.Random(args.seed + 1)
+    questions = [make_question(rng) for _ in range(args.requests)]
+
+    async def run() -> Dict[str, Any]:
+        async with _client() as client:
+            if len(get_vector_store()) == 0:
+                await _ingest(client, [(f"bench-corpus-{i}.txt", make_text(args.document_words, rng)) for i in range(4)], args.concurrency)
+
+            async def ask(question: str) -> int:
+                response = await client.post("/chat", json={"query": question, "session_id": f"bench-{uuid.uuid4().hex}"})
+                return response.status_code
+
+            cold, cold_time, cold_status = await load(ask, questions, args.concurrency)
+            # the same questions again: answered by the response cache at /chat entry
+            cached, cached_time, cached_status = await load(ask, questions, args.concurrency)
+
+            async def first_token(question: str) -> float:
+                start = time.perf_counter()
+                async with client.stream("POST", "/chat/stream", json={"query": question, "session_id": f"bench-{uuid.uuid4().hex}"}) as response:
+                    async for line in response.aiter_lines():
+                        if line.startswith("event: token"):
+                            return time.perf_counter() - start
+                return time.perf_counter() - start
+
+            ttft = [await first_token(make_question(rng)) for _ in range(args.repeat * 3)]
+            return {
+                "requests": len(questions),
+                "concurrency": args.concurrency,
+                "errors": sum(status != 200 for status in cold_status + cached_status),
+                **percentiles(cold, "uncached"),
+                "uncached_requests_per_s": round(len(questions) / cold_time, 2),
+                **percentiles(cached, "cached"),
+                "cached_requests_per_s": round(len(questions) / cached_time, 2),
+                **percentiles(ttft, "stream_first_token")
+            }
+
+    return asyncio.run(run())
+
+
+STAGES: Dict[str, Callable[[Any], Dict[str, Any]]] = {
+    "pdf": bench_pdf,
+    "chunk": bench_chunk,
+    "embed": bench_embed,
+    "vector": bench_vector,
+    "hydration": bench_hydration,
+    "cache": bench_cache,
+    "upload": bench_upload,
+    "chat": bench_chat,
+}
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[Dict[str, Any]]:
+    """Changes of the latency (`_ms`) and throughput (`_per_s`) metrics present in both results"""
+    rows = []
+    for stage, metrics in current["results"].items():
+        for metric, value in metrics.items():
+            before = baseline.get("results", {}).get(stage, {}).get(metric)
+            lower_is_better = metric.endswith("_ms")
+            if not (lower_is_better or metric.endswith("_per_s")) or not isinstance(before, (int, float)) or not before:
+                continue
+            change = (value - before) / before
+            worse = change > threshold if lower_is_better else change < -threshold
+            better = change < -threshold if lower_is_better else change > threshold
+            rows.append({"metric": f"{stage}.{metric}", "baseline": before, "current": value, "change": change,
+                         "status": "REGRESSION" if worse else "improved" if better else "ok"})
+    return rows
+
+
+def print_comparison(rows: List[Dict[str, Any]]) -> None:
+    print(f"\n{'metric':<40} {'baseline':>12} {'current':>12} {'change':>8}  status")
+    for row in rows:
+        print(f"{row['metric']:<40} {row['baseline']:>12.3f} {row['current']:>12.3f} {row['change']:>+7.1%}  {row['status']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stages", nargs="+", choices=list(STAGES), default=list(STAGES))
+    parser.add_argument("--output", default="benchmarks/results/latest.json")
+    parser.add_argument("--baseline", help="saved result to compare with")
+    parser.add_argument("--save-baseline", help="also write the result here")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"), help="only compare two saved results")
+    parser.add_argument("--threshold", type=float, default=0.10, help="relative change reported as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true", help="exit with status 1 on regressions")
+    parser.add_argument("--workdir", help="directory for the local stand-ins (default: a temporary directory)")
+    parser.add_argument("--redis", choices=["auto", "fakeredis", "memory"], default="auto")
+    parser.add_argument("--pdf", default=DEFAULT_PDF)
+    parser.add_argument("--words", type=int, default=100_000)
+    parser.add_argument("--embed-chunks", type=int, default=256)
+    parser.add_argument("--vectors", type=int, default=20_000)
+    parser.add_argument("--hydration-rows", type=int, default=2_000)
+    parser.add_argument("--cache-entries", type=int, default=2_000)
+    parser.add_argument("--documents", type=int, default=20)
+    parser.add_argument("--document-words", type=int, default=5_000)
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            baseline = json.load(f)
+        with open(args.compare[1]) as f:
+            current = json.load(f)
+        rows = compare(current, baseline, args.threshold)
+        print_comparison(rows)
+        sys.exit(1 if args.fail_on_regression and any(row["status"] == "REGRESSION" for row in rows) else 0)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="rag-bench-")
+    backends = offline.setup(workdir, redis_backend=args.redis)
+    print(f"Offline backends: {backends} (work directory {workdir})")
+
+    results: Dict[str, Dict[str, Any]] = {}
+    for stage in args.stages:
+        print(f"\n== {stage}")
+        start = time.perf_counter()
+        try:
+            results[stage] = STAGES[stage](args)
+        except Exception as e:
+            print(f"Stage {stage} failed: {e!r}")
+            results[stage] = {"error": repr(e)}
+        for metric, value in results[stage].items():
+            print(f"  {metric:<32} {value}")
+        print(f"  ({time.perf_counter() - start:.1f}s)")
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "backends": backends,
+            "args": {k: v for k, v in vars(args).items() if k not in ("output", "baseline", "save_baseline", "compare", "workdir")}
+        },
+        "results": results
+    }
+    for path in filter(None, [args.output, args.save_baseline]):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nWrote {path}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            rows = compare(report, json.load(f), args.threshold)
+        print_comparison(rows)
+        if args.fail_on_regression and any(row["status"] == "REGRESSION" for row in rows):
+            sys.exit(1)
+    if any("error" in metrics for metrics in results.values()):
+        sys.exit(2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+import os
+from typing import Dict, List, Sequence, Tuple
+
+from psycopg2.extras import execute_values
+from sqlalchemy import text
+
+from database.db_conn import execute_prepared, get_async_engine, get_raw_connection
+
+INSERT_PAGE_SIZE = int(os.getenv("INSERT_PAGE_SIZE", 500))
+
+# chunk ids are content addressed: an existing chunk only moves to its new position
+INSERT_CHUNKS_SQL = """
+    INSERT INTO chunks (chunk_id, document_id, chunk_index, chunk_text, embedding_model, chunking_method, chunk_hash)
+    VALUES %s
+    ON CONFLICT (chunk_id) DO UPDATE SET chunk_index = EXCLUDED.chunk_index
+"""
+
+FETCH_CHUNK_TEXT_SQL = "SELECT chunk_text FROM chunks WHERE chunk_id = $1"
+
+FETCH_CHUNK_TEXTS_SQL = "SELECT chunk_id::text, chunk_text FROM chunks WHERE chunk_id = ANY($1::uuid[])"
+
+
+def insert_chunk_rows(conn, rows: List[Tuple], page_size: int = INSERT_PAGE_SIZE) -> None:
+    """Insert chunk rows with multi-row INSERT statements inside the caller's transaction"""
+    with conn.cursor() as cursor:
+        execute_values(cursor, INSERT_CHUNKS_SQL, rows, page_size=page_size)
+
+
+def delete_chunk_rows(conn, chunk_ids: Sequence[str]) -> None:
+    """Delete chunk rows by id inside the caller's transaction"""
+    with conn.cursor() as cursor:
+        cursor.execute("DELETE FROM chunks WHERE chunk_id = ANY(%s::uuid[])", (list(chunk_ids),))
+
+
+def fetch_chunk_text(chunk_id: str) -> str:
+    """Text of one chunk, empty when it does not exist"""
+    with get_raw_connection() as conn:
+        cursor = execute_prepared(conn, "fetch_chunk_text", FETCH_CHUNK_TEXT_SQL, (chunk_id,))
+        result = cursor.fetchone()
+        cursor.close()
+        conn.commit()
+    return result[0] if result else ""
+
+
+def fetch_chunk_texts(chunk_ids: Sequence[str]) -> Dict[str, str]:
+    """Texts of several chunks in one round trip, keyed by chunk id; missing chunks are left out"""
+    if not chunk_ids:
+        return {}
+    with get_raw_connection() as conn:
+        # psycopg2 sends a list of str as text[], the statement casts it to uuid[]
+        cursor = execute_prepared(conn, "fetch_chunk_texts", FETCH_CHUNK_TEXTS_SQL, (list(chunk_ids),), ["text[]"])
+        rows = cursor.fetchall()
+        cursor.close()
+        conn.commit()
+    return {chunk_id: chunk_text for chunk_id, chunk_text in rows}
+
+
+async def afetch_chunk_texts(chunk_ids: Sequence[str]) -> Dict[str, str]:
+    """Async variant of fetch_chunk_texts"""
+    if not chunk_ids:
+        return {}
+    async with get_async_engine().connect() as conn:
+        result = await conn.execute(
+            text("SELECT chunk_id::text, chunk_text FROM chunks WHERE chunk_id = ANY(CAST(:chunk_ids AS uuid[]))"),
+            {"chunk_ids": list(chunk_ids)}
+        )
+        return {chunk_id: chunk_text for chunk_id, chunk_text in result.all()}
+
+
+async def afetch_chunk_text(chunk_id: str) -> str:
+    """Async variant of fetch_chunk_text on the asyncpg pool"""
+    async with get_async_engine().connect() as conn:
+        result = await conn.execute(text("SELECT chunk_text FROM chunks WHERE chunk_id = :chunk_id"), {"chunk_id": chunk_id})
+        row = result.first()
+    return row[0] if row else ""
+
+
+def insert_chunks(rows: List[Tuple]) -> None:
+    """Insert (chunk_id, document_id, chunk_index, chunk_text, embedding_model, chunking_method, chunk_hash) rows in one transaction"""
+    with get_raw_connection() as conn:
+        try:
+            insert_chunk_rows(conn, rows)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+
+async def ainsert_chunks(rows: List[Tuple]) -> None:
+    """Async variant of insert_chunks"""
+    statement = text(
+        """
+        INSERT INTO chunks (chunk_id, document_id, chunk_index, chunk_text, embedding_model, chunking_method, chunk_hash)
+        VALUES (:chunk_id, :document_id, :chunk_index, :chunk_text, :embedding_model, :chunking_method, :chunk_hash)
+        ON CONFLICT (chunk_id) DO UPDATE SET chunk_index = EXCLUDED.chunk_index
+        """
+    )
+    keys = ("chunk_id", "document_id", "chunk_index", "chunk_text", "embedding_model", "chunking_method", "chunk_hash")
+    async with get_async_engine().begin() as conn:
+        # executemany on asyncpg reuses one prepared statement for every row
+        await conn.execute(statement, [dict(zip(keys, row)) for row in rows])
@@ -1,16 +1,39 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime
+from contextlib import contextmanager
+from datetime import datetime
+from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
 import os
+import threading
 
 load_dotenv()
 
-postgres_uri = os.getenv("POSTGRES_URI")
-if postgres_uri is None:
-    raise ValueError("POSTGRES_URI environment variable is not set")
 
-engine = create_engine(postgres_uri)
+def _build_postgres_uri():
+    # POSTGRES_URI wins, otherwise build it from the DB_* variables
+    uri = os.getenv("POSTGRES_URI")
+    if uri:
+        return uri
+    parts = [os.getenv(name) for name in ("DB_USER", "DB_PASSWORD", "DB_HOST", "DB_PORT", "DB_NAME")]
+    if all(parts):
+        user, password, host, port, name = parts
+        return f"postgresql://{user}:{password}@{host}:{port}/{name}"
+    return None
+
+
+def _postgres_uri():
+    uri = _build_postgres_uri()
+    if uri is None:
+        raise ValueError("POSTGRES_URI environment variable is not set")
+    return uri
+
+
+# pool settings, shared by the upload and query paths
+pool_size = int(os.getenv("DB_POOL_SIZE", 10))
+max_overflow = int(os.getenv("DB_MAX_OVERFLOW", 10))
+pool_timeout = int(os.getenv("DB_POOL_TIMEOUT", 30))
+pool_recycle = int(os.getenv("DB_POOL_RECYCLE", 1800))
 
 Base = declarative_base()
 
@@ -22,8 +45,137 @@ class Booking(Base):
     date = Column(String)
     time = Column(String)
 
-# engine = create_engine(os.getenv("POSTGRES_URI"))
-SessionLocal = sessionmaker(bind=engine)
+class EmailOutbox(Base):
+    """Emails to send, written in the same transaction as the change they report (drained by services.mailer)"""
+    __tablename__ = 'email_outbox'
+    id = Column(Integer, primary_key=True)
+    # one message per key: a retried write or a re-claimed row never sends twice
+    idempotency_key = Column(String, nullable=False, unique=True)
+    recipient = Column(String)
+    subject = Column(String, nullable=False)
+    body = Column(Text, nullable=False)
+    # pending -> sending -> sent, or failed after the last attempt
+    status = Column(String, nullable=False, default='pending', index=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    claimed_at = Column(DateTime)
+    sent_at = Column(DateTime)
+    last_error = Column(Text)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+# bound to the engine when it is created
+SessionLocal = sessionmaker()
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """Return the process-wide engine and its connection pool, created on first use"""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                engine = create_engine(
+                    _postgres_uri(),
+                    pool_size=pool_size,
+                    max_overflow=max_overflow,
+                    pool_timeout=pool_timeout,
+                    pool_recycle=pool_recycle,
+                    # health check: test each connection on checkout and replace it if the server dropped it
+                    pool_pre_ping=True
+                )
+                SessionLocal.configure(bind=engine)
+                _engine = engine
+    return _engine
+
+
+def get_session():
+    """New ORM session on the shared engine"""
+    get_engine()
+    return SessionLocal()
+
 
 def init_db():
-    Base.metadata.create_all(engine)
+    Base.metadata.create_all(get_engine())
+
+
+_outbox_ready = False
+
+
+def ensure_outbox_table():
+    """Create the email outbox table if it is missing (once per process)"""
+    global _outbox_ready
+    if not _outbox_ready:
+        EmailOutbox.__table__.create(get_engine(), checkfirst=True)
+        _outbox_ready = True
+
+
+@contextmanager
+def get_raw_connection():
+    """Borrow a pooled psycopg2 connection, returned to the pool on exit"""
+    conn = get_engine().raw_connection()
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+def execute_prepared(conn, name, statement, params, param_types=None):
+    """
+    Run `statement` as a server-side prepared statement on a pooled psycopg2 connection.
+
+    The statement is prepared once per physical connection (PREPARE lasts for the session)
+    and executed with EXECUTE afterwards, so repeated queries skip parsing and planning.
+    `param_types` (e.g. ["text[]"]) declares parameter types the server cannot infer.
+    Returns the cursor holding the results.
+    """
+    prepared = conn.info.setdefault("prepared_statements", set())
+    cursor = conn.cursor()
+    if name not in prepared:
+        try:
+            declared = f"({', '.join(param_types)})" if param_types else ""
+            cursor.execute(f"PREPARE {name}{declared} AS {statement}")
+        except Exception:
+            conn.rollback()
+            raise
+        prepared.add(name)
+    placeholders = ", ".join(["%s"] * len(params))
+    cursor.execute(f"EXECUTE {name}({placeholders})", params)
+    return cursor
+
+
+def check_database():
+    """Health check of the pool: True when a connection can run SELECT 1"""
+    try:
+        with get_engine().connect() as conn:
+            conn.execute(text("SELECT 1"))
+        return True
+    except Exception as e:
+        print(f"Database health check failed: {e}")
+        return False
+
+
+_async_engine = None
+
+
+def get_async_engine():
+    """
+    Async engine on the same database (asyncpg driver), created on first use.
+
+    asyncpg prepares statements on the server and caches them per connection.
+    """
+    global _async_engine
+    if _async_engine is None:
+        from sqlalchemy.ext.asyncio import create_async_engine
+
+        async_uri = _postgres_uri().split("://", 1)[1]
+        _async_engine = create_async_engine(
+            f"postgresql+asyncpg://{async_uri}",
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_timeout=pool_timeout,
+            pool_recycle=pool_recycle,
+            pool_pre_ping=True
+        )
+    return _async_engine
@@ -0,0 +1,162 @@
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from psycopg2 import Binary
+from psycopg2.extras import execute_values
+
+from database.db_conn import execute_prepared, get_raw_connection
+
+# idempotent, brings databases created from the original README schema up to date
+SCHEMA_SQL = """
+    ALTER TABLE chunks ADD COLUMN IF NOT EXISTS chunk_hash TEXT;
+    CREATE INDEX IF NOT EXISTS chunks_document_id_idx ON chunks (document_id);
+    CREATE TABLE IF NOT EXISTS documents (
+        document_id UUID PRIMARY KEY,
+        filename TEXT NOT NULL,
+        content_hash TEXT NOT NULL,
+        embedding_model TEXT NOT NULL,
+        num_chunks INTEGER NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    -- a filename identifies a document within its collection
+    ALTER TABLE documents ADD COLUMN IF NOT EXISTS collection TEXT NOT NULL DEFAULT 'default';
+    ALTER TABLE documents DROP CONSTRAINT IF EXISTS documents_filename_key;
+    CREATE UNIQUE INDEX IF NOT EXISTS documents_collection_filename_idx ON documents (collection, filename);
+    -- re-uploading a file with another chunking method re-chunks it
+    ALTER TABLE documents ADD COLUMN IF NOT EXISTS chunking_method TEXT NOT NULL DEFAULT 'token';
+    CREATE TABLE IF NOT EXISTS embedding_cache (
+        embedding_model TEXT NOT NULL,
+        chunk_hash TEXT NOT NULL,
+        embedding BYTEA NOT NULL,
+        PRIMARY KEY (embedding_model, chunk_hash)
+    );
+"""
+
+FETCH_EMBEDDINGS_SQL = "SELECT chunk_hash, embedding FROM embedding_cache WHERE embedding_model = $1 AND chunk_hash = ANY($2)"
+
+_schema_ready = False
+
+
+def ensure_schema() -> None:
+    """Create the document and embedding cache tables (once per process)"""
+    global _schema_ready
+    if _schema_ready:
+        return
+    with get_raw_connection() as conn:
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(SCHEMA_SQL)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    _schema_ready = True
+
+
+def fetch_document(filename: str, collection: str) -> Optional[Dict]:
+    """
+    The stored document with this filename in a collection (document_id, content_hash, embedding_model,
+    chunking_method, num_chunks), or None
+    """
+    with get_raw_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT document_id::text, content_hash, embedding_model, chunking_method, num_chunks FROM documents "
+                "WHERE collection = %s AND filename = %s",
+                (collection, filename)
+            )
+            row = cursor.fetchone()
+        conn.commit()
+    if row is None:
+        return None
+    return dict(zip(("document_id", "content_hash", "embedding_model", "chunking_method", "num_chunks"), row))
+
+
+def fetch_document_chunks(document_id: str) -> Dict[str, int]:
+    """chunk_id -> chunk_index of every stored chunk of a document"""
+    with get_raw_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT chunk_id::text, chunk_index FROM chunks WHERE document_id = %s", (document_id,))
+            rows = cursor.fetchall()
+        conn.commit()
+    return {chunk_id: chunk_index for chunk_id, chunk_index in rows}
+
+
+def upsert_document(conn, document_id: str, filename: str, content_hash: str, embedding_model: str, num_chunks: int,
+                    collection: str, chunking_method: str) -> None:
+    """Record the ingested version of a document inside the caller's transaction"""
+    with conn.cursor() as cursor:
+        cursor.execute(
+            """
+            INSERT INTO documents (document_id, filename, content_hash, embedding_model, num_chunks, collection, chunking_method, updated_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
+            ON CONFLICT (collection, filename) DO UPDATE SET
+                document_id = EXCLUDED.document_id,
+                content_hash = EXCLUDED.content_hash,
+                embedding_model = EXCLUDED.embedding_model,
+                num_chunks = EXCLUDED.num_chunks,
+                chunking_method = EXCLUDED.chunking_method,
+                updated_at = CURRENT_TIMESTAMP
+            """,
+            (document_id, filename, content_hash, embedding_model, num_chunks, collection, chunking_method)
+        )
+        # chunks the new method cut exactly like the old one were kept, not rewritten
+        cursor.execute(
+            "UPDATE chunks SET chunking_method = %s WHERE document_id = %s AND chunking_method <> %s",
+            (chunking_method, document_id, chunking_method)
+        )
+
+
+def delete_collection_rows(conn, collection: str) -> Tuple[int, int]:
+    """Delete the documents of a collection and their chunk rows inside the caller's transaction; (documents, chunks) deleted"""
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "DELETE FROM chunks WHERE document_id IN (SELECT document_id FROM documents WHERE collection = %s)",
+            (collection,)
+        )
+        chunks = cursor.rowcount
+        cursor.execute("DELETE FROM documents WHERE collection = %s", (collection,))
+        return cursor.rowcount, chunks
+
+
+def list_collections() -> List[Dict]:
+    """Every collection holding documents, with its number of documents and chunks"""
+    ensure_schema()
+    with get_raw_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT collection, COUNT(*), COALESCE(SUM(num_chunks), 0) FROM documents GROUP BY collection ORDER BY collection"
+            )
+            rows = cursor.fetchall()
+        conn.commit()
+    return [{"collection": collection, "documents": documents, "chunks": int(chunks)} for collection, documents, chunks in rows]
+
+
+def fetch_embeddings(embedding_model: str, chunk_hashes: Sequence[str]) -> Dict[str, bytes]:
+    """Cached embeddings (raw float32 bytes) of chunk hashes, keyed by hash; misses are left out"""
+    if not chunk_hashes:
+        return {}
+    with get_raw_connection() as conn:
+        cursor = execute_prepared(conn, "fetch_embeddings", FETCH_EMBEDDINGS_SQL, (embedding_model, list(chunk_hashes)), ["text", "text[]"])
+        rows = cursor.fetchall()
+        cursor.close()
+        conn.commit()
+    return {chunk_hash: bytes(embedding) for chunk_hash, embedding in rows}
+
+
+def store_embeddings(embedding_model: str, embeddings: Sequence[Tuple[str, bytes]]) -> None:
+    """Add (chunk_hash, float32 bytes) pairs to the embedding cache"""
+    if not embeddings:
+        return
+    with get_raw_connection() as conn:
+        try:
+            with conn.cursor() as cursor:
+                execute_values(
+                    cursor,
+                    "INSERT INTO embedding_cache (embedding_model, chunk_hash, embedding) VALUES %s "
+                    "ON CONFLICT (embedding_model, chunk_hash) DO UPDATE SET embedding = EXCLUDED.embedding",
+                    [(embedding_model, chunk_hash, Binary(embedding)) for chunk_hash, embedding in embeddings]
+                )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
@@ -1,7 +1,34 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from api import routes_upload, routes_chat
+from api import routes_upload, routes_chat, routes_health, routes_metrics
+from services.mailer import MAILER_MODE, get_mailer
+from services.metrics import MetricsMiddleware
+from services.redis_service import close_redis_service
+from services.warmup import WARMUP_MODE, warmup
 
-app= FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # models, clients and pools are created here rather than at import or on the first request
+    if WARMUP_MODE == "blocking":
+        await warmup.arun()
+    elif WARMUP_MODE == "background":
+        warmup.start()
+    else:
+        warmup.skip()
+    # emails left in the outbox by a previous run go out without waiting for the next booking
+    if MAILER_MODE == "local":
+        get_mailer().start()
+    yield
+    if MAILER_MODE == "local":
+        get_mailer().stop(timeout=5)
+    close_redis_service()
+
+
+app= FastAPI(lifespan=lifespan)
+
+# request latency by route, and the per-request stage breakdown
+app.add_middleware(MetricsMiddleware)
 
 # first api route
 app.include_router(routes_upload.router)
@@ -9,3 +36,8 @@ app.include_router(routes_upload.router)
 # second api route
 app.include_router(routes_chat.router)
 
+# /metrics and the profiler switch
+app.include_router(routes_metrics.router)
+
+# liveness and readiness probes
+app.include_router(routes_health.router)
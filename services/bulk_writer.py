@@ -0,0 +1,139 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, Optional, Sequence, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+from database.chunks import delete_chunk_rows, insert_chunk_rows
+from services.lexical_index import LEXICAL_INDEX_ENABLED, get_lexical_index
+from services.vector_store import VectorStore
+
+load_dotenv()
+
+# Pinecone caps a request at 1000 vectors and 2MB
+UPSERT_BATCH_SIZE = int(os.getenv("UPSERT_BATCH_SIZE", 200))
+UPSERT_MAX_BATCH_BYTES = int(os.getenv("UPSERT_MAX_BATCH_BYTES", 1_500_000))
+UPSERT_CONCURRENCY = int(os.getenv("UPSERT_CONCURRENCY", 4))
+UPSERT_RETRIES = int(os.getenv("UPSERT_RETRIES", 3))
+
+# bytes of one float once serialized in an upsert request
+_BYTES_PER_FLOAT = 12
+
+
+def iter_upsert_batches(ids: Sequence[str], metadata: Sequence[Dict[str, Any]], dimension: int,
+                        batch_size: int = UPSERT_BATCH_SIZE, max_bytes: int = UPSERT_MAX_BATCH_BYTES) -> Iterator[Tuple[int, int]]:
+    """Split rows into (start, end) ranges bounded by both row count and estimated request size"""
+    start = 0
+    size = 0
+    for i in range(len(ids)):
+        row_size = dimension * _BYTES_PER_FLOAT + len(ids[i]) + len(json.dumps(metadata[i]))
+        if i > start and (i - start >= batch_size or size + row_size > max_bytes):
+            yield start, i
+            start, size = i, 0
+        size += row_size
+    if start < len(ids):
+        yield start, len(ids)
+
+
+def _upsert_with_retries(store: VectorStore, ids: Sequence[str], vectors: np.ndarray, metadata: Sequence[Dict[str, Any]], retries: int,
+                         namespace: str) -> None:
+    for attempt in range(retries + 1):
+        try:
+            store.upsert(ids, vectors, metadata, namespace=namespace)
+            return
+        except Exception as e:
+            if attempt == retries:
+                raise
+            delay = 0.5 * 2 ** attempt
+            print(f"Upsert of {len(ids)} vectors failed ({e}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def upsert_vectors(store: VectorStore, ids: Sequence[str], vectors: np.ndarray, metadata: Sequence[Dict[str, Any]],
+                   concurrency: int = UPSERT_CONCURRENCY, retries: int = UPSERT_RETRIES, namespace: str = "") -> None:
+    """
+    Upsert vectors in size-bounded batches sent concurrently, retrying failed batches with backoff.
+
+    Vectors stay in one numpy array; each batch is a slice of it.
+    Raises the first error of a batch that still fails after `retries` attempts.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    batches = list(iter_upsert_batches(ids, metadata, vectors.shape[1] if vectors.ndim == 2 else 0))
+    if len(batches) <= 1 or concurrency <= 1:
+        for start, end in batches:
+            _upsert_with_retries(store, ids[start:end], vectors[start:end], metadata[start:end], retries, namespace)
+        return
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [
+            executor.submit(_upsert_with_retries, store, ids[start:end], vectors[start:end], metadata[start:end], retries, namespace)
+            for start, end in batches
+        ]
+        for future in futures:
+            future.result()
+
+
+def remove_chunks(conn, store: VectorStore, document_id: str, chunk_ids: Sequence[str], namespace: str = "") -> None:
+    """Best-effort removal of chunks from the vector store, PostgreSQL and the lexical index, used to undo partial writes"""
+    try:
+        # Pinecone deletes at most 1000 ids per request
+        for start in range(0, len(chunk_ids), 1000):
+            store.delete(ids=chunk_ids[start:start + 1000], namespace=namespace)
+    except Exception as e:
+        print(f"Failed to remove vectors of document {document_id} after a failed upsert: {e}")
+    try:
+        delete_chunk_rows(conn, chunk_ids)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print(f"Failed to remove chunk rows of document {document_id} after a failed upsert: {e}")
+    if LEXICAL_INDEX_ENABLED:
+        try:
+            get_lexical_index().delete(chunk_ids)
+        except Exception as e:
+            print(f"Failed to remove chunks of document {document_id} from the lexical index: {e}")
+
+
+def write_chunks(conn, store: VectorStore, document_id: str, chunk_ids: Sequence[str], texts: Sequence[str],
+                 vectors: np.ndarray, metadata: Sequence[Dict[str, Any]], embedding_model: str, chunking_method: str,
+                 chunk_indexes: Optional[Sequence[int]] = None, chunk_hashes: Optional[Sequence[str]] = None, namespace: str = "",
+                 new_ids: Optional[Sequence[str]] = None) -> None:
+    """
+    Write chunk rows to PostgreSQL and vectors to the vector store so that either both land or neither does.
+
+    Rows are committed first: a row without a vector is never retrieved, while a vector without a row
+    would be. If the vector upsert then fails, the rows and any vectors this write added are removed
+    again before the error is re-raised. The chunks are then added to the lexical index.
+    `chunk_indexes` are the positions of the chunks in the document (0, 1, ... when omitted),
+    `chunk_hashes` their content hashes and `namespace` the vector store namespace of the
+    document's collection. `new_ids` are the chunks that did not exist before (all of them when
+    omitted): chunks that only moved were stored by an earlier ingestion and are never removed.
+    """
+    chunk_indexes = range(len(chunk_ids)) if chunk_indexes is None else chunk_indexes
+    chunk_hashes = [None] * len(chunk_ids) if chunk_hashes is None else chunk_hashes
+    rows = [
+        (chunk_id, document_id, index, text, embedding_model, chunking_method, chunk_hash)
+        for chunk_id, index, text, chunk_hash in zip(chunk_ids, chunk_indexes, texts, chunk_hashes)
+    ]
+    try:
+        insert_chunk_rows(conn, rows)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    try:
+        upsert_vectors(store, chunk_ids, vectors, metadata, namespace=namespace)
+    except Exception:
+        added = set(chunk_ids if new_ids is None else new_ids)
+        remove_chunks(conn, store, document_id, [chunk_id for chunk_id in chunk_ids if chunk_id in added], namespace)
+        raise
+
+    if LEXICAL_INDEX_ENABLED:
+        # the lexical index only ranks chunks, it is rebuilt from PostgreSQL when it falls behind
+        try:
+            get_lexical_index().upsert(chunk_ids, texts, metadata, namespace=namespace)
+        except Exception as e:
+            print(f"Failed to add chunks of document {document_id} to the lexical index: {e}")
@@ -0,0 +1,116 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from dotenv import load_dotenv
+
+from database.chunks import afetch_chunk_texts, fetch_chunk_texts
+from services.metrics import record_cache
+from services.vector_store import VectorMatch
+
+load_dotenv()
+
+
+class ChunkTextCache:
+    """
+    Size-bounded LRU cache of chunk text keyed by chunk_uuid.
+
+    Chunks are immutable once ingested, so entries never go stale and are only evicted for space.
+    """
+
+    def __init__(self, max_entries: int = 10000, max_chars: int = 50_000_000):
+        self.max_entries = max_entries
+        self.max_chars = max_chars
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._chars = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, chunk_ids: Sequence[str]) -> Tuple[Dict[str, str], List[str]]:
+        """Return (cached texts, ids that were not cached)"""
+        found: Dict[str, str] = {}
+        missing: List[str] = []
+        with self._lock:
+            for chunk_id in chunk_ids:
+                text = self._entries.get(chunk_id)
+                if text is None:
+                    missing.append(chunk_id)
+                else:
+                    self._entries.move_to_end(chunk_id)
+                    found[chunk_id] = text
+            self.hits += len(found)
+            self.misses += len(missing)
+        return found, missing
+
+    def put_many(self, texts: Dict[str, str]) -> None:
+        with self._lock:
+            for chunk_id, text in texts.items():
+                previous = self._entries.pop(chunk_id, None)
+                if previous is not None:
+                    self._chars -= len(previous)
+                self._entries[chunk_id] = text
+                self._chars += len(text)
+            while self._entries and (len(self._entries) > self.max_entries or self._chars > self.max_chars):
+                _, evicted = self._entries.popitem(last=False)
+                self._chars -= len(evicted)
+
+    def discard(self, chunk_ids: Sequence[str]) -> None:
+        """Forget deleted chunks"""
+        with self._lock:
+            for chunk_id in chunk_ids:
+                text = self._entries.pop(chunk_id, None)
+                if text is not None:
+                    self._chars -= len(text)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+# Global cache instance
+chunk_text_cache = ChunkTextCache(
+    max_entries=int(os.getenv("CHUNK_CACHE_MAX_ENTRIES", 10000)),
+    max_chars=int(os.getenv("CHUNK_CACHE_MAX_CHARS", 50_000_000))
+)
+
+
+def _chunk_id(match: VectorMatch) -> str:
+    return match.metadata.get("chunk_uuid") or match.id
+
+
+def _pair(matches: Sequence[VectorMatch], texts: Dict[str, str]) -> List[Tuple[VectorMatch, str]]:
+    # matches whose text is gone (e.g. deleted rows) are dropped, order follows the matches
+    return [(match, texts[_chunk_id(match)]) for match in matches if _chunk_id(match) in texts]
+
+
+def hydrate_matches(matches: Sequence[VectorMatch], cache: Optional[ChunkTextCache] = None) -> List[Tuple[VectorMatch, str]]:
+    """
+    Attach chunk text to vector matches.
+
+    Cached texts are served from memory; the rest are fetched from PostgreSQL with a single
+    `chunk_id = ANY(...)` query and added to the cache.
+
+    Returns:
+        (match, chunk_text) pairs in match order
+    """
+    cache = chunk_text_cache if cache is None else cache
+    texts, missing = cache.get_many([_chunk_id(match) for match in matches])
+    record_cache("chunk_text", hits=len(texts), misses=len(missing))
+    if missing:
+        fetched = fetch_chunk_texts(missing)
+        cache.put_many(fetched)
+        texts.update(fetched)
+    return _pair(matches, texts)
+
+
+async def ahydrate_matches(matches: Sequence[VectorMatch], cache: Optional[ChunkTextCache] = None) -> List[Tuple[VectorMatch, str]]:
+    """Async variant of hydrate_matches"""
+    cache = chunk_text_cache if cache is None else cache
+    texts, missing = cache.get_many([_chunk_id(match) for match in matches])
+    record_cache("chunk_text", hits=len(texts), misses=len(missing))
+    if missing:
+        fetched = await afetch_chunk_texts(missing)
+        cache.put_many(fetched)
+        texts.update(fetched)
+    return _pair(matches, texts)
@@ -1,17 +1,319 @@
-from transformers import AutoTokenizer
-
-
-def chunk_text_by_tokens(text: str, model: str = "sentence-transformers/all-MiniLM-L6-v2", chunk_size: int = 200, overlap: int = 50):
-    tokenizer = AutoTokenizer.from_pretrained(model)
-    tokens = tokenizer.encode(text)
-    print(f"Total number of tokens: {len(tokens)}")
-    
-    chunks = []
-    i = 0
-    while i < len(tokens):
-        chunk_tokens = tokens[i: i + chunk_size]
-        chunk = tokenizer.decode(chunk_tokens)
-        chunks.append(chunk)
-        i += chunk_size - overlap  
-    
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, Iterator, List, Pattern, Sequence, Tuple
+import os
+import re
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DEFAULT_TOKENIZER_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+# chunking strategy of uploads that do not name one, see CHUNKERS
+DEFAULT_CHUNKING_METHOD = os.getenv("CHUNKING_METHOD", "token")
+
+# size of the slices chunk_text_by_tokens feeds to the streaming chunker
+_TEXT_SLICE_SIZE = 64 * 1024
+# segments are cut into parts of about this size and encoded as one batch, which the fast tokenizer parallelizes
+_ENCODE_PART_SIZE = 4 * 1024
+
+_whitespace = re.compile(r"\s")
+# a sentence ends at ., ! or ? followed by whitespace, or at a blank line (headings, list items)
+_sentence_boundary = re.compile(r"(?<=[.!?])\s+|\n\s*\n")
+_paragraph_boundary = re.compile(r"\n\s*\n")
+# tried in order by the recursive chunker: paragraphs, lines, sentences, words
+_RECURSIVE_SEPARATORS = (_paragraph_boundary, re.compile(r"\n"), re.compile(r"(?<=[.!?])\s+"), re.compile(r"\s+"))
+
+_tokenizer_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def _load_tokenizer(model: str):
+    # transformers is slow to import, only pay for it when a tokenizer is needed
+    from transformers import AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(model, use_fast=True)
+    if not tokenizer.is_fast:
+        raise ValueError(f"Tokenizer for {model} has no fast implementation, offset mappings are unavailable")
+    return tokenizer
+
+
+def get_tokenizer(model: str = DEFAULT_TOKENIZER_MODEL):
+    """Return the process-wide tokenizer for a model, loading it on first use"""
+    with _tokenizer_lock:
+        return _load_tokenizer(model)
+
+
+def _split_at_whitespace(text: str) -> int:
+    """Index of the last whitespace character, the tail after it may still grow into a longer word"""
+    for i in range(len(text) - 1, -1, -1):
+        if text[i].isspace():
+            return i
+    return 0
+
+
+def _split_parts(segment: str) -> List[int]:
+    """Start offsets of roughly equal parts of `segment`, each starting at a whitespace character"""
+    starts = [0]
+    while True:
+        match = _whitespace.search(segment, starts[-1] + _ENCODE_PART_SIZE)
+        if not match:
+            return starts
+        starts.append(match.start())
+
+
+def iter_chunks_by_tokens(pieces: Iterable[str], model: str = DEFAULT_TOKENIZER_MODEL, chunk_size: int = 200, overlap: int = 50) -> Iterator[str]:
+    """
+    Yield token-window chunks while text arrives piece by piece (e.g. one PDF page at a time).
+
+    Windows are laid out exactly like the original encode/decode chunker: `chunk_size` tokens
+    with `overlap` tokens shared between neighbours, counted over the encoded sequence including
+    the leading [CLS] and trailing [SEP]. Instead of decoding token ids back to text, each chunk
+    is sliced out of the original text with the fast tokenizer's character offsets, so chunks keep
+    the original casing and spacing. Windows holding only special tokens are skipped.
+
+    Args:
+        pieces: Consecutive pieces of the document text
+        model: Tokenizer model name
+        chunk_size: Number of tokens per chunk
+        overlap: Number of tokens shared by consecutive chunks
+
+    Yields:
+        Chunk text, in document order
+    """
+    if overlap >= chunk_size:
+        raise ValueError("overlap must be smaller than chunk_size")
+
+    tokenizer = get_tokenizer(model)
+    step = chunk_size - overlap
+
+    text = ""           # retained text, text[0] sits at absolute offset `base`
+    base = 0
+    tokenized_upto = 0  # absolute offset up to which the text has been tokenized
+    offsets: List[tuple] = []  # absolute (start, end) of retained content tokens
+    first_token = 0     # content index of offsets[0]
+    window = 0
+
+    def tokenize(end: int) -> None:
+        nonlocal tokenized_upto
+        segment = text[tokenized_upto - base:end - base]
+        if segment.strip():
+            starts = _split_parts(segment)
+            parts = [segment[s:e] for s, e in zip(starts, starts[1:] + [len(segment)])]
+            encoding = tokenizer(parts, add_special_tokens=False, return_offsets_mapping=True, verbose=False)
+            for start, part_offsets in zip(starts, encoding["offset_mapping"]):
+                shift = tokenized_upto + start
+                offsets.extend((shift + s, shift + e) for s, e in part_offsets)
+        tokenized_upto = end
+
+    def window_text(start: int, end: int) -> str:
+        # `start`/`end` are content token indices, clipped to the retained tokens
+        span = offsets[max(start, first_token) - first_token:end - first_token]
+        if not span:
+            return ""
+        return text[span[0][0] - base:span[-1][1] - base]
+
+    def emit_ready(final: bool):
+        nonlocal window, first_token, text, base
+        # position 0 of the legacy sequence is [CLS], so window `w` covers content tokens
+        # [w * step - 1, w * step + chunk_size - 1)
+        total = first_token + len(offsets)
+        while True:
+            start = window * step - 1
+            end = start + chunk_size
+            if not final and end > total:
+                break
+            # legacy windows start while the start position is before [SEP] at total + 1
+            if final and window * step >= total + 2:
+                break
+            chunk = window_text(start, end)
+            window += 1
+            if chunk:
+                yield chunk
+
+            # drop tokens and text no later window can reach
+            next_start = window * step - 1
+            drop = min(max(next_start - first_token, 0), len(offsets))
+            if drop:
+                del offsets[:drop]
+                first_token += drop
+                cut = offsets[0][0] if offsets else tokenized_upto
+                text = text[cut - base:]
+                base = cut
+
+    for piece in pieces:
+        if not piece:
+            continue
+        text += piece
+        split = tokenized_upto + _split_at_whitespace(text[tokenized_upto - base:])
+        if split > tokenized_upto:
+            tokenize(split)
+            yield from emit_ready(final=False)
+
+    tokenize(base + len(text))
+    yield from emit_ready(final=True)
+
+
+def _slices(text: str, size: int) -> Iterator[str]:
+    for i in range(0, len(text), size):
+        yield text[i:i + size]
+
+
+def chunk_text_by_tokens(text: str, model: str = DEFAULT_TOKENIZER_MODEL, chunk_size: int = 200, overlap: int = 50) -> List[str]:
+    chunks = list(iter_chunks_by_tokens(_slices(text, _TEXT_SLICE_SIZE), model=model, chunk_size=chunk_size, overlap=overlap))
+    print(f"Total number of chunks: {len(chunks)}")
     return chunks
+
+
+def _split_keep(text: str, separator: Pattern) -> List[str]:
+    """`text` split after each match of `separator`; the parts concatenate back to `text`"""
+    parts = []
+    start = 0
+    for match in separator.finditer(text):
+        if match.end() > start:
+            parts.append(text[start:match.end()])
+            start = match.end()
+    if start < len(text):
+        parts.append(text[start:])
+    return parts
+
+
+def _iter_blocks(pieces: Iterable[str], boundary: Pattern) -> Iterator[str]:
+    """Text in blocks of about _TEXT_SLICE_SIZE characters, each ending at a `boundary` match (or whitespace)"""
+    text = ""
+    for piece in pieces:
+        text += piece
+        if len(text) < _TEXT_SLICE_SIZE:
+            continue
+        end = 0
+        for match in boundary.finditer(text):
+            end = match.end()
+        if not end and len(text) >= 4 * _TEXT_SLICE_SIZE:
+            # no boundary at all, e.g. text without punctuation
+            end = _split_at_whitespace(text)
+        if end:
+            yield text[:end]
+            text = text[end:]
+    if text:
+        yield text
+
+
+def _token_counts(tokenizer, texts: Sequence[str]) -> List[int]:
+    if not texts:
+        return []
+    return [len(ids) for ids in tokenizer(list(texts), add_special_tokens=False, verbose=False)["input_ids"]]
+
+
+def _pack(units: Iterable[Tuple[str, int]], model: str, chunk_size: int, overlap: int) -> Iterator[str]:
+    """
+    Merge consecutive (text, token count) units into chunks of at most `chunk_size` tokens.
+
+    Chunks end at unit boundaries. Whole trailing units of up to `overlap` tokens are repeated at
+    the start of the next chunk. A unit too long for one chunk is cut into token windows.
+    """
+    # room for [CLS] and [SEP], which the token windows count too
+    budget = chunk_size - 2
+    current: List[Tuple[str, int]] = []
+    size = 0
+
+    def text_of(units: List[Tuple[str, int]]) -> str:
+        return "".join(unit for unit, _ in units).strip()
+
+    for unit, count in units:
+        if count > budget:
+            if text_of(current):
+                yield text_of(current)
+            current, size = [], 0
+            yield from iter_chunks_by_tokens([unit], model=model, chunk_size=chunk_size, overlap=overlap)
+            continue
+        if current and size + count > budget:
+            if text_of(current):
+                yield text_of(current)
+            carried: List[Tuple[str, int]] = []
+            carried_size = 0
+            for previous in reversed(current):
+                if carried_size + previous[1] > overlap or carried_size + previous[1] + count > budget:
+                    break
+                carried.insert(0, previous)
+                carried_size += previous[1]
+            current, size = carried, carried_size
+        current.append((unit, count))
+        size += count
+    if text_of(current):
+        yield text_of(current)
+
+
+def iter_chunks_by_sentences(pieces: Iterable[str], model: str = DEFAULT_TOKENIZER_MODEL, chunk_size: int = 200, overlap: int = 50) -> Iterator[str]:
+    """
+    Yield chunks of whole sentences, filled up to `chunk_size` tokens, while text arrives piece by piece.
+
+    Consecutive chunks share their last sentences, up to `overlap` tokens. A sentence longer than
+    a chunk is cut into token windows like iter_chunks_by_tokens.
+    """
+    if overlap >= chunk_size:
+        raise ValueError("overlap must be smaller than chunk_size")
+    tokenizer = get_tokenizer(model)
+
+    def units() -> Iterator[Tuple[str, int]]:
+        for block in _iter_blocks(pieces, _sentence_boundary):
+            sentences = _split_keep(block, _sentence_boundary)
+            yield from zip(sentences, _token_counts(tokenizer, sentences))
+
+    yield from _pack(units(), model, chunk_size, overlap)
+
+
+def _split_recursive(text: str, separators: Sequence[Pattern], tokenizer, limit: int) -> List[Tuple[str, int]]:
+    """(part, token count) of `text`, split at the first separator and parts still over `limit` at the next ones"""
+    parts = _split_keep(text, separators[0])
+    units: List[Tuple[str, int]] = []
+    for part, count in zip(parts, _token_counts(tokenizer, parts)):
+        if count <= limit or len(separators) == 1:
+            units.append((part, count))
+        else:
+            units.extend(_split_recursive(part, separators[1:], tokenizer, limit))
+    return units
+
+
+def iter_chunks_recursive(pieces: Iterable[str], model: str = DEFAULT_TOKENIZER_MODEL, chunk_size: int = 200, overlap: int = 50) -> Iterator[str]:
+    """
+    Yield chunks split at the coarsest separator that fits, while text arrives piece by piece.
+
+    Paragraphs that fit in `chunk_size` tokens are kept whole, longer ones are split into lines,
+    then sentences, then words. Neighbouring parts are merged up to `chunk_size` tokens, sharing
+    whole parts of up to `overlap` tokens.
+    """
+    if overlap >= chunk_size:
+        raise ValueError("overlap must be smaller than chunk_size")
+    tokenizer = get_tokenizer(model)
+
+    def units() -> Iterator[Tuple[str, int]]:
+        for block in _iter_blocks(pieces, _paragraph_boundary):
+            yield from _split_recursive(block, _RECURSIVE_SEPARATORS, tokenizer, chunk_size - 2)
+
+    yield from _pack(units(), model, chunk_size, overlap)
+
+
+# chunking strategies by name, the name is stored in chunks.chunking_method
+CHUNKERS: Dict[str, Callable[..., Iterator[str]]] = {
+    "token": iter_chunks_by_tokens,
+    "sentence": iter_chunks_by_sentences,
+    "recursive": iter_chunks_recursive,
+}
+
+
+def register_chunker(name: str, chunker: Callable[..., Iterator[str]]) -> None:
+    """Add a strategy: `chunker(pieces, model=..., chunk_size=..., overlap=...)` yields chunk texts"""
+    CHUNKERS[name] = chunker
+
+
+def get_chunker(method: str = DEFAULT_CHUNKING_METHOD) -> Callable[..., Iterator[str]]:
+    """The chunker registered as `method`, ValueError for unknown names"""
+    chunker = CHUNKERS.get(method)
+    if chunker is None:
+        raise ValueError(f"Unknown chunking method {method!r}, expected one of: {', '.join(sorted(CHUNKERS))}")
+    return chunker
+
+
+def iter_chunks(pieces: Iterable[str], method: str = DEFAULT_CHUNKING_METHOD, model: str = DEFAULT_TOKENIZER_MODEL,
+                chunk_size: int = 200, overlap: int = 50) -> Iterator[str]:
+    """Yield the chunks of streamed text with the chunking strategy `method`"""
+    return get_chunker(method)(pieces, model=model, chunk_size=chunk_size, overlap=overlap)
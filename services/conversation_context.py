@@ -0,0 +1,212 @@
+import asyncio
+import os
+import re
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from dotenv import load_dotenv
+
+from services.chunk_text import DEFAULT_TOKENIZER_MODEL, get_tokenizer
+from services.llm_client import get_llm_client, message_text
+from services.redis_service import get_redis_service
+
+load_dotenv()
+
+# tokens of conversation context added to the agent's prompt, summary included
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 800))
+# part of the budget reserved for the summary of older turns
+CONTEXT_SUMMARY_TOKENS = int(os.getenv("CONTEXT_SUMMARY_TOKENS", 200))
+# most recent turns kept verbatim, fewer when they do not fit the budget
+CONTEXT_RECENT_TURNS = int(os.getenv("CONTEXT_RECENT_TURNS", 5))
+# "llm" (summary written by the LLM client, off the request path) or "extractive" (no LLM call)
+CONTEXT_SUMMARY_MODE = os.getenv("CONTEXT_SUMMARY_MODE", "llm").lower()
+
+# tag of the summary LLM run, never forwarded to streaming clients
+SUMMARY_LLM_TAG = "conversation_summary"
+
+SUMMARY_HEADER = "Summary of earlier conversation:"
+RECENT_HEADER = "Previous conversation:"
+
+
+def _format_turn(message: Dict[str, Any]) -> str:
+    return f"User: {message['user_query']}\nAssistant: {message['response']}"
+
+
+def _first_sentence(text: str) -> str:
+    return re.split(r"(?<=[.!?])\s+", text.strip(), maxsplit=1)[0]
+
+
+class ConversationContextBuilder:
+    """
+    Conversation context for the agent's prompt, held under a token budget.
+
+    The most recent turns are kept verbatim while they fit the budget left after the summary's
+    share (at most `recent_turns`; a single oversized turn is cut). Turns that left that window
+    are folded into a rolling summary stored next to the conversation in Redis, updated
+    incrementally in the background after each turn, so it is never rebuilt from the whole
+    history. Turns the background update has not reached yet are condensed on the fly.
+    """
+
+    def __init__(self, token_budget: int = CONTEXT_TOKEN_BUDGET, summary_tokens: int = CONTEXT_SUMMARY_TOKENS,
+                 recent_turns: int = CONTEXT_RECENT_TURNS, summary_mode: str = CONTEXT_SUMMARY_MODE,
+                 tokenizer_model: str = DEFAULT_TOKENIZER_MODEL):
+        self.token_budget = token_budget
+        self.summary_tokens = min(summary_tokens, token_budget)
+        self.recent_turns = recent_turns
+        self.summary_mode = summary_mode
+        self.tokenizer_model = tokenizer_model
+        # background summary updates: task references, and sessions with one in flight
+        self._tasks: Set[asyncio.Task] = set()
+        self._updating: Set[str] = set()
+        self._header_tokens: Optional[int] = None
+
+    def _encode(self, text: str):
+        return get_tokenizer(self.tokenizer_model)(text, add_special_tokens=False, return_offsets_mapping=True, verbose=False)
+
+    def count_tokens(self, text: str) -> int:
+        return len(self._encode(text)["input_ids"]) if text else 0
+
+    def truncate(self, text: str, max_tokens: int, keep_end: bool = False) -> str:
+        """First (or with `keep_end` last) `max_tokens` tokens of a text"""
+        offsets = self._encode(text)["offset_mapping"]
+        if len(offsets) <= max_tokens:
+            return text
+        if max_tokens <= 0:
+            return ""
+        if keep_end:
+            return text[offsets[-max_tokens][0]:]
+        return text[:offsets[max_tokens - 1][1]]
+
+    def split(self, messages: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[str]]:
+        """(turns older than the verbatim window, formatted recent turns oldest first)"""
+        if self._header_tokens is None:
+            self._header_tokens = self.count_tokens(f"{SUMMARY_HEADER}\n{RECENT_HEADER}")
+        budget = max(self.token_budget - self.summary_tokens - self._header_tokens, 1)
+        recent: List[str] = []
+        used = 0
+        for message in reversed(messages):
+            if len(recent) >= self.recent_turns:
+                break
+            text = _format_turn(message)
+            tokens = self.count_tokens(text)
+            if used + tokens > budget:
+                if not recent:
+                    # the latest turn alone is over budget: keep its beginning
+                    recent.append(self.truncate(text, budget))
+                break
+            recent.append(text)
+            used += tokens
+        return messages[:len(messages) - len(recent)], list(reversed(recent))
+
+    def condense(self, message: Dict[str, Any]) -> str:
+        """One summary line for a turn, without an LLM call"""
+        line = f"User asked: {message['user_query']} Assistant answered: {_first_sentence(message['response'])}"
+        return self.truncate(line, max(self.summary_tokens // 4, 16))
+
+    def _trim_summary(self, summary: str) -> str:
+        # the newest part of the summary matters most
+        return self.truncate(summary, self.summary_tokens, keep_end=True).strip()
+
+    @staticmethod
+    def _pending(older: List[Dict[str, Any]], record: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        summarized_until = float((record or {}).get("summarized_until", 0.0))
+        return [message for message in older if float(message.get("timestamp", 0.0)) > summarized_until]
+
+    def compose(self, messages: List[Dict[str, Any]], record: Optional[Dict[str, Any]] = None) -> str:
+        """Context string from a session's messages (oldest first) and its stored summary record"""
+        if not messages:
+            return ""
+        older, recent = self.split(messages)
+        summary = (record or {}).get("summary", "")
+        pending = self._pending(older, record)
+        if pending:
+            # turns the background update has not folded in yet
+            summary = "\n".join(filter(None, [summary] + [self.condense(message) for message in pending]))
+        summary = self._trim_summary(summary) if summary else ""
+
+        parts = []
+        if summary:
+            parts.append(f"{SUMMARY_HEADER}\n{summary}")
+        if recent:
+            parts.append(f"{RECENT_HEADER}\n" + "\n\n".join(recent))
+        return "\n\n".join(parts)
+
+    async def _summarize(self, summary: str, turns: List[Dict[str, Any]]) -> str:
+        condensed = "\n".join(filter(None, [summary] + [self.condense(message) for message in turns]))
+        if self.summary_mode != "llm":
+            return self._trim_summary(condensed)
+        transcript = "\n\n".join(_format_turn(message) for message in turns)
+        prompt = f"""
+            Update the running summary of a conversation between a user and an assistant with the new turns below.
+            Keep names, dates, email addresses, bookings and facts the user may refer to later. Answer with the summary only,
+            in at most {max(self.summary_tokens * 3 // 4, 20)} words.
+
+            Current summary: {summary or "(none)"}
+
+            New turns:
+            {transcript}
+            """
+        try:
+            response = await get_llm_client().ainvoke(prompt, config={"tags": [SUMMARY_LLM_TAG]})
+            return self._trim_summary(message_text(response))
+        except Exception as e:
+            print(f"Conversation summary error, using the condensed turns: {e}")
+            return self._trim_summary(condensed)
+
+    async def afold(self, messages: List[Dict[str, Any]], record: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """New summary record with the turns that left the verbatim window folded in, None when there are none"""
+        older, _ = await asyncio.to_thread(self.split, messages)
+        pending = self._pending(older, record)
+        if not pending:
+            return None
+        record = record or {}
+        return {
+            "summary": await self._summarize(record.get("summary", ""), pending),
+            "summarized_until": float(pending[-1].get("timestamp", 0.0)),
+            "turns": int(record.get("turns", 0)) + len(pending)
+        }
+
+    async def abuild(self, session_id: str, timeout: Optional[float] = None) -> str:
+        """Context of a session for the next prompt; `timeout` bounds the Redis reads, not the tokenizing"""
+        redis_service = get_redis_service()
+        messages, record = await asyncio.wait_for(
+            asyncio.gather(redis_service.aget_conversation_history(session_id), redis_service.aget_conversation_summary(session_id)),
+            timeout
+        )
+        # tokenizing runs off the event loop (and loads the tokenizer on first use)
+        return await asyncio.to_thread(self.compose, messages, record)
+
+    def build(self, session_id: str) -> str:
+        redis_service = get_redis_service()
+        return self.compose(redis_service.get_conversation_history(session_id), redis_service.get_conversation_summary(session_id))
+
+    async def aupdate_summary(self, session_id: str) -> None:
+        redis_service = get_redis_service()
+        messages, record = await asyncio.gather(
+            redis_service.aget_conversation_history(session_id),
+            redis_service.aget_conversation_summary(session_id)
+        )
+        updated = await self.afold(messages, record)
+        if updated is not None:
+            await redis_service.astore_conversation_summary(session_id, updated)
+
+    async def _run_update(self, session_id: str) -> None:
+        try:
+            await self.aupdate_summary(session_id)
+        except Exception as e:
+            print(f"Conversation summary update error: {e}")
+        finally:
+            self._updating.discard(session_id)
+
+    def schedule_update(self, session_id: str) -> None:
+        """Update the session's summary in the background, after the response has been sent"""
+        if session_id in self._updating:
+            # the running update picks the new turn up next time
+            return
+        self._updating.add(session_id)
+        task = asyncio.create_task(self._run_update(session_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+
+# Global context builder instance
+context_builder = ConversationContextBuilder()
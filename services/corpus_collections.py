@@ -0,0 +1,67 @@
+import re
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# documents uploaded without a collection, and everything ingested before collections existed
+DEFAULT_COLLECTION = "default"
+
+# also used as a directory name by the local vector store and as a Pinecone namespace
+_collection_name = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_-]{0,62}$")
+
+
+def validate_collection(collection: str) -> str:
+    """The collection name, ValueError unless it is 1-63 letters, digits, '-' or '_'"""
+    if not _collection_name.match(collection or ""):
+        raise ValueError(f"Invalid collection name {collection!r}: use 1-63 letters, digits, '-' or '_'")
+    return collection
+
+
+def namespace_for(collection: str) -> str:
+    """Vector store namespace of a collection; the default collection is the default ("") namespace"""
+    return "" if collection == DEFAULT_COLLECTION else collection
+
+
+@dataclass(frozen=True)
+class Scope:
+    """The part of the corpus a question is answered from: one or more collections, optionally narrowed to documents"""
+
+    collections: Tuple[str, ...] = (DEFAULT_COLLECTION,)
+    document_ids: Tuple[str, ...] = ()
+
+    @property
+    def namespaces(self) -> List[str]:
+        return [namespace_for(collection) for collection in self.collections]
+
+    @property
+    def filter(self) -> Optional[Dict[str, Any]]:
+        """Metadata filter of the vector store and lexical index queries"""
+        return {"document_id": {"$in": list(self.document_ids)}} if self.document_ids else None
+
+    @property
+    def key(self) -> str:
+        """Part of the response cache keys, empty for the default scope so its entries are shared with unscoped callers"""
+        if self == DEFAULT_SCOPE:
+            return ""
+        return f"collections={','.join(self.collections)};documents={','.join(self.document_ids)}"
+
+
+DEFAULT_SCOPE = Scope()
+
+
+def make_scope(collections: Optional[Sequence[str]] = None, document_ids: Optional[Sequence[str]] = None) -> Scope:
+    """Validated scope, in canonical order so equal scopes share cache entries; ValueError for invalid collections"""
+    collections = sorted({validate_collection(collection) for collection in collections}) if collections else [DEFAULT_COLLECTION]
+    return Scope(tuple(collections), tuple(sorted(set(document_ids or ()))))
+
+
+# scope of the request being handled, read by the document tool the agent calls
+_current_scope: ContextVar[Scope] = ContextVar("retrieval_scope", default=DEFAULT_SCOPE)
+
+
+def set_scope(scope: Scope) -> None:
+    _current_scope.set(scope)
+
+
+def current_scope() -> Scope:
+    return _current_scope.get()
@@ -0,0 +1,104 @@
+import hashlib
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from database.documents import fetch_document, fetch_document_chunks, upsert_document
+from services.bulk_writer import remove_chunks
+from services.chunk_hydration import chunk_text_cache
+from services.chunk_text import DEFAULT_CHUNKING_METHOD
+from services.corpus_collections import DEFAULT_COLLECTION, namespace_for
+from services.vector_store import VectorStore
+
+# namespace of the content-addressed chunk ids
+CHUNK_ID_NAMESPACE = uuid.UUID("bf48e996-75d9-467b-a436-b2f2471578d6")
+
+
+def content_hash(text: str) -> str:
+    """SHA-256 of a text, hex encoded"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def file_hash(path: str, block_size: int = 1024 * 1024) -> str:
+    """SHA-256 of a file's bytes, hex encoded"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class DocumentPlan:
+    """
+    Incremental (re-)ingestion of one document, identified by its filename within its collection.
+
+    Chunk ids are derived from the document id, the embedding model, the chunk's content hash and
+    how often that content occurred before in the document, so an unchanged chunk keeps its id
+    across uploads. `assign` tells which chunks must be written: new ones, and existing ones that
+    moved to another position. Chunks of the previous version that were not seen again are
+    returned by `stale_ids` and deleted by `finalize_document`.
+    """
+
+    def __init__(self, filename: str, content_hash: str, embedding_model: str, document_id: str,
+                 existing: Dict[str, int], unchanged: bool = False, stored_chunks: int = 0, collection: str = DEFAULT_COLLECTION,
+                 chunking_method: str = DEFAULT_CHUNKING_METHOD):
+        self.filename = filename
+        self.collection = collection
+        self.chunking_method = chunking_method
+        self.content_hash = content_hash
+        self.embedding_model = embedding_model
+        self.document_id = document_id
+        self.existing = existing
+        self.unchanged = unchanged
+        self.stored_chunks = stored_chunks
+        self.num_chunks = 0
+        self._seen: set = set()
+        self._occurrences: Dict[str, int] = {}
+
+    @classmethod
+    def for_document(cls, filename: str, content_hash: str, embedding_model: str, collection: str = DEFAULT_COLLECTION,
+                     chunking_method: str = DEFAULT_CHUNKING_METHOD) -> "DocumentPlan":
+        stored = fetch_document(filename, collection)
+        if stored is None:
+            return cls(filename, content_hash, embedding_model, str(uuid.uuid4()), {}, collection=collection, chunking_method=chunking_method)
+        if (stored["content_hash"] == content_hash and stored["embedding_model"] == embedding_model
+                and stored["chunking_method"] == chunking_method):
+            return cls(filename, content_hash, embedding_model, stored["document_id"], {}, unchanged=True, stored_chunks=stored["num_chunks"],
+                       collection=collection, chunking_method=chunking_method)
+        return cls(filename, content_hash, embedding_model, stored["document_id"], fetch_document_chunks(stored["document_id"]),
+                   collection=collection, chunking_method=chunking_method)
+
+    @property
+    def namespace(self) -> str:
+        return namespace_for(self.collection)
+
+    def assign(self, text: str, index: int) -> Tuple[str, str, bool]:
+        """(chunk_id, chunk_hash, needs_write) of the chunk at `index`"""
+        chunk_hash = content_hash(text)
+        occurrence = self._occurrences.get(chunk_hash, 0)
+        self._occurrences[chunk_hash] = occurrence + 1
+        chunk_id = str(uuid.uuid5(CHUNK_ID_NAMESPACE, f"{self.document_id}:{self.embedding_model}:{chunk_hash}:{occurrence}"))
+        self._seen.add(chunk_id)
+        self.num_chunks += 1
+        return chunk_id, chunk_hash, self.existing.get(chunk_id) != index
+
+    def is_new(self, chunk_id: str) -> bool:
+        return chunk_id not in self.existing
+
+    def stale_ids(self) -> List[str]:
+        return [chunk_id for chunk_id in self.existing if chunk_id not in self._seen]
+
+
+def finalize_document(conn, store: VectorStore, plan: DocumentPlan) -> int:
+    """Delete the chunks the new version dropped and record the version; returns the number deleted"""
+    stale_ids = plan.stale_ids()
+    if stale_ids:
+        remove_chunks(conn, store, plan.document_id, stale_ids, plan.namespace)
+        chunk_text_cache.discard(stale_ids)
+    try:
+        upsert_document(conn, plan.document_id, plan.filename, plan.content_hash, plan.embedding_model, plan.num_chunks, plan.collection,
+                        plan.chunking_method)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return len(stale_ids)
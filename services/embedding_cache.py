@@ -0,0 +1,45 @@
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+from database.documents import fetch_embeddings, store_embeddings
+from services.embedding_engine import DEFAULT_EMBEDDING_MODEL, encode_documents, get_embedding_dimension
+from services.metrics import record_cache
+
+
+def encode_with_cache(texts: Sequence[str], chunk_hashes: Sequence[str], model_name: str = DEFAULT_EMBEDDING_MODEL) -> np.ndarray:
+    """
+    Document embeddings of `texts`, looked up in the persistent embedding cache by (model, chunk hash).
+
+    Only texts missing from the cache are encoded (each distinct text once) and their embeddings
+    are added to the cache. Cache errors are logged and fall back to encoding.
+    """
+    if not chunk_hashes:
+        return np.empty((0, get_embedding_dimension(model_name)), dtype=np.float32)
+    unique_hashes = list(dict.fromkeys(chunk_hashes))
+    try:
+        cached = fetch_embeddings(model_name, unique_hashes)
+    except Exception as e:
+        print(f"Embedding cache lookup failed: {e}")
+        cached = {}
+
+    vectors: Dict[str, np.ndarray] = {chunk_hash: np.frombuffer(data, dtype=np.float32) for chunk_hash, data in cached.items()}
+    first_text = dict(zip(chunk_hashes, texts))
+    missing: List[str] = [chunk_hash for chunk_hash in unique_hashes if chunk_hash not in vectors]
+    record_cache("embedding", hits=len(unique_hashes) - len(missing), misses=len(missing))
+    if missing:
+        encoded = encode_documents([first_text[chunk_hash] for chunk_hash in missing], model_name=model_name)
+        # entries of another dimension (cache shared with a different model build) are re-encoded
+        dimension = encoded.shape[1]
+        stale = [chunk_hash for chunk_hash, vector in vectors.items() if vector.shape[0] != dimension]
+        if stale:
+            encoded = np.concatenate([encoded, encode_documents([first_text[chunk_hash] for chunk_hash in stale], model_name=model_name)])
+            missing += stale
+        vectors.update(zip(missing, encoded))
+        try:
+            store_embeddings(model_name, [(chunk_hash, vectors[chunk_hash].tobytes()) for chunk_hash in missing])
+        except Exception as e:
+            print(f"Embedding cache update failed: {e}")
+
+    print(f"Embedding cache: {len(unique_hashes) - len(missing)} of {len(unique_hashes)} distinct chunks reused")
+    return np.stack([vectors[chunk_hash] for chunk_hash in chunk_hashes]).astype(np.float32, copy=False)
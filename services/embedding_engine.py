@@ -0,0 +1,94 @@
+import os
+import threading
+from typing import TYPE_CHECKING, Dict, List, Union
+
+import numpy as np
+from dotenv import load_dotenv
+from services.metrics import timed_stage
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+
+load_dotenv()
+
+DEFAULT_EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+DOCUMENT_BATCH_SIZE = int(os.getenv("EMBEDDING_DOCUMENT_BATCH_SIZE", 64))
+QUERY_BATCH_SIZE = int(os.getenv("EMBEDDING_QUERY_BATCH_SIZE", 32))
+
+# one loaded copy of each model per process, shared by the upload and query paths
+_models: Dict[str, "SentenceTransformer"] = {}
+_models_lock = threading.Lock()
+
+
+def get_model(model_name: str = DEFAULT_EMBEDDING_MODEL) -> "SentenceTransformer":
+    """Return the shared SentenceTransformer for `model_name`, loading it on first use"""
+    model = _models.get(model_name)
+    if model is None:
+        with _models_lock:
+            model = _models.get(model_name)
+            if model is None:
+                # sentence-transformers imports torch, which takes seconds: only when a model is loaded
+                from sentence_transformers import SentenceTransformer
+
+                model = SentenceTransformer(model_name)
+                _models[model_name] = model
+    return model
+
+
+def get_embedding_dimension(model_name: str = DEFAULT_EMBEDDING_MODEL) -> int:
+    """Dimension of the vectors produced by `model_name`"""
+    return int(get_model(model_name).get_sentence_embedding_dimension())  # type: ignore
+
+
+def _encode(texts: List[str], model_name: str, batch_size: int, normalize: bool, dtype: Union[str, np.dtype], show_progress_bar: bool,
+            stage: str) -> np.ndarray:
+    model = get_model(model_name)
+    if not texts:
+        return np.empty((0, get_embedding_dimension(model_name)), dtype=dtype)
+
+    with timed_stage(stage):
+        embeddings = model.encode(
+            texts,
+            batch_size=batch_size,
+            normalize_embeddings=normalize,
+            convert_to_numpy=True,
+            show_progress_bar=show_progress_bar
+        )
+    return embeddings.astype(dtype, copy=False)
+
+
+def encode_documents(texts: List[str], model_name: str = DEFAULT_EMBEDDING_MODEL, batch_size: int = DOCUMENT_BATCH_SIZE,
+                     normalize: bool = True, dtype: Union[str, np.dtype] = np.float32, show_progress_bar: bool = False) -> np.ndarray:
+    """
+    Embed document chunks with the shared model.
+
+    Args:
+        texts: Chunk texts to embed
+        model_name: Embedding model name
+        batch_size: Number of texts per forward pass
+        normalize: Scale vectors to unit length so dot product equals cosine similarity
+        dtype: dtype of the returned array (e.g. float32, float16)
+        show_progress_bar: Show the sentence-transformers progress bar
+
+    Returns:
+        Array of shape (len(texts), dimension)
+    """
+    return _encode(texts, model_name, batch_size, normalize, dtype, show_progress_bar, stage="encode_documents")
+
+
+def encode_queries(queries: List[str], model_name: str = DEFAULT_EMBEDDING_MODEL, batch_size: int = QUERY_BATCH_SIZE,
+                   normalize: bool = True, dtype: Union[str, np.dtype] = np.float32) -> np.ndarray:
+    """
+    Embed user queries with the shared model.
+
+    Args:
+        queries: Query strings to embed
+        model_name: Embedding model name, must match the one used for the documents
+        batch_size: Number of queries per forward pass
+        normalize: Scale vectors to unit length so dot product equals cosine similarity
+        dtype: dtype of the returned array
+
+    Returns:
+        Array of shape (len(queries), dimension)
+    """
+    return _encode(queries, model_name, batch_size, normalize, dtype, show_progress_bar=False, stage="encode_queries")
@@ -1,23 +1,120 @@
+import codecs
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional
+
+from dotenv import load_dotenv
 from PyPDF2 import PdfReader
 
+load_dotenv()
 
-def extract_text_from_pdf(file) -> str:
-    try:
-        reader = PdfReader(file)
-        text = ""
+# PDFs with at least this many pages are extracted by a process pool
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", 32))
+PDF_EXTRACT_PROCESSES = int(os.getenv("PDF_EXTRACT_PROCESSES", os.cpu_count() or 1))
+# pages extracted per pool task
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", 8))
+TXT_READ_SIZE = 64 * 1024
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+# per worker process: readers of the PDFs it is extracting, so each file is parsed once
+_worker_readers: Dict[str, PdfReader] = {}
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # spawn: the parent runs tokenizer and database threads that must not be forked
+                _pool = ProcessPoolExecutor(max_workers=PDF_EXTRACT_PROCESSES, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def _extract_pages(path: str, start: int, end: int) -> List[str]:
+    reader = _worker_readers.get(path)
+    if reader is None:
+        # a worker serves one document at a time in practice, keep memory flat
+        _worker_readers.clear()
+        reader = _worker_readers[path] = PdfReader(path)
+    return [reader.pages[i].extract_text() or "" for i in range(start, end)]
+
+
+def iter_pdf_pages(source, processes: Optional[int] = None, min_pages_for_pool: int = PDF_PARALLEL_MIN_PAGES) -> Iterator[str]:
+    """
+    Yield the text of each page of a PDF, in page order.
+
+    `source` is a path or a binary file object. Large PDFs given by path are split into page ranges
+    extracted by a process pool; at most two ranges per process are in flight, so pages that are
+    extracted but not yet consumed stay bounded.
+    """
+    reader = PdfReader(source)
+    page_count = len(reader.pages)
+    processes = PDF_EXTRACT_PROCESSES if processes is None else processes
+
+    if not isinstance(source, (str, os.PathLike)) or processes <= 1 or page_count < min_pages_for_pool:
         for page in reader.pages:
-            page_text = page.extract_text()
+            yield page.extract_text() or ""
+        return
+
+    path = os.fspath(source)
+    pool = _get_pool()
+    ranges = iter(range(0, page_count, PDF_PAGES_PER_TASK))
+    in_flight = deque()
+
+    def submit_next() -> None:
+        start = next(ranges, None)
+        if start is not None:
+            in_flight.append(pool.submit(_extract_pages, path, start, min(start + PDF_PAGES_PER_TASK, page_count)))
+
+    for _ in range(2 * processes):
+        submit_next()
+    try:
+        while in_flight:
+            pages = in_flight.popleft().result()
+            submit_next()
+            yield from pages
+    finally:
+        # consumer stopped early (or failed): drop queued ranges
+        for future in in_flight:
+            future.cancel()
+
+
+def iter_text_from_pdf(source) -> Iterator[str]:
+    """Text of a PDF as page-sized pieces, for the streaming chunker"""
+    try:
+        for page_text in iter_pdf_pages(source):
             if page_text:
-                text += page_text + "\n"
-        return text.strip()
+                yield page_text + "\n"
     except Exception as e:
         raise RuntimeError(f"Failed to extract text from PDF: {str(e)}")
 
-def extract_text_from_txt(file) -> str:
+
+def iter_text_from_txt(file, read_size: int = TXT_READ_SIZE) -> Iterator[str]:
+    """Text of a UTF-8 file in blocks of `read_size` bytes, decoded incrementally"""
     try:
-        content = file.read()
-        if isinstance(content, bytes):
-            content = content.decode('utf-8')  # decode if needed
-        return content.strip()
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        while True:
+            block = file.read(read_size)
+            if not block:
+                break
+            # text-mode files already yield str
+            text = block if isinstance(block, str) else decoder.decode(block)
+            if text:
+                yield text
+        tail = decoder.decode(b"", final=True)
+        if tail:
+            yield tail
     except Exception as e:
         raise RuntimeError(f"Failed to extract text from TXT file: {str(e)}")
+
+
+def extract_text_from_pdf(file) -> str:
+    return "".join(iter_text_from_pdf(file)).strip()
+
+def extract_text_from_txt(file) -> str:
+    return "".join(iter_text_from_txt(file)).strip()
@@ -0,0 +1,510 @@
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+import zipfile
+from contextlib import ExitStack
+from dataclasses import dataclass, field
+from typing import Any, BinaryIO, Dict, List, Optional, Sequence, Tuple
+
+from dotenv import load_dotenv
+
+from database.db_conn import get_raw_connection
+from services.bulk_writer import remove_chunks, write_chunks
+from services.chunk_hydration import chunk_text_cache
+from database.documents import delete_collection_rows, ensure_schema
+from services.chunk_text import DEFAULT_CHUNKING_METHOD, iter_chunks
+from services.corpus_collections import DEFAULT_COLLECTION, namespace_for
+from services.dedup import DocumentPlan, file_hash, finalize_document
+from services.embed_store import build_chunk_metadata
+from services.embedding_cache import encode_with_cache
+from services.metrics import timed_stage
+from services.embedding_engine import DEFAULT_EMBEDDING_MODEL
+from services.extract_text import iter_text_from_pdf, iter_text_from_txt
+from services.lexical_index import LEXICAL_INDEX_ENABLED, get_lexical_index
+from services.vector_store import get_vector_store
+
+load_dotenv()
+
+# "local" runs the pipeline inside the API process, "redis" queues jobs for `python -m services.ingestion` workers
+INGEST_WORKER_MODE = os.getenv("INGEST_WORKER_MODE", "local").lower()
+# uploads are spooled here until ingested; shared with the workers in redis mode
+INGEST_SPOOL_DIR = os.getenv("INGEST_SPOOL_DIR", "data/uploads")
+
+# workers per pipeline stage
+# extraction streams straight into the chunker, one document per extract worker
+INGEST_EXTRACT_WORKERS = int(os.getenv("INGEST_EXTRACT_WORKERS", 2))
+INGEST_EMBED_WORKERS = int(os.getenv("INGEST_EMBED_WORKERS", 1))
+INGEST_STORE_WORKERS = int(os.getenv("INGEST_STORE_WORKERS", 4))
+# chunks embedded and stored together; a document is written in batches of this size
+INGEST_EMBED_BATCH_SIZE = int(os.getenv("INGEST_EMBED_BATCH_SIZE", 256))
+# batches waiting between two stages, bounds memory when embedding falls behind
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", 8))
+INGEST_JOB_TTL = int(os.getenv("INGEST_JOB_TTL", 7 * 86400))
+# zip uploads: limits on the number of documents and their uncompressed size
+INGEST_MAX_ZIP_ENTRIES = int(os.getenv("INGEST_MAX_ZIP_ENTRIES", 1000))
+INGEST_MAX_ZIP_BYTES = int(os.getenv("INGEST_MAX_ZIP_BYTES", 500_000_000))
+
+SUPPORTED_EXTENSIONS = (".pdf", ".txt")
+QUEUE_KEY = "ingest:queue"
+
+FINISHED = ("completed", "failed")
+
+
+def _is_document(filename: str) -> bool:
+    return filename.lower().endswith(SUPPORTED_EXTENSIONS)
+
+
+def save_uploads(job_id: str, uploads: Sequence[Tuple[str, BinaryIO]]) -> List[Tuple[str, str]]:
+    """
+    Spool uploaded files to disk and return (filename, path) of every document to ingest.
+
+    Zip archives are expanded; their .pdf and .txt entries become documents and other entries
+    are ignored. Raises ValueError for unsupported files or archives over the size limits.
+    """
+    job_dir = os.path.join(INGEST_SPOOL_DIR, job_id)
+    os.makedirs(job_dir, exist_ok=True)
+    documents = []
+
+    def spool(filename: str, source: BinaryIO) -> None:
+        path = os.path.join(job_dir, f"{len(documents)}_{os.path.basename(filename)}")
+        with open(path, "wb") as target:
+            shutil.copyfileobj(source, target)
+        documents.append((filename, path))
+
+    try:
+        for filename, source in uploads:
+            if filename.lower().endswith(".zip"):
+                with zipfile.ZipFile(source) as archive:
+                    entries = [
+                        entry for entry in archive.infolist()
+                        if not entry.is_dir() and _is_document(entry.filename) and not entry.filename.startswith("__MACOSX/")
+                    ]
+                    if len(entries) > INGEST_MAX_ZIP_ENTRIES:
+                        raise ValueError(f"{filename} holds more than {INGEST_MAX_ZIP_ENTRIES} documents")
+                    if sum(entry.file_size for entry in entries) > INGEST_MAX_ZIP_BYTES:
+                        raise ValueError(f"{filename} expands to more than {INGEST_MAX_ZIP_BYTES} bytes")
+                    for entry in entries:
+                        with archive.open(entry) as member:
+                            spool(entry.filename, member)
+            elif _is_document(filename):
+                spool(filename, source)
+            else:
+                raise ValueError(f"Unsupported file {filename}: only .pdf, .txt and .zip files are supported.")
+    except Exception:
+        shutil.rmtree(job_dir, ignore_errors=True)
+        raise
+    return documents
+
+
+class IngestionJobStore:
+    """
+    Status of ingestion jobs, in Redis when available (so API and workers share it) or in memory.
+
+    A job holds one entry per document with its stage, chunk counts and error; the job status
+    and progress are derived from them.
+    """
+
+    KEY_PREFIX = "ingest:job:"
+
+    def __init__(self, redis_client=None, ttl: int = INGEST_JOB_TTL):
+        self.redis_client = redis_client
+        self.ttl = ttl
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        # documents of a job are updated by several stage workers of one process
+        self._lock = threading.Lock()
+
+    def _load(self, job_id: str) -> Optional[Dict[str, Any]]:
+        if self.redis_client is None:
+            return self._jobs.get(job_id)
+        data = self.redis_client.get(self.KEY_PREFIX + job_id)
+        return json.loads(data) if data else None
+
+    def _save(self, job: Dict[str, Any]) -> None:
+        job["updated_at"] = time.time()
+        if self.redis_client is None:
+            self._jobs[job["job_id"]] = job
+        else:
+            self.redis_client.setex(self.KEY_PREFIX + job["job_id"], self.ttl, json.dumps(job))
+
+    def create(self, job_id: str, documents: Sequence[Tuple[str, str]], collection: str = DEFAULT_COLLECTION,
+               chunking_method: str = DEFAULT_CHUNKING_METHOD) -> Dict[str, Any]:
+        job = {
+            "job_id": job_id,
+            "collection": collection,
+            "chunking_method": chunking_method,
+            "status": "queued",
+            "created_at": time.time(),
+            "documents": [
+                {
+                    "filename": filename,
+                    "path": path,
+                    # known once the previous version of the document (if any) is looked up
+                    "document_id": None,
+                    "status": "queued",
+                    "num_chunks": None,
+                    "chunks_stored": 0,
+                    "chunks_unchanged": 0,
+                    "chunks_deleted": 0,
+                    "error": None
+                }
+                for filename, path in documents
+            ]
+        }
+        with self._lock:
+            self._refresh(job)
+            self._save(job)
+        return job
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._load(job_id)
+
+    def update_document(self, job_id: str, index: int, **fields: Any) -> None:
+        with self._lock:
+            job = self._load(job_id)
+            if job is None:
+                return
+            job["documents"][index].update(fields)
+            self._refresh(job)
+            self._save(job)
+
+    @staticmethod
+    def _refresh(job: Dict[str, Any]) -> None:
+        documents = job["documents"]
+        statuses = [document["status"] for document in documents]
+        if all(status in FINISHED for status in statuses):
+            failed = statuses.count("failed")
+            job["status"] = "completed" if not failed else "failed" if failed == len(statuses) else "completed_with_errors"
+        elif all(status == "queued" for status in statuses):
+            job["status"] = "queued"
+        else:
+            job["status"] = "running"
+        job["progress"] = {
+            "documents_total": len(documents),
+            "documents_done": sum(status in FINISHED for status in statuses),
+            "chunks_total": sum(document["num_chunks"] or 0 for document in documents),
+            "chunks_stored": sum(document["chunks_stored"] for document in documents)
+        }
+
+    @staticmethod
+    def public(job: Dict[str, Any]) -> Dict[str, Any]:
+        """Job as returned by the API, without spool paths"""
+        return {**job, "documents": [{k: v for k, v in document.items() if k != "path"} for document in job["documents"]]}
+
+
+@dataclass
+class _DocumentTask:
+    job_id: str
+    index: int
+    filename: str
+    path: str
+    collection: str = DEFAULT_COLLECTION
+    chunking_method: str = DEFAULT_CHUNKING_METHOD
+    document_id: Optional[str] = None
+    plan: Optional[DocumentPlan] = None
+    pending_batches: int = 0
+    chunking_done: bool = False
+    completed: bool = False
+    stored_ids: List[str] = field(default_factory=list)
+    failed: bool = False
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+
+class IngestionPipeline:
+    """
+    Staged ingestion: extract + chunk -> embed -> store, each stage with its own worker threads.
+
+    Extracted text streams page by page (or block by block) into the chunker, which emits batches
+    of `embed_batch_size` chunks as soon as they are complete, so while one batch is embedded
+    (CPU bound) earlier batches are written to PostgreSQL and the vector store (I/O bound) and no
+    document is ever held in memory whole. Queues between stages are bounded, which holds back
+    extraction when embedding is the bottleneck.
+
+    Ingestion is incremental: an upload identical to the stored version of the file is skipped,
+    only new or moved chunks are embedded (through the embedding cache) and written, and chunks
+    that disappeared are deleted once every batch is stored. Each batch is written atomically;
+    when a later batch of a document fails, the chunks this run added are removed again and the
+    document is marked failed.
+    """
+
+    def __init__(self, job_store: IngestionJobStore, extract_workers: int = INGEST_EXTRACT_WORKERS,
+                 embed_workers: int = INGEST_EMBED_WORKERS,
+                 store_workers: int = INGEST_STORE_WORKERS, embed_batch_size: int = INGEST_EMBED_BATCH_SIZE,
+                 queue_size: int = INGEST_QUEUE_SIZE):
+        self.job_store = job_store
+        self.embed_batch_size = embed_batch_size
+
+        # documents waiting for extraction are only paths, that queue is unbounded
+        self._extract_queue: "queue.Queue" = queue.Queue()
+        self._embed_queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self._store_queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+
+        stages = [
+            ("extract", self._extract_queue, self._extract, extract_workers),
+            ("embed", self._embed_queue, self._embed, embed_workers),
+            ("store", self._store_queue, self._store, store_workers),
+        ]
+        for name, inbox, handler, workers in stages:
+            for i in range(max(1, workers)):
+                threading.Thread(target=self._run_stage, args=(inbox, handler), name=f"ingest-{name}-{i}", daemon=True).start()
+
+    def submit(self, job: Dict[str, Any]) -> None:
+        """Queue every document of a job"""
+        for index, document in enumerate(job["documents"]):
+            if document["status"] in FINISHED:
+                continue
+            task = _DocumentTask(job["job_id"], index, document["filename"], document["path"], job.get("collection", DEFAULT_COLLECTION),
+                                 job.get("chunking_method", DEFAULT_CHUNKING_METHOD))
+            self._extract_queue.put((task,))
+
+    def _run_stage(self, inbox: "queue.Queue", handler) -> None:
+        while True:
+            # items are tuples of handler arguments, starting with the document task
+            item = inbox.get()
+            task = item[0]
+            try:
+                if not task.failed:
+                    handler(*item)
+            except Exception as e:
+                self._fail(task, e)
+            finally:
+                inbox.task_done()
+
+    def _update(self, task: _DocumentTask, **fields: Any) -> None:
+        self.job_store.update_document(task.job_id, task.index, **fields)
+
+    def _extract(self, task: _DocumentTask) -> None:
+        self._update(task, status="extracting")
+        ensure_schema()
+        plan = task.plan = DocumentPlan.for_document(task.filename, file_hash(task.path), DEFAULT_EMBEDDING_MODEL, task.collection,
+                                                    task.chunking_method)
+        task.document_id = plan.document_id
+        if plan.unchanged:
+            print(f"Document {task.filename} is unchanged, skipping it")
+            with task.lock:
+                task.completed = True
+                self._update(task, status="completed", document_id=plan.document_id,
+                             num_chunks=plan.stored_chunks, chunks_unchanged=plan.stored_chunks)
+            self._discard_upload(task)
+            return
+        self._update(task, document_id=plan.document_id)
+
+        # extraction and chunking, including waits for room in the embed queue
+        with ExitStack() as stack, timed_stage("ingest_extract"):
+            if task.filename.lower().endswith(".pdf"):
+                # by path: large PDFs are extracted by the process pool, which opens the file itself
+                pieces = iter_text_from_pdf(task.path)
+            else:
+                pieces = iter_text_from_txt(stack.enter_context(open(task.path, "rb")))
+
+            # batch of chunks to write, as (index, chunk_id, chunk_hash, text)
+            batch: List[Tuple[int, str, str, str]] = []
+            unchanged = 0
+            for index, chunk in enumerate(iter_chunks(pieces, task.chunking_method)):
+                if task.failed:
+                    return
+                chunk_id, chunk_hash, needs_write = plan.assign(chunk, index)
+                if not needs_write:
+                    unchanged += 1
+                    continue
+                batch.append((index, chunk_id, chunk_hash, chunk))
+                if len(batch) == self.embed_batch_size:
+                    self._queue_batch(task, batch, unchanged)
+                    batch = []
+            if batch:
+                self._queue_batch(task, batch, unchanged)
+
+        print(f"Total number of chunks: {plan.num_chunks}")
+        with task.lock:
+            self._update(task, num_chunks=plan.num_chunks, chunks_unchanged=unchanged)
+            task.chunking_done = True
+        self._complete_if_done(task)
+
+    def _queue_batch(self, task: _DocumentTask, batch: List[Tuple[int, str, str, str]], unchanged: int) -> None:
+        with task.lock:
+            task.pending_batches += 1
+        self._update(task, num_chunks=task.plan.num_chunks, chunks_unchanged=unchanged)
+        indexes, chunk_ids, chunk_hashes, texts = (list(column) for column in zip(*batch))
+        self._embed_queue.put((task, indexes, chunk_ids, chunk_hashes, texts))
+
+    def _embed(self, task: _DocumentTask, indexes: List[int], chunk_ids: List[str], chunk_hashes: List[str], texts: List[str]) -> None:
+        with timed_stage("ingest_embed"):
+            vectors = encode_with_cache(texts, chunk_hashes, DEFAULT_EMBEDDING_MODEL)
+        self._store_queue.put((task, indexes, chunk_ids, chunk_hashes, texts, vectors))
+
+    def _store(self, task: _DocumentTask, indexes: List[int], chunk_ids: List[str], chunk_hashes: List[str], texts: List[str], vectors) -> None:
+        metadata = build_chunk_metadata(task.document_id, chunk_ids, task.filename, indexes, task.collection)
+        store = get_vector_store()
+        with get_raw_connection() as conn:
+            with timed_stage("ingest_store"):
+                write_chunks(conn, store, task.document_id, chunk_ids, texts, vectors, metadata,
+                             DEFAULT_EMBEDDING_MODEL, task.chunking_method, chunk_indexes=indexes, chunk_hashes=chunk_hashes,
+                             namespace=namespace_for(task.collection),
+                             new_ids=[chunk_id for chunk_id in chunk_ids if task.plan.is_new(chunk_id)])
+            # status updates of a document are ordered by its lock, a late batch never overwrites "completed"
+            with task.lock:
+                failed = task.failed
+                if not failed:
+                    task.stored_ids.extend(chunk_ids)
+                    task.pending_batches -= 1
+                    self._update(task, status="storing", chunks_stored=len(task.stored_ids))
+            if failed:
+                # another batch of the document failed meanwhile, undo what this one added
+                remove_chunks(conn, store, task.document_id, [chunk_id for chunk_id in chunk_ids if task.plan.is_new(chunk_id)],
+                              namespace_for(task.collection))
+                return
+        self._complete_if_done(task)
+
+    def _complete_if_done(self, task: _DocumentTask) -> None:
+        # done once chunking has finished and every batch is stored
+        with task.lock:
+            if task.failed or task.completed or not task.chunking_done or task.pending_batches:
+                return
+            task.completed = True
+        try:
+            with get_raw_connection() as conn, timed_stage("ingest_finalize"):
+                deleted = finalize_document(conn, get_vector_store(), task.plan)
+        except Exception as e:
+            self._fail(task, e)
+            return
+        if task.stored_ids or deleted:
+            # bumped before the job reports completion, cached answers of the old corpus stop matching
+            from services.redis_service import get_redis_service
+
+            get_redis_service().bump_corpus_version()
+        self._update(task, status="completed", chunks_deleted=deleted)
+        self._discard_upload(task)
+
+    def _fail(self, task: _DocumentTask, error: Exception) -> None:
+        with task.lock:
+            if task.failed:
+                return
+            task.failed = True
+            # chunks that existed before this run stay, only the ones it added are removed
+            stored_ids = [chunk_id for chunk_id in task.stored_ids if task.plan is None or task.plan.is_new(chunk_id)]
+        print(f"Ingestion of {task.filename} (job {task.job_id}) failed: {error}")
+        if stored_ids:
+            try:
+                with get_raw_connection() as conn:
+                    remove_chunks(conn, get_vector_store(), task.document_id, stored_ids, namespace_for(task.collection))
+                chunk_text_cache.discard(stored_ids)
+            except Exception as e:
+                print(f"Failed to remove partially stored document {task.document_id}: {e}")
+        self._update(task, status="failed", chunks_stored=0, error=str(error))
+        self._discard_upload(task)
+
+    @staticmethod
+    def _discard_upload(task: _DocumentTask) -> None:
+        try:
+            os.remove(task.path)
+            os.rmdir(os.path.dirname(task.path))
+        except OSError:
+            # other documents of the job are still spooled
+            pass
+
+
+class IngestionService:
+    """Entry point of the upload API: records jobs and hands them to the local pipeline or the Redis queue"""
+
+    def __init__(self, redis_client=None, mode: str = INGEST_WORKER_MODE):
+        if mode == "redis" and redis_client is None:
+            print("INGEST_WORKER_MODE=redis needs Redis, running ingestion in-process")
+            mode = "local"
+        self.mode = mode
+        self.redis_client = redis_client
+        self.job_store = IngestionJobStore(redis_client)
+        self._pipeline: Optional[IngestionPipeline] = None
+        self._pipeline_lock = threading.Lock()
+
+    @property
+    def pipeline(self) -> IngestionPipeline:
+        if self._pipeline is None:
+            with self._pipeline_lock:
+                if self._pipeline is None:
+                    self._pipeline = IngestionPipeline(self.job_store)
+        return self._pipeline
+
+    def submit(self, job_id: str, documents: Sequence[Tuple[str, str]], collection: str = DEFAULT_COLLECTION,
+               chunking_method: str = DEFAULT_CHUNKING_METHOD) -> Dict[str, Any]:
+        """Create a job for spooled documents of a collection, chunked with `chunking_method`, and queue it; returns the job status"""
+        job = self.job_store.create(job_id, documents, collection, chunking_method)
+        if self.mode == "redis":
+            self.redis_client.rpush(QUEUE_KEY, job_id)
+        else:
+            self.pipeline.submit(job)
+        return IngestionJobStore.public(job)
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = self.job_store.get(job_id)
+        return IngestionJobStore.public(job) if job else None
+
+    def run_worker(self) -> None:
+        """Consume jobs queued by API processes running in redis mode, until interrupted"""
+        if self.redis_client is None:
+            raise RuntimeError("The ingestion worker needs Redis")
+        print(f"Ingestion worker waiting for jobs on {QUEUE_KEY}")
+        while True:
+            item = self.redis_client.blpop(QUEUE_KEY, timeout=5)
+            if not item:
+                continue
+            job = self.job_store.get(item[1])
+            if job is None:
+                print(f"Ingestion job {item[1]} expired before it was picked up")
+                continue
+            self.pipeline.submit(job)
+
+
+def delete_collection(collection: str) -> Optional[Dict[str, int]]:
+    """
+    Delete every document of a collection in bulk; None when the collection holds no documents.
+
+    Document and chunk rows go in one transaction, then the collection's vector store namespace and
+    lexical index entries as a whole. Cached answers stop matching because the corpus version is
+    bumped; chunk texts left in the in-process cache are never looked up again and age out.
+    """
+    ensure_schema()
+    with get_raw_connection() as conn:
+        try:
+            documents, chunks = delete_collection_rows(conn, collection)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    if not documents:
+        return None
+
+    namespace = namespace_for(collection)
+    # without rows, vectors left behind by a failure here are never hydrated into an answer
+    get_vector_store().delete(namespace=namespace, delete_all=True)
+    if LEXICAL_INDEX_ENABLED:
+        get_lexical_index().delete_namespace(namespace)
+
+    from services.redis_service import get_redis_service
+
+    get_redis_service().bump_corpus_version()
+    print(f"Deleted collection {collection}: {documents} documents, {chunks} chunks")
+    return {"documents_deleted": documents, "chunks_deleted": chunks}
+
+
+_ingestion_service: Optional[IngestionService] = None
+_ingestion_service_lock = threading.Lock()
+
+
+def get_ingestion_service() -> IngestionService:
+    """Return the process-wide ingestion service, created on first use"""
+    global _ingestion_service
+    if _ingestion_service is None:
+        with _ingestion_service_lock:
+            if _ingestion_service is None:
+                from services.redis_service import get_redis_service
+
+                _ingestion_service = IngestionService(get_redis_service().redis_client)
+    return _ingestion_service
+
+
+if __name__ == "__main__":
+    # worker process for INGEST_WORKER_MODE=redis: python -m services.ingestion
+    get_ingestion_service().run_worker()
@@ -0,0 +1,158 @@
+import asyncio
+import os
+import re
+import threading
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+from services.embedding_engine import encode_queries
+from services.query_batcher import query_batcher
+
+load_dotenv()
+
+INTENT_ROUTER_ENABLED = os.getenv("INTENT_ROUTER_ENABLED", "true").lower() in ("1", "true", "yes")
+# best exemplar similarity needed to route a question to retrieval directly
+INTENT_ROUTER_MIN_SCORE = float(os.getenv("INTENT_ROUTER_MIN_SCORE", 0.45))
+# and its lead over the best exemplar of any other intent
+INTENT_ROUTER_MIN_MARGIN = float(os.getenv("INTENT_ROUTER_MIN_MARGIN", 0.08))
+
+# labelled examples per intent; only "documents" is routed without the agent
+INTENT_EXEMPLARS: Dict[str, List[str]] = {
+    "documents": [
+        "What does the document say about this topic?",
+        "Summarize the uploaded file",
+        "According to the report, what are the main findings?",
+        "Explain the section about the project requirements",
+        "What is the capital of Nepal?",
+        "Who is mentioned in the document?",
+        "List the key points from the PDF",
+        "What are the benefits described in the text?",
+        "When did the event described happen?",
+        "How does the process described in the document work?",
+        "Give me details about the history of the company",
+        "What information is there about pricing?",
+    ],
+    "booking": [
+        "I want to book an interview",
+        "Schedule an interview for tomorrow at 10am",
+        "Can you book a meeting for me?",
+        "My name is John, email john@example.com, book me for Monday at 3pm",
+        "Reschedule my appointment",
+        "I'd like to set up a call next week",
+    ],
+    "conversation": [
+        "What name did I give you?",
+        "What did I say earlier?",
+        "What time did you book my interview for?",
+        "Can you repeat your last answer?",
+        "Tell me more about that",
+        "Thanks, that's helpful",
+        "Hello, how are you?",
+        "Who are you?",
+    ],
+}
+
+# cheap rules that always leave the decision to the agent
+_AGENT_RULES: List[Tuple[str, "re.Pattern[str]"]] = [
+    ("booking", re.compile(r"\b(book(ing|ed)?|schedul\w*|reschedul\w*|appointment|interview|meeting|slot)\b", re.IGNORECASE)),
+    ("conversation", re.compile(r"\b(earlier|previous(ly)?|last time|you said|i said|i told|i gave|my name|remember|again)\b", re.IGNORECASE)),
+    ("email", re.compile(r"[\w.+-]+@[\w-]+\.[\w.]+")),
+    # short follow-ups ("and that?", "why?") depend on the conversation context
+    ("follow-up", re.compile(r"^\W*(and|but|so|why|what about|how about|more|it|that|this)\b[^.?!]{0,30}[.?!]?\s*$", re.IGNORECASE)),
+]
+
+
+@dataclass
+class RouteDecision:
+    """Where a /chat message goes: "documents" (straight to retrieval) or "agent" """
+
+    route: str
+    intent: str
+    score: float
+    margin: float
+    reason: str
+    embedding: Optional[np.ndarray] = None
+
+
+class IntentRouter:
+    """
+    Embedding-based intent router in front of the ReAct agent.
+
+    The query embedding (the same MiniLM vector retrieval uses) is compared with labelled intent
+    exemplars. Clear document questions, whose nearest exemplar is a document question by at
+    least `min_margin` with similarity >= `min_score`, go straight to retrieval and skip the
+    agent's planning LLM call. Booking requests, references to the conversation, very short
+    messages and anything ambiguous fall back to the agent.
+    """
+
+    def __init__(self, exemplars: Optional[Dict[str, List[str]]] = None, min_score: float = INTENT_ROUTER_MIN_SCORE,
+                 min_margin: float = INTENT_ROUTER_MIN_MARGIN, encode_fn: Callable[[List[str]], np.ndarray] = encode_queries):
+        self.exemplars = INTENT_EXEMPLARS if exemplars is None else exemplars
+        self.min_score = min_score
+        self.min_margin = min_margin
+        self.encode_fn = encode_fn
+        self._matrix: Optional[np.ndarray] = None
+        self._labels: List[str] = []
+        self._lock = threading.Lock()
+        self.counts: Dict[str, int] = {"documents": 0, "agent": 0}
+
+    def _exemplar_matrix(self) -> Tuple[np.ndarray, List[str]]:
+        # exemplars are embedded once, on first use
+        if self._matrix is None:
+            with self._lock:
+                if self._matrix is None:
+                    labels = [intent for intent, texts in self.exemplars.items() for _ in texts]
+                    texts = [text for intent_texts in self.exemplars.values() for text in intent_texts]
+                    self._labels = labels
+                    self._matrix = np.asarray(self.encode_fn(texts), dtype=np.float32)
+        return self._matrix, self._labels
+
+    @staticmethod
+    def _rule(query: str) -> Optional[str]:
+        if len(query.split()) < 3:
+            return "short message"
+        for name, pattern in _AGENT_RULES:
+            if pattern.search(query):
+                return f"{name} rule"
+        return None
+
+    def decide(self, query: str, embedding: np.ndarray) -> RouteDecision:
+        """Route a query given its (normalized) embedding"""
+        matrix, labels = self._exemplar_matrix()
+        similarities = matrix @ np.asarray(embedding, dtype=np.float32).reshape(-1)
+        best: Dict[str, float] = {}
+        for label, similarity in zip(labels, similarities):
+            best[label] = max(best.get(label, -1.0), float(similarity))
+        ranked = sorted(best.items(), key=lambda item: item[1], reverse=True)
+        intent, score = ranked[0]
+        margin = score - ranked[1][1] if len(ranked) > 1 else score
+
+        rule = self._rule(query)
+        if rule is not None:
+            decision = RouteDecision("agent", intent, score, margin, rule, embedding)
+        elif intent == "documents" and score >= self.min_score and margin >= self.min_margin:
+            decision = RouteDecision("documents", intent, score, margin, "confident document question", embedding)
+        else:
+            decision = RouteDecision("agent", intent, score, margin, "not confident", embedding)
+        self.counts[decision.route] += 1
+        return decision
+
+    def warmup(self) -> None:
+        """Embed the exemplars now instead of on the first routed query"""
+        self._exemplar_matrix()
+
+    def route(self, query: str) -> RouteDecision:
+        return self.decide(query, query_batcher.encode(query))
+
+    async def aroute(self, query: str) -> RouteDecision:
+        embedding = await query_batcher.aencode(query)
+        if self._matrix is None:
+            await asyncio.to_thread(self._exemplar_matrix)
+        return self.decide(query, embedding)
+
+
+# Global router instance
+intent_router = IntentRouter()
@@ -0,0 +1,492 @@
+import json
+import math
+import os
+import re
+import threading
+from array import array
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from services.corpus_collections import DEFAULT_COLLECTION, namespace_for
+from services.vector_store import VectorMatch, matches_filter
+
+load_dotenv()
+
+# chunks are added to the index as they are written, so hybrid retrieval can be switched on at any time
+LEXICAL_INDEX_ENABLED = os.getenv("LEXICAL_INDEX_ENABLED", "true").lower() in ("1", "true", "yes")
+LEXICAL_INDEX_PATH = os.getenv("LEXICAL_INDEX_PATH", "data/lexical_index")
+BM25_K1 = float(os.getenv("BM25_K1", 1.2))
+BM25_B = float(os.getenv("BM25_B", 0.75))
+
+_token = re.compile(r"[^\W_]+")
+
+# frequent enough that their postings would dominate query time, rare enough in questions to matter
+STOPWORDS = frozenset(
+    "a an and are as at be but by did do does for from had has have how i if in into is it its me my of on or "
+    "so than that the their them then there these they this to was we were what when where which who why will "
+    "with you your".split()
+)
+
+# term frequencies are stored as uint16
+_MAX_TF = 65535
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased alphanumeric terms of a text, stopwords removed (identifiers like INV-0042 become inv, 0042)"""
+    return [term for term in _token.findall(text.lower()) if term not in STOPWORDS]
+
+
+class LexicalIndex:
+    """
+    BM25 index over chunk texts, persisted to a directory.
+
+    Postings are compact arrays per term (uint32 rows, uint16 term frequencies) that grow by
+    appending, so adding a chunk is cheap and queries score whole posting lists with numpy.
+    Deleted and replaced chunks leave dead rows behind until the next compaction. Chunks belong
+    to namespaces like the vectors; queries can be restricted to some of them.
+
+    - index.npz: snapshot of the index, postings in CSR layout (offsets into one rows/tfs array)
+    - log.jsonl: upserts and deletes since the snapshot, replayed on load; folded into a new
+      snapshot by `compact` once it holds as many entries as the snapshot has chunks
+    - lock: flock'd exclusively to append to the log or compact, shared to read them
+
+    API and ingestion workers share the directory: before every change and query, an index
+    replays the log entries other processes appended since it last looked, and reloads the
+    snapshot when another process compacted. Compaction replays the whole log first, so it
+    never drops other processes' entries. Without fcntl (Windows) only one process may use it.
+    """
+
+    def __init__(self, path: str, k1: float = BM25_K1, b: float = BM25_B, compact_min_entries: int = 10000):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.compact_min_entries = compact_min_entries
+
+        self._lock = threading.RLock()
+        self._reset()
+
+        os.makedirs(path, exist_ok=True)
+        self._snapshot_path = os.path.join(path, "index.npz")
+        self._log_path = os.path.join(path, "log.jsonl")
+        self._lock_file = open(os.path.join(path, "lock"), "a")
+        # append mode: writes land at the end of the log whatever other processes wrote
+        self._log = open(self._log_path, "a")
+        with self._lock, self._file_lock(exclusive=True):
+            self._sync()
+            self._maybe_compact()
+
+    def _reset(self) -> None:
+        self._postings: Dict[str, Tuple[array, array]] = {}
+        self._ids: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self._metadata: List[Dict[str, Any]] = []
+        self._lengths = array("I")
+        self._alive = array("b")
+        # namespace of every row, as an index into _namespace_names
+        self._row_namespaces = array("H")
+        self._namespace_names: List[str] = []
+        self._namespace_codes: Dict[str, int] = {}
+        self._live_count = 0
+        self._live_length = 0
+        self._log_entries = 0
+        # how far the log has been replayed, and which snapshot it was replayed over
+        self._log_offset = 0
+        self._log_torn = False
+        self._snapshot_id: Optional[Tuple[int, int, int]] = None
+
+    # -- persistence --
+
+    @contextmanager
+    def _file_lock(self, exclusive: bool):
+        """Hold the directory lock against other processes; callers hold self._lock, flock is per open file"""
+        if fcntl is None:
+            yield
+            return
+        fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _stat_snapshot(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            stat = os.stat(self._snapshot_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _log_size(self) -> int:
+        try:
+            return os.path.getsize(self._log_path)
+        except FileNotFoundError:
+            return 0
+
+    def _refresh(self) -> None:
+        """Catch up with the changes other processes made, if any"""
+        if self._stat_snapshot() == self._snapshot_id and self._log_size() == self._log_offset:
+            return
+        with self._file_lock(exclusive=False):
+            self._sync()
+
+    def _sync(self) -> None:
+        """Reload the snapshot if another process compacted, then replay the log entries not applied yet; needs the file lock"""
+        snapshot_id = self._stat_snapshot()
+        if snapshot_id != self._snapshot_id:
+            self._reset()
+            self._load_snapshot()
+            self._snapshot_id = snapshot_id
+        if self._log_size() < self._log_offset:
+            # truncated without a new snapshot: only a lost snapshot does that, start over
+            self._reset()
+            self._load_snapshot()
+            self._snapshot_id = snapshot_id
+        self._replay_log()
+
+    def _load_snapshot(self) -> None:
+        if os.path.exists(self._snapshot_path):
+            with np.load(self._snapshot_path) as snapshot:
+                terms = bytes(snapshot["terms"]).decode("utf-8").split("\n") if len(snapshot["terms"]) else []
+                offsets, rows, tfs = snapshot["offsets"], snapshot["rows"], snapshot["tfs"]
+                for i, term in enumerate(terms):
+                    start, end = offsets[i], offsets[i + 1]
+                    self._postings[term] = (array("I", rows[start:end].tobytes()), array("H", tfs[start:end].tobytes()))
+                self._lengths = array("I", snapshot["lengths"].tobytes())
+                self._ids = bytes(snapshot["ids"]).decode("utf-8").split("\n") if len(snapshot["ids"]) else []
+                self._metadata = json.loads(bytes(snapshot["metadata"]).decode("utf-8"))
+                self._namespace_names = json.loads(bytes(snapshot["namespace_names"]).decode("utf-8"))
+                self._row_namespaces = array("H", snapshot["row_namespaces"].tobytes())
+            self._namespace_codes = {namespace: code for code, namespace in enumerate(self._namespace_names)}
+            self._rows = {id: row for row, id in enumerate(self._ids)}
+            self._alive = array("b", [1]) * len(self._ids)
+            self._live_count = len(self._ids)
+            self._live_length = sum(self._lengths)
+
+    def _replay_log(self) -> None:
+        if not os.path.exists(self._log_path):
+            return
+        with open(self._log_path, "rb") as f:
+            f.seek(self._log_offset)
+            data = f.read()
+        if not data:
+            return
+        self._log_offset += len(data)
+        # writers hold the lock for whole records, so only a crash mid-write leaves the log without a final newline
+        self._log_torn = not data.endswith(b"\n")
+        for line in data.split(b"\n"):
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # blank line or a record torn by a crash mid-write
+                continue
+            if entry["op"] == "upsert":
+                self._apply_upsert(entry["id"], entry["terms"], entry["length"], entry["metadata"], entry.get("namespace", ""))
+            elif entry["op"] == "delete_namespace":
+                self._apply_delete_namespace(entry["namespace"])
+            else:
+                self._apply_delete(entry["id"])
+            self._log_entries += 1
+
+    def compact(self) -> None:
+        """Write a snapshot without the dead rows and start a new log"""
+        with self._lock, self._file_lock(exclusive=True):
+            self._sync()
+            self._compact()
+
+    def _compact(self) -> None:
+        # holds both locks and has replayed the whole log: the snapshot covers every process's entries
+        live = [row for row in range(len(self._ids)) if self._alive[row]]
+        new_row = np.full(len(self._ids), -1, dtype=np.int64)
+        new_row[live] = np.arange(len(live))
+
+        terms: List[str] = []
+        offsets = [0]
+        row_parts: List[np.ndarray] = []
+        tf_parts: List[np.ndarray] = []
+        postings: Dict[str, Tuple[array, array]] = {}
+        for term, (rows, tfs) in self._postings.items():
+            rows_array = new_row[np.frombuffer(rows, dtype=np.uint32)]
+            keep = rows_array >= 0
+            if not keep.any():
+                continue
+            kept_rows = rows_array[keep].astype(np.uint32)
+            kept_tfs = np.frombuffer(tfs, dtype=np.uint16)[keep]
+            terms.append(term)
+            offsets.append(offsets[-1] + len(kept_rows))
+            row_parts.append(kept_rows)
+            tf_parts.append(kept_tfs)
+            postings[term] = (array("I", kept_rows.tobytes()), array("H", kept_tfs.tobytes()))
+
+        ids = [self._ids[row] for row in live]
+        metadata = [self._metadata[row] for row in live]
+        lengths = np.frombuffer(self._lengths, dtype=np.uint32)[live] if live else np.zeros(0, dtype=np.uint32)
+        row_namespaces = np.frombuffer(self._row_namespaces, dtype=np.uint16)[live] if live else np.zeros(0, dtype=np.uint16)
+
+        tmp_path = self._snapshot_path + ".tmp.npz"
+        np.savez(
+            tmp_path,
+            terms=np.frombuffer("\n".join(terms).encode("utf-8"), dtype=np.uint8),
+            offsets=np.asarray(offsets, dtype=np.int64),
+            rows=np.concatenate(row_parts) if row_parts else np.zeros(0, dtype=np.uint32),
+            tfs=np.concatenate(tf_parts) if tf_parts else np.zeros(0, dtype=np.uint16),
+            lengths=lengths,
+            ids=np.frombuffer("\n".join(ids).encode("utf-8"), dtype=np.uint8),
+            metadata=np.frombuffer(json.dumps(metadata).encode("utf-8"), dtype=np.uint8),
+            namespace_names=np.frombuffer(json.dumps(self._namespace_names).encode("utf-8"), dtype=np.uint8),
+            row_namespaces=row_namespaces
+        )
+        os.replace(tmp_path, self._snapshot_path)
+        # other processes see the new snapshot and reload it; replaying the old log over it would be
+        # harmless, upserts and deletes are idempotent
+        self._log.truncate(0)
+        self._snapshot_id = self._stat_snapshot()
+        self._log_offset = 0
+        self._log_torn = False
+
+        self._postings = postings
+        self._ids = ids
+        self._rows = {id: row for row, id in enumerate(ids)}
+        self._metadata = metadata
+        self._lengths = array("I", lengths.tobytes())
+        self._row_namespaces = array("H", row_namespaces.tobytes())
+        self._alive = array("b", [1]) * len(ids)
+        self._log_entries = 0
+
+    def _maybe_compact(self) -> None:
+        if self._log_entries >= max(self.compact_min_entries, self._live_count):
+            self._compact()
+
+    def clear(self) -> None:
+        """Remove every chunk, on disk too"""
+        with self._lock, self._file_lock(exclusive=True):
+            self._reset()
+            # an empty snapshot rather than none, so other processes notice and drop their chunks
+            self._compact()
+
+    def flush(self) -> None:
+        """Persist the log to disk"""
+        with self._lock:
+            self._log.flush()
+            os.fsync(self._log.fileno())
+
+    # -- bookkeeping --
+
+    def _namespace_code(self, namespace: str) -> int:
+        code = self._namespace_codes.get(namespace)
+        if code is None:
+            code = self._namespace_codes[namespace] = len(self._namespace_names)
+            self._namespace_names.append(namespace)
+        return code
+
+    def _apply_upsert(self, id: str, terms: Dict[str, int], length: int, metadata: Dict[str, Any], namespace: str) -> None:
+        self._apply_delete(id)
+        row = len(self._ids)
+        self._row_namespaces.append(self._namespace_code(namespace))
+        self._ids.append(id)
+        self._rows[id] = row
+        self._metadata.append(metadata)
+        self._lengths.append(length)
+        self._alive.append(1)
+        self._live_count += 1
+        self._live_length += length
+        for term, tf in terms.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = (array("I"), array("H"))
+            postings[0].append(row)
+            postings[1].append(min(tf, _MAX_TF))
+
+    def _apply_delete(self, id: str) -> None:
+        row = self._rows.pop(id, None)
+        if row is None:
+            return
+        self._alive[row] = 0
+        self._metadata[row] = {}
+        self._live_count -= 1
+        self._live_length -= self._lengths[row]
+
+    def _apply_delete_namespace(self, namespace: str) -> List[str]:
+        code = self._namespace_codes.get(namespace)
+        if code is None:
+            return []
+        ids = [self._ids[row] for row in range(len(self._ids)) if self._alive[row] and self._row_namespaces[row] == code]
+        for id in ids:
+            self._apply_delete(id)
+        return ids
+
+    # -- index --
+
+    def upsert(self, ids: Sequence[str], texts: Sequence[str], metadata: Sequence[Dict[str, Any]], namespace: str = "") -> None:
+        """Add or replace chunks of a namespace, one id and metadata dict (as stored with the vectors) per text"""
+        if not (len(ids) == len(texts) == len(metadata)):
+            raise ValueError("ids, texts and metadata must have the same length")
+        # tokenized outside the lock, concurrent ingestion batches only wait for the bookkeeping
+        entries = []
+        for id, text, meta in zip(ids, texts, metadata):
+            terms = tokenize(text)
+            entries.append((id, dict(Counter(terms)), len(terms), dict(meta)))
+        with self._lock, self._file_lock(exclusive=True):
+            self._sync()
+            lines = []
+            for id, terms, length, meta in entries:
+                self._apply_upsert(id, terms, length, meta, namespace)
+                lines.append(json.dumps({"op": "upsert", "id": id, "terms": terms, "length": length, "metadata": meta, "namespace": namespace}))
+            self._write_log(lines)
+
+    def delete(self, ids: Sequence[str]) -> None:
+        with self._lock, self._file_lock(exclusive=True):
+            self._sync()
+            lines = []
+            for id in ids:
+                if id in self._rows:
+                    self._apply_delete(id)
+                    lines.append(json.dumps({"op": "delete", "id": id}))
+            self._write_log(lines)
+
+    def delete_namespace(self, namespace: str) -> int:
+        """Remove every chunk of a namespace; returns how many were removed"""
+        with self._lock, self._file_lock(exclusive=True):
+            self._sync()
+            removed = len(self._apply_delete_namespace(namespace))
+            if removed:
+                self._write_log([json.dumps({"op": "delete_namespace", "namespace": namespace})])
+            return removed
+
+    def _write_log(self, lines: List[str]) -> None:
+        if not lines:
+            return
+        # finish a record torn by a crash, so it does not swallow the first of these
+        self._log.write(("\n" if self._log_torn else "") + "\n".join(lines) + "\n")
+        self._log.flush()
+        # nothing else was written since _sync, the lock is held
+        self._log_offset = self._log_size()
+        self._log_torn = False
+        self._log_entries += len(lines)
+        self._maybe_compact()
+
+    def query(self, text: str, top_k: int = 5, filter: Optional[Dict[str, Any]] = None,
+              namespaces: Optional[Sequence[str]] = None) -> List[VectorMatch]:
+        """
+        The `top_k` chunks with the highest BM25 score for `text`, best first, optionally restricted
+        by a metadata filter and to some namespaces (all of them by default).
+
+        Term statistics are those of the whole index, so scores do not depend on the namespaces searched.
+        """
+        terms = set(tokenize(text))
+        with self._lock:
+            self._refresh()
+            if not terms or not self._live_count or top_k <= 0:
+                return []
+            count = len(self._ids)
+            alive = np.frombuffer(self._alive, dtype=np.int8).astype(bool)
+            searched = alive
+            if namespaces is not None:
+                codes = [self._namespace_codes[namespace] for namespace in namespaces if namespace in self._namespace_codes]
+                searched = alive & np.isin(np.frombuffer(self._row_namespaces, dtype=np.uint16), codes)
+            lengths = np.frombuffer(self._lengths, dtype=np.uint32).astype(np.float32)
+            # copies: an array exporting its buffer cannot grow, and ingestion appends to them
+            postings = [
+                (np.frombuffer(rows, dtype=np.uint32).astype(np.int64), np.frombuffer(tfs, dtype=np.uint16).astype(np.float32))
+                for rows, tfs in (self._postings[term] for term in terms if term in self._postings)
+            ]
+            live_count = self._live_count
+            average_length = self._live_length / live_count or 1.0
+            # a refresh or compaction replaces these rather than renumbering them in place
+            ids, metadata, alive_rows = self._ids, self._metadata, self._alive
+
+        scores = np.zeros(count, dtype=np.float32)
+        norms = self.k1 * (1 - self.b + self.b * lengths / average_length)
+        for rows, tfs in postings:
+            live_rows = alive[rows]
+            df = int(live_rows.sum())
+            if not df:
+                continue
+            idf = math.log(1 + (live_count - df + 0.5) / (df + 0.5))
+            # a row appears at most once in a posting list, plain fancy indexing accumulates correctly
+            scores[rows] += np.where(live_rows, idf * tfs * (self.k1 + 1) / (tfs + norms[rows]), 0.0)
+
+        candidates = np.flatnonzero((scores > 0) & searched)
+        if filter:
+            with self._lock:
+                candidates = np.asarray([row for row in candidates if matches_filter(metadata[row], filter)], dtype=np.int64)
+        if not len(candidates):
+            return []
+        k = min(top_k, len(candidates))
+        top = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        with self._lock:
+            return [VectorMatch(ids[row], float(scores[row]), dict(metadata[row])) for row in top if alive_rows[row]]
+
+    def __len__(self) -> int:
+        return self._live_count
+
+
+_lexical_index: Optional[LexicalIndex] = None
+_lexical_index_lock = threading.Lock()
+
+
+def get_lexical_index() -> LexicalIndex:
+    """Return the process-wide lexical index stored in LEXICAL_INDEX_PATH, loaded on first use"""
+    global _lexical_index
+    if _lexical_index is None:
+        with _lexical_index_lock:
+            if _lexical_index is None:
+                _lexical_index = LexicalIndex(LEXICAL_INDEX_PATH)
+    return _lexical_index
+
+
+def rebuild_from_database(index: LexicalIndex, batch_size: int = 1000) -> int:
+    """Replace the index with every chunk stored in PostgreSQL, e.g. for a corpus ingested before it existed; returns the number of chunks"""
+    from database.db_conn import get_raw_connection
+    from database.documents import ensure_schema
+
+    ensure_schema()
+    index.clear()
+    total = 0
+    with get_raw_connection() as conn:
+        # named cursor: rows are streamed from the server instead of loaded at once
+        with conn.cursor(name="lexical_index_rebuild") as cursor:
+            cursor.itersize = batch_size
+            cursor.execute(
+                """
+                SELECT c.chunk_id::text, c.document_id::text, c.chunk_index, c.chunk_text, d.filename,
+                       COALESCE(d.collection, %s)
+                FROM chunks c LEFT JOIN documents d ON d.document_id = c.document_id
+                ORDER BY 6
+                """,
+                (DEFAULT_COLLECTION,)
+            )
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                # one upsert per collection of the batch, rows are ordered by collection
+                for collection in dict.fromkeys(row[5] for row in rows):
+                    batch = [row for row in rows if row[5] == collection]
+                    index.upsert(
+                        [row[0] for row in batch],
+                        [row[3] for row in batch],
+                        [
+                            {"document_id": document_id, "chunk_uuid": chunk_id, "chunk_index": chunk_index, "filename": filename,
+                             "collection": collection}
+                            for chunk_id, document_id, chunk_index, _, filename, _ in batch
+                        ],
+                        namespace=namespace_for(collection)
+                    )
+                total += len(rows)
+        conn.commit()
+    index.compact()
+    return total
+
+
+if __name__ == "__main__":
+    # python -m services.lexical_index: (re)build the index from the chunks in PostgreSQL
+    print(f"Indexed {rebuild_from_database(get_lexical_index())} chunks into {LEXICAL_INDEX_PATH}")
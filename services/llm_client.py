@@ -0,0 +1,213 @@
+import asyncio
+import os
+import threading
+import time
+import weakref
+from typing import TYPE_CHECKING, Any, Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+from langchain_core.callbacks import AsyncCallbackHandler, BaseCallbackManager
+from langchain_core.messages import BaseMessage
+from langchain_core.runnables.config import ensure_config
+
+from services.metrics import LLMMetricsCallback
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+if TYPE_CHECKING:
+    from langchain_core.language_models.chat_models import BaseChatModel
+
+load_dotenv()
+
+# "gemini" or "stub" (offline and deterministic, for load tests and profiling)
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini").lower()
+LLM_MODEL = os.getenv("LLM_MODEL", "gemini-1.5-pro")
+LLM_TEMPERATURE = float(os.getenv("LLM_TEMPERATURE", 0.7))
+# per attempt
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", 60))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 2))
+# whole call, retries and backoff included; keep it below CHAT_TIMEOUT_SECONDS so retries are not cut off by the request deadline
+LLM_DEADLINE_SECONDS = float(os.getenv("LLM_DEADLINE_SECONDS", 100))
+# calls in flight through the client, per process (sync) or event loop (async)
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 8))
+# request rate shared by the client and the agent, 0 for no limit
+LLM_REQUESTS_PER_SECOND = float(os.getenv("LLM_REQUESTS_PER_SECOND", 0))
+
+LLM_STUB_LATENCY_MS = float(os.getenv("LLM_STUB_LATENCY_MS", 200))
+LLM_STUB_TOKENS_PER_SECOND = float(os.getenv("LLM_STUB_TOKENS_PER_SECOND", 50))
+LLM_STUB_RESPONSE_WORDS = int(os.getenv("LLM_STUB_RESPONSE_WORDS", 64))
+
+
+def message_text(message: Any) -> str:
+    """Text content of a model response (content may be a list of parts)"""
+    content = message.content if hasattr(message, "content") else message
+    if isinstance(content, list):
+        return " ".join(part if isinstance(part, str) else str(part.get("text", part)) for part in content)
+    return str(content)
+
+
+def create_chat_model(backend: str = LLM_BACKEND) -> "BaseChatModel":
+    """Chat model of the configured backend; callers share the instance returned by get_llm_client()"""
+    # langchain's model classes import transformers, which is slow: loaded with the model, not at import
+    from langchain_core.rate_limiters import InMemoryRateLimiter
+
+    rate_limiter = InMemoryRateLimiter(requests_per_second=LLM_REQUESTS_PER_SECOND) if LLM_REQUESTS_PER_SECOND > 0 else None
+    if backend == "stub":
+        from services.llm_stub import StubChatModel
+
+        return StubChatModel(rate_limiter=rate_limiter, callbacks=[LLMMetricsCallback("stub")])
+    if backend == "gemini":
+        from langchain_google_genai import ChatGoogleGenerativeAI
+        from pydantic import SecretStr
+
+        api_key = os.getenv("GEMINI_API_KEY")
+        if not api_key:
+            raise ValueError("GEMINI_API_KEY environment variable is not set")
+        return ChatGoogleGenerativeAI(
+            model=LLM_MODEL,
+            temperature=LLM_TEMPERATURE,
+            api_key=SecretStr(api_key),
+            timeout=LLM_TIMEOUT_SECONDS,
+            # retries are done by LLMClient, with backoff and the timeout per attempt
+            max_retries=0,
+            rate_limiter=rate_limiter,
+            # token counts and call durations for /metrics
+            callbacks=[LLMMetricsCallback(LLM_MODEL)]
+        )
+    raise ValueError(f"Unknown LLM_BACKEND: {backend}")
+
+
+def _status_code(error: Exception) -> Optional[int]:
+    """HTTP status of an API error (google.api_core and httpx errors), None for other errors"""
+    for status in (getattr(error, "code", None), getattr(error, "status_code", None),
+                   getattr(getattr(error, "response", None), "status_code", None)):
+        if isinstance(status, int):
+            return status
+    return None
+
+
+def _is_retryable(error: Exception) -> bool:
+    """
+    Transient failures only: connection errors, rate limiting (429) and server errors (5xx).
+
+    Request, authentication and configuration errors fail the same way on every attempt, and a
+    timed-out attempt already used its whole share of the deadline.
+    """
+    if isinstance(error, asyncio.TimeoutError):
+        return False
+    status = _status_code(error)
+    if status is not None:
+        return status == 429 or 500 <= status < 600
+    if httpx is not None and isinstance(error, httpx.TransportError):
+        return True
+    return isinstance(error, ConnectionError)
+
+
+class _TokenWatcher(AsyncCallbackHandler):
+    """Notes whether a call streamed any token: once a token reached a client, the call is not retried"""
+
+    def __init__(self):
+        self.streamed = False
+
+    async def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        self.streamed = True
+
+
+def _watch_tokens(config: Optional[Dict[str, Any]]) -> Tuple[Dict[str, Any], _TokenWatcher]:
+    watcher = _TokenWatcher()
+    # merged with the config of the enclosing run first, whose callbacks stream the tokens to astream_events
+    config = dict(ensure_config(config))
+    callbacks = config.get("callbacks")
+    if isinstance(callbacks, BaseCallbackManager):
+        callbacks = callbacks.copy()
+        callbacks.add_handler(watcher, inherit=False)
+    else:
+        callbacks = [*(callbacks or []), watcher]
+    config["callbacks"] = callbacks
+    return config, watcher
+
+
+class LLMClient:
+    """
+    One chat model per process, shared by every caller so its HTTP/gRPC connections are reused.
+
+    `invoke`/`ainvoke` bound the calls in flight, apply a timeout per attempt and retry transient
+    failures with exponential backoff, as long as the retry fits in the deadline of the whole call
+    and no token of the failed attempt was streamed. The agent uses `model` directly and shares
+    its rate limit.
+    """
+
+    def __init__(self, model: "BaseChatModel", max_concurrency: int = LLM_MAX_CONCURRENCY, timeout: float = LLM_TIMEOUT_SECONDS,
+                 max_retries: int = LLM_MAX_RETRIES, backoff: float = 0.5, deadline: float = LLM_DEADLINE_SECONDS):
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.deadline = deadline
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        # asyncio semaphores belong to one event loop
+        self._async_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+    def _retry_delay(self, attempt: int, error: Exception, deadline: float, streamed: bool) -> Optional[float]:
+        """Backoff before the next attempt, None when the error must be raised"""
+        if attempt == self.max_retries or streamed or not _is_retryable(error):
+            return None
+        delay = self.backoff * 2 ** attempt
+        # an attempt that could only run for a moment before the deadline is not worth starting
+        if time.monotonic() + delay + 1.0 > deadline:
+            return None
+        return delay
+
+    def invoke(self, prompt: Any, config: Optional[Dict[str, Any]] = None) -> BaseMessage:
+        # the sync model applies LLM_TIMEOUT_SECONDS itself, only the retries are bounded by the deadline
+        deadline = time.monotonic() + self.deadline
+        for attempt in range(self.max_retries + 1):
+            try:
+                with self._semaphore:
+                    return self.model.invoke(prompt, config=config)
+            except Exception as e:
+                delay = self._retry_delay(attempt, e, deadline, streamed=False)
+                if delay is None:
+                    raise
+                print(f"LLM call failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+        raise RuntimeError("unreachable")
+
+    async def ainvoke(self, prompt: Any, config: Optional[Dict[str, Any]] = None) -> BaseMessage:
+        loop = asyncio.get_running_loop()
+        semaphore = self._async_semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._async_semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        deadline = time.monotonic() + self.deadline
+        for attempt in range(self.max_retries + 1):
+            # tokens of a streamed answer (astream_events) may already be on their way to the client
+            attempt_config, watcher = _watch_tokens(config)
+            try:
+                async with semaphore:
+                    timeout = min(self.timeout, max(deadline - time.monotonic(), 0.0))
+                    return await asyncio.wait_for(self.model.ainvoke(prompt, config=attempt_config), timeout)
+            except Exception as e:
+                delay = self._retry_delay(attempt, e, deadline, watcher.streamed)
+                if delay is None:
+                    raise
+                print(f"LLM call failed ({e!r}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+        raise RuntimeError("unreachable")
+
+
+_llm_client: Optional[LLMClient] = None
+_llm_client_lock = threading.Lock()
+
+
+def get_llm_client() -> LLMClient:
+    """Return the process-wide LLM client, created on first use (LLM_BACKEND selects the backend)"""
+    global _llm_client
+    if _llm_client is None:
+        with _llm_client_lock:
+            if _llm_client is None:
+                _llm_client = LLMClient(create_chat_model())
+    return _llm_client
@@ -0,0 +1,92 @@
+import asyncio
+import hashlib
+import json
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+from services.llm_client import LLM_STUB_LATENCY_MS, LLM_STUB_RESPONSE_WORDS, LLM_STUB_TOKENS_PER_SECOND, message_text
+
+
+class StubChatModel(BaseChatModel):
+    """
+    Offline chat model with deterministic answers and configurable latency.
+
+    With tools bound, a user message is answered with a call to the first tool that takes exactly
+    one required argument (the document search tool), and a tool result is returned as the final
+    answer, so the agent loop runs its real tools. Otherwise the answer is a digest of the prompt
+    followed by its first `response_words` words. Streaming emits one word per token at
+    `tokens_per_second`, after `latency_ms` to the first token.
+    """
+
+    latency_ms: float = LLM_STUB_LATENCY_MS
+    tokens_per_second: float = LLM_STUB_TOKENS_PER_SECOND
+    response_words: int = LLM_STUB_RESPONSE_WORDS
+    tool_schemas: List[Dict[str, Any]] = []
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub"
+
+    def bind_tools(self, tools: Sequence[Any], **kwargs: Any) -> "StubChatModel":
+        return self.model_copy(update={"tool_schemas": [convert_to_openai_tool(tool)["function"] for tool in tools]})
+
+    @staticmethod
+    def _usage(messages: List[BaseMessage], output: str) -> Dict[str, int]:
+        # words stand in for tokens
+        input_tokens = sum(len(message_text(message).split()) for message in messages)
+        output_tokens = len(output.split())
+        return {"input_tokens": input_tokens, "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens}
+
+    def _reply(self, messages: List[BaseMessage]) -> AIMessage:
+        last = messages[-1]
+        prompt = message_text(last)
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        if isinstance(last, ToolMessage):
+            return AIMessage(content=prompt, usage_metadata=self._usage(messages, prompt))
+        if isinstance(last, HumanMessage):
+            for schema in self.tool_schemas:
+                required = schema.get("parameters", {}).get("required", [])
+                if len(required) == 1:
+                    return AIMessage(content="", tool_calls=[{"name": schema["name"], "args": {required[0]: prompt}, "id": f"call_{digest[:16]}"}],
+                                     usage_metadata=self._usage(messages, prompt))
+        answer = " ".join([f"[stub {digest[:8]}]"] + prompt.split()[:self.response_words])
+        return AIMessage(content=answer, usage_metadata=self._usage(messages, answer))
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        time.sleep(self.latency_ms / 1000)
+        return ChatResult(generations=[ChatGeneration(message=self._reply(messages))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self.latency_ms / 1000)
+        return ChatResult(generations=[ChatGeneration(message=self._reply(messages))])
+
+    def _chunks(self, messages: List[BaseMessage]) -> Iterator[AIMessageChunk]:
+        reply = self._reply(messages)
+        if reply.tool_calls:
+            yield AIMessageChunk(content="", tool_call_chunks=[
+                {"name": call["name"], "args": json.dumps(call["args"]), "id": call["id"], "index": 0} for call in reply.tool_calls
+            ], usage_metadata=reply.usage_metadata)
+            return
+        words = message_text(reply).split(" ")
+        for i, word in enumerate(words):
+            # usage is summed over the chunks, report it once
+            yield AIMessageChunk(content=word if i == 0 else " " + word, usage_metadata=reply.usage_metadata if i == 0 else None)
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self.latency_ms / 1000)
+        for i, chunk in enumerate(self._chunks(messages)):
+            if i and self.tokens_per_second > 0:
+                time.sleep(1 / self.tokens_per_second)
+            yield ChatGenerationChunk(message=chunk)
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self.latency_ms / 1000)
+        for i, chunk in enumerate(self._chunks(messages)):
+            if i and self.tokens_per_second > 0:
+                await asyncio.sleep(1 / self.tokens_per_second)
+            yield ChatGenerationChunk(message=chunk)
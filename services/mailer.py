@@ -0,0 +1,344 @@
+import argparse
+import hashlib
+import os
+import smtplib
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from email.mime.text import MIMEText
+from email.utils import formatdate
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import and_, or_
+
+from database.db_conn import EmailOutbox, ensure_outbox_table, get_session
+
+load_dotenv()
+
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", 587))
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "true").lower() in ("1", "true", "yes")
+SMTP_TIMEOUT_SECONDS = float(os.getenv("SMTP_TIMEOUT_SECONDS", 30))
+# booking notifications go here, by default to the sending account as before
+BOOKING_NOTIFY_EMAIL = os.getenv("BOOKING_NOTIFY_EMAIL") or os.getenv("SMTP_EMAIL")
+
+# "local": a mailer thread in the API process; "external": run `python -m services.mailer` separately
+MAILER_MODE = os.getenv("MAILER_MODE", "local").lower()
+MAILER_BATCH_SIZE = int(os.getenv("MAILER_BATCH_SIZE", 50))
+# outbox poll interval; the local mailer is also woken by every new row
+MAILER_POLL_SECONDS = float(os.getenv("MAILER_POLL_SECONDS", 5))
+MAILER_MAX_ATTEMPTS = int(os.getenv("MAILER_MAX_ATTEMPTS", 6))
+# delay before the first retry, doubled on each further attempt
+MAILER_RETRY_SECONDS = float(os.getenv("MAILER_RETRY_SECONDS", 30))
+# rows left in "sending" this long (the worker died mid-batch) are claimed again
+MAILER_CLAIM_TIMEOUT_SECONDS = float(os.getenv("MAILER_CLAIM_TIMEOUT_SECONDS", 300))
+# the SMTP connection is closed after this long without mail
+MAILER_IDLE_SECONDS = float(os.getenv("MAILER_IDLE_SECONDS", 60))
+
+
+def enqueue_email(session, idempotency_key: str, subject: str, body: str, recipient: Optional[str] = None) -> None:
+    """
+    Add an email to the outbox inside the caller's transaction; it is sent once the transaction
+    commits, and never when it rolls back. A key that is already in the outbox is ignored.
+    """
+    if session.query(EmailOutbox.id).filter_by(idempotency_key=idempotency_key).first() is not None:
+        return
+    session.add(EmailOutbox(idempotency_key=idempotency_key, recipient=recipient, subject=subject, body=body,
+                            status="pending", attempts=0, next_attempt_at=datetime.utcnow()))
+
+
+@dataclass
+class _OutboxEmail:
+    id: int
+    idempotency_key: str
+    recipient: Optional[str]
+    subject: str
+    body: str
+    attempts: int
+
+
+def _is_permanent(error: Exception) -> bool:
+    # only a 5xx reply to this email's recipient or message fails the same way on every attempt;
+    # server, sender and account problems are fixed on the server side and retried
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return any(code >= 500 for code, _ in error.recipients.values())
+    return isinstance(error, smtplib.SMTPDataError) and error.smtp_code >= 500
+
+
+def _is_connection_error(error: Exception) -> bool:
+    # SMTPException subclasses OSError, a refused email leaves the connection usable
+    return isinstance(error, smtplib.SMTPServerDisconnected) or (isinstance(error, OSError) and not isinstance(error, smtplib.SMTPException))
+
+
+class OutboxMailer:
+    """
+    Sends the emails of the outbox table over one persistent SMTP connection.
+
+    Each round claims up to `batch_size` due rows with SELECT ... FOR UPDATE SKIP LOCKED (several
+    workers never claim the same row), sends them over the reused connection and records the
+    outcome. Failed sends are retried with exponential backoff up to `max_attempts`; 5xx replies to
+    the recipient or the message fail at once. When the server cannot be reached or rejects the
+    login, the emails are not charged an attempt: they are released and the batch is retried after
+    `retry_seconds`. Delivery is at least once: a row claimed by a worker
+    that died is claimed again after `claim_timeout`, and the resent message keeps the Message-ID
+    derived from its idempotency key, so receivers can drop the duplicate.
+    """
+
+    def __init__(self, host: str = SMTP_HOST, port: int = SMTP_PORT, starttls: bool = SMTP_STARTTLS,
+                 username: Optional[str] = None, password: Optional[str] = None, sender: Optional[str] = None,
+                 batch_size: int = MAILER_BATCH_SIZE, max_attempts: int = MAILER_MAX_ATTEMPTS,
+                 retry_seconds: float = MAILER_RETRY_SECONDS, claim_timeout: float = MAILER_CLAIM_TIMEOUT_SECONDS,
+                 idle_seconds: float = MAILER_IDLE_SECONDS, poll_seconds: float = MAILER_POLL_SECONDS,
+                 timeout: float = SMTP_TIMEOUT_SECONDS):
+        self.host = host
+        self.port = port
+        self.starttls = starttls
+        self.username = username if username is not None else os.getenv("SMTP_EMAIL")
+        self.password = password if password is not None else os.getenv("SMTP_PASSWORD")
+        self.sender = sender or self.username
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_seconds = retry_seconds
+        self.claim_timeout = claim_timeout
+        self.idle_seconds = idle_seconds
+        self.poll_seconds = poll_seconds
+        self.timeout = timeout
+        self.sent = 0
+        self.failed = 0
+        self._smtp: Optional[smtplib.SMTP] = None
+        self._last_used = 0.0
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+    def _connection(self) -> smtplib.SMTP:
+        if self._smtp is not None:
+            try:
+                self._smtp.noop()
+                return self._smtp
+            except (smtplib.SMTPException, OSError):
+                self._close()
+        if not self.sender:
+            raise ValueError("SMTP_EMAIL environment variable must be set")
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.starttls:
+                smtp.starttls()
+            if self.username and self.password:
+                smtp.login(self.username, self.password)
+        except Exception:
+            smtp.close()
+            raise
+        self._smtp = smtp
+        return smtp
+
+    def _close(self) -> None:
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                self._smtp.close()
+            self._smtp = None
+
+    def _message(self, email: _OutboxEmail) -> MIMEText:
+        msg = MIMEText(email.body)
+        msg["Subject"] = email.subject
+        msg["From"] = self.sender
+        msg["To"] = email.recipient or self.sender
+        msg["Date"] = formatdate(localtime=True)
+        # stable across resends of the same outbox row
+        domain = (self.sender or "localhost").rsplit("@", 1)[-1]
+        msg["Message-ID"] = f"<{hashlib.sha256(email.idempotency_key.encode()).hexdigest()[:32]}@{domain}>"
+        return msg
+
+    def _claim(self) -> List[_OutboxEmail]:
+        now = datetime.utcnow()
+        session = get_session()
+        try:
+            rows = (
+                session.query(EmailOutbox)
+                .filter(or_(
+                    and_(EmailOutbox.status == "pending", EmailOutbox.next_attempt_at <= now),
+                    and_(EmailOutbox.status == "sending", EmailOutbox.claimed_at <= now - timedelta(seconds=self.claim_timeout))
+                ))
+                .order_by(EmailOutbox.id)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)
+                .all()
+            )
+            emails = [_OutboxEmail(row.id, row.idempotency_key, row.recipient, row.subject, row.body, row.attempts) for row in rows]
+            for row in rows:
+                row.status = "sending"
+                row.claimed_at = now
+            session.commit()
+            return emails
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def _record(self, emails: List[_OutboxEmail], errors: Dict[int, Optional[Exception]]) -> None:
+        now = datetime.utcnow()
+        session = get_session()
+        try:
+            sent_ids = [email.id for email in emails if errors.get(email.id) is None]
+            if sent_ids:
+                session.query(EmailOutbox).filter(EmailOutbox.id.in_(sent_ids)).update(
+                    {"status": "sent", "sent_at": now, "last_error": None, "attempts": EmailOutbox.attempts + 1},
+                    synchronize_session=False
+                )
+            for email in emails:
+                error = errors.get(email.id)
+                if error is None:
+                    continue
+                attempts = email.attempts + 1
+                failed = attempts >= self.max_attempts or _is_permanent(error)
+                session.query(EmailOutbox).filter(EmailOutbox.id == email.id).update({
+                    "status": "failed" if failed else "pending",
+                    "attempts": attempts,
+                    "next_attempt_at": now + timedelta(seconds=self.retry_seconds * 2 ** (attempts - 1)),
+                    "last_error": repr(error)[:1000]
+                }, synchronize_session=False)
+                print(f"Email {email.idempotency_key} {'failed' if failed else 'will be retried'} (attempt {attempts}): {error!r}")
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+        self.sent += len(sent_ids)
+        self.failed += sum(1 for error in errors.values() if error is not None)
+
+    def _release(self, emails: List[_OutboxEmail], error: Exception) -> None:
+        """Put claimed emails back without charging an attempt, they are retried after `retry_seconds`"""
+        session = get_session()
+        try:
+            session.query(EmailOutbox).filter(EmailOutbox.id.in_([email.id for email in emails])).update({
+                "status": "pending",
+                "next_attempt_at": datetime.utcnow() + timedelta(seconds=self.retry_seconds),
+                "last_error": repr(error)[:1000]
+            }, synchronize_session=False)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+        print(f"SMTP server unavailable ({error!r}), {len(emails)} emails will be retried in {self.retry_seconds:.0f}s")
+
+    def drain_once(self) -> int:
+        """Claim one batch of due emails and send it; returns the number of emails claimed"""
+        emails = self._claim()
+        if not emails:
+            return 0
+        errors: Dict[int, Optional[Exception]] = {}
+        smtp: Optional[smtplib.SMTP] = None
+        unsent: List[_OutboxEmail] = []
+        connect_error: Optional[Exception] = None
+        for email in emails:
+            if smtp is None and connect_error is None:
+                try:
+                    smtp = self._connection()
+                except Exception as e:
+                    # unreachable server or rejected login: no email of the batch is at fault
+                    connect_error = e
+            if smtp is None:
+                unsent.append(email)
+                continue
+            try:
+                smtp.sendmail(self.sender, [email.recipient or self.sender], self._message(email).as_string())
+                errors[email.id] = None
+            except Exception as e:
+                errors[email.id] = e
+                if _is_connection_error(e):
+                    # the next email of the batch reconnects
+                    self._close()
+                    smtp = None
+        self._last_used = time.monotonic()
+        sent = [email for email in emails if email.id in errors]
+        if sent:
+            self._record(sent, errors)
+        if unsent:
+            self._release(unsent, connect_error)
+        return len(emails)
+
+    def drain(self) -> int:
+        """Send everything that is due now; returns the number of emails claimed"""
+        total = 0
+        while True:
+            claimed = self.drain_once()
+            total += claimed
+            if claimed < self.batch_size:
+                return total
+
+    def run(self) -> None:
+        """Drain the outbox until stopped, waking on notify() or every `poll_seconds`"""
+        ensure_outbox_table()
+        print(f"Mailer started ({self.host}:{self.port})")
+        while not self._stop.is_set():
+            try:
+                self.drain()
+            except Exception as e:
+                print(f"Mailer error: {e}")
+            self._wake.wait(self.poll_seconds)
+            self._wake.clear()
+            if self._smtp is not None and time.monotonic() - self._last_used >= self.idle_seconds:
+                self._close()
+        self._close()
+
+    def start(self) -> None:
+        """Run the mailer in a daemon thread of this process (idempotent)"""
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self.run, name="mailer", daemon=True)
+                self._thread.start()
+
+    def notify(self) -> None:
+        self._wake.set()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+_mailer: Optional[OutboxMailer] = None
+_mailer_lock = threading.Lock()
+
+
+def get_mailer() -> OutboxMailer:
+    """Return the process-wide outbox mailer, created on first use"""
+    global _mailer
+    if _mailer is None:
+        with _mailer_lock:
+            if _mailer is None:
+                _mailer = OutboxMailer()
+    return _mailer
+
+
+def notify_mailer() -> None:
+    """Tell the local mailer that outbox rows were committed; external workers find them by polling"""
+    if MAILER_MODE == "local":
+        mailer = get_mailer()
+        mailer.start()
+        mailer.notify()
+
+
+if __name__ == "__main__":
+    # worker process for MAILER_MODE=external: python -m services.mailer
+    parser = argparse.ArgumentParser(description="Send the emails of the outbox table")
+    parser.add_argument("--once", action="store_true", help="send what is due and exit")
+    args = parser.parse_args()
+    if args.once:
+        ensure_outbox_table()
+        mailer = get_mailer()
+        print(f"Claimed {mailer.drain()} emails: {mailer.sent} sent, {mailer.failed} failed")
+        mailer._close()
+    else:
+        get_mailer().run()
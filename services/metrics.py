@@ -0,0 +1,157 @@
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterable, Iterator, Optional
+from uuid import UUID
+
+from dotenv import load_dotenv
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+
+load_dotenv()
+
+# adds a Server-Timing header with the stage breakdown to every response
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "false").lower() in ("1", "true", "yes")
+
+# from cache lookups (well under a millisecond) to whole agent runs
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+STAGE_SECONDS = Histogram("rag_stage_duration_seconds", "Duration of one pipeline stage", ["stage"], buckets=LATENCY_BUCKETS)
+REQUEST_SECONDS = Histogram("rag_request_duration_seconds", "Duration of HTTP requests", ["method", "route", "status"],
+                            buckets=LATENCY_BUCKETS)
+CACHE_REQUESTS = Counter("rag_cache_requests_total", "Cache lookups by tier and result", ["tier", "result"])
+LLM_TOKENS = Counter("rag_llm_tokens_total", "LLM tokens reported by the model", ["model", "direction"])
+LLM_CALLS = Counter("rag_llm_calls_total", "LLM calls by outcome", ["model", "status"])
+# query embedding micro-batcher, for tuning QUERY_BATCH_MAX_SIZE and QUERY_BATCH_MAX_WAIT_MS
+QUERY_BATCH_SIZE = Histogram("rag_query_batch_size", "Queries per batched query embedding", buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+QUERY_BATCH_WAIT_SECONDS = Histogram("rag_query_batch_wait_seconds", "Time a query waited in the batcher before its batch was encoded",
+                                     buckets=LATENCY_BUCKETS)
+QUERY_BATCH_PENDING = Gauge("rag_query_batch_pending", "Queries waiting in the batcher's queue", multiprocess_mode="livesum")
+
+# stage durations of the current request, summed per stage; None outside a request
+_request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_timings", default=None)
+
+
+def record_stage(stage: str, seconds: float) -> None:
+    """Observe a stage duration, and add it to the timing breakdown of the current request"""
+    STAGE_SECONDS.labels(stage).observe(seconds)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def timed_stage(stage: str) -> Iterator[None]:
+    """Time the block as `stage`; works around awaits and in threads started with asyncio.to_thread"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+
+def record_cache(tier: str, hits: int = 0, misses: int = 0) -> None:
+    if hits:
+        CACHE_REQUESTS.labels(tier, "hit").inc(hits)
+    if misses:
+        CACHE_REQUESTS.labels(tier, "miss").inc(misses)
+
+
+def record_query_batch(batch_size: int, wait_seconds: Iterable[float]) -> None:
+    QUERY_BATCH_SIZE.observe(batch_size)
+    for seconds in wait_seconds:
+        QUERY_BATCH_WAIT_SECONDS.observe(seconds)
+
+
+class LLMMetricsCallback(BaseCallbackHandler):
+    """Counts the tokens and times every call of a chat model, including the agent's own calls"""
+
+    # called in the caller's context (not an executor thread), so durations reach the request breakdown
+    run_inline = True
+
+    def __init__(self, model: str):
+        self.model = model
+        self._started: Dict[UUID, float] = {}
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._started[run_id] = time.perf_counter()
+
+    def _finish(self, run_id: UUID, status: str) -> None:
+        start = self._started.pop(run_id, None)
+        if start is not None:
+            record_stage("llm", time.perf_counter() - start)
+        LLM_CALLS.labels(self.model, status).inc()
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        self._finish(run_id, "success")
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    LLM_TOKENS.labels(self.model, "input").inc(usage.get("input_tokens", 0))
+                    LLM_TOKENS.labels(self.model, "output").inc(usage.get("output_tokens", 0))
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._finish(run_id, "error")
+
+
+def render_metrics() -> bytes:
+    """Metrics in the Prometheus text format, aggregated across workers when PROMETHEUS_MULTIPROC_DIR is set"""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest()
+
+
+def _server_timing(timings: Dict[str, float], total: float) -> str:
+    entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items()]
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording the duration of every HTTP request by route and status.
+
+    Each request gets its own stage breakdown, filled by timed_stage() wherever the request's work
+    runs. With `server_timing` the breakdown is sent in a Server-Timing header (stages nest, e.g.
+    `agent` includes `llm`). Headers go out before a streamed body, so streamed responses only
+    report the stages finished by then.
+    """
+
+    def __init__(self, app, server_timing: bool = SERVER_TIMING_ENABLED):
+        self.app = app
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings: Dict[str, float] = {}
+        token = _request_timings.set(timings)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if self.server_timing:
+                    header = _server_timing(timings, time.perf_counter() - start).encode("latin-1")
+                    message = {**message, "headers": [*message.get("headers", []), (b"server-timing", header)]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_timings.reset(token)
+            # the route template, not the raw path, keeps the label set bounded
+            route = getattr(scope.get("route"), "path", "unmatched")
+            REQUEST_SECONDS.labels(scope["method"], route, str(status)).observe(time.perf_counter() - start)
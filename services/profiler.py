@@ -0,0 +1,98 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# the /debug/profiler endpoints answer 404 unless this is set
+PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "false").lower() in ("1", "true", "yes")
+PROFILER_INTERVAL_MS = float(os.getenv("PROFILER_INTERVAL_MS", 5))
+# a profile left running stops by itself after this long
+PROFILER_MAX_SECONDS = float(os.getenv("PROFILER_MAX_SECONDS", 300))
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler of every thread of the process, started and stopped at runtime.
+
+    A background thread reads the stacks of all other threads every `interval_ms` and counts
+    identical stacks. The result is in the folded format of flamegraph.pl and speedscope, one
+    `thread;outer;...;inner count` line per stack, with the thread name as the root frame. A
+    stack that keeps showing up in the event loop thread is code blocking the loop.
+    """
+
+    def __init__(self, interval_ms: float = PROFILER_INTERVAL_MS, max_seconds: float = PROFILER_MAX_SECONDS):
+        self.interval_ms = interval_ms
+        self.max_seconds = max_seconds
+        self._stacks: Counter = Counter()
+        self._samples = 0
+        self._started_at: Optional[float] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval_ms: Optional[float] = None) -> bool:
+        """Start sampling from scratch; False when a profile is already running"""
+        with self._lock:
+            if self.running:
+                return False
+            if interval_ms:
+                self.interval_ms = interval_ms
+            self._stacks = Counter()
+            self._samples = 0
+            self._started_at = time.monotonic()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self) -> str:
+        """Stop sampling and return the folded stacks"""
+        with self._lock:
+            self._stop.set()
+            if self._thread is not None:
+                self._thread.join()
+            return self.folded()
+
+    def folded(self) -> str:
+        return "\n".join(f"{stack} {count}" for stack, count in self._stacks.most_common())
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "interval_ms": self.interval_ms,
+            "samples": self._samples,
+            "seconds": round(time.monotonic() - self._started_at, 1) if self._started_at else 0.0,
+        }
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        deadline = time.monotonic() + self.max_seconds
+        while not self._stop.wait(self.interval_ms / 1000):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self._stacks[";".join(reversed(stack))] += 1
+            self._samples += 1
+            if time.monotonic() >= deadline:
+                print(f"Profiler stopped after {self.max_seconds:.0f}s")
+                break
+
+
+profiler = SamplingProfiler()
@@ -0,0 +1,150 @@
+import asyncio
+import os
+import queue
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+from services.embedding_engine import encode_queries
+from services.metrics import QUERY_BATCH_PENDING, record_query_batch
+
+load_dotenv()
+
+
+class BatcherMetrics:
+    """Running batch size and queueing delay statistics of a QueryEmbeddingBatcher"""
+
+    def __init__(self, window: int = 10000):
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.queries = 0
+        self.batch_sizes: Counter = Counter()
+        # most recent samples, in milliseconds
+        self.queue_delays_ms: deque = deque(maxlen=window)
+        self.encode_times_ms: deque = deque(maxlen=window)
+
+    def record(self, batch_size: int, queue_delays_ms: List[float], encode_time_ms: float) -> None:
+        with self._lock:
+            self.batches += 1
+            self.queries += batch_size
+            self.batch_sizes[batch_size] += 1
+            self.queue_delays_ms.extend(queue_delays_ms)
+            self.encode_times_ms.append(encode_time_ms)
+
+    @staticmethod
+    def _percentiles(samples: List[float]) -> Dict[str, float]:
+        if not samples:
+            return {"p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0}
+        p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+        return {"p50": float(p50), "p95": float(p95), "p99": float(p99), "max": float(max(samples))}
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "batches": self.batches,
+                "queries": self.queries,
+                "mean_batch_size": self.queries / self.batches if self.batches else 0.0,
+                "batch_size_histogram": dict(sorted(self.batch_sizes.items())),
+                "queue_delay_ms": self._percentiles(list(self.queue_delays_ms)),
+                "encode_time_ms": self._percentiles(list(self.encode_times_ms)),
+            }
+
+
+class QueryEmbeddingBatcher:
+    """
+    Micro-batcher in front of the query encoder.
+
+    Callers submit single queries; a worker thread collects them until `max_batch_size` queries
+    are waiting or `max_wait_ms` has passed since the first one arrived, runs one batched encode
+    and resolves each caller's future with its own vector. Blocking callers use `encode`,
+    coroutines use `aencode`.
+    """
+
+    def __init__(self, encode_fn: Callable[[List[str]], np.ndarray] = encode_queries,
+                 max_batch_size: int = 32, max_wait_ms: float = 2.0):
+        self.encode_fn = encode_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.metrics = BatcherMetrics()
+
+        self._queue: "queue.Queue[Tuple[str, float, Future]]" = queue.Queue()
+        self._worker: Optional[threading.Thread] = None
+        self._worker_lock = threading.Lock()
+
+    def _ensure_worker(self) -> None:
+        if self._worker is None or not self._worker.is_alive():
+            with self._worker_lock:
+                if self._worker is None or not self._worker.is_alive():
+                    self._worker = threading.Thread(target=self._run, name="query-embedding-batcher", daemon=True)
+                    self._worker.start()
+
+    def submit(self, query: str) -> Future:
+        """Queue a query and return a future resolving to its embedding"""
+        future: Future = Future()
+        self._ensure_worker()
+        self._queue.put((query, time.perf_counter(), future))
+        QUERY_BATCH_PENDING.inc()
+        return future
+
+    def encode(self, query: str, timeout: Optional[float] = None) -> np.ndarray:
+        """Embed one query, blocking until its batch has been encoded"""
+        return self.submit(query).result(timeout=timeout)
+
+    async def aencode(self, query: str) -> np.ndarray:
+        """Embed one query without blocking the event loop"""
+        return await asyncio.wrap_future(self.submit(query))
+
+    def stats(self) -> Dict[str, Any]:
+        """Batch size and queueing delay statistics, for tuning max_batch_size/max_wait_ms (also exported as rag_query_batch_* metrics)"""
+        snapshot = self.metrics.snapshot()
+        snapshot["max_batch_size"] = self.max_batch_size
+        snapshot["max_wait_ms"] = self.max_wait_ms
+        snapshot["pending"] = self._queue.qsize()
+        return snapshot
+
+    def _collect(self) -> List[Tuple[str, float, Future]]:
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                # drain whatever is already queued even once the window has closed
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        QUERY_BATCH_PENDING.dec(len(batch))
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            # callers that gave up (cancelled futures) are dropped from the batch
+            batch = [item for item in batch if item[2].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            started = time.perf_counter()
+            queue_delays_ms = [(started - enqueued) * 1000 for _, enqueued, _ in batch]
+            record_query_batch(len(batch), [delay / 1000 for delay in queue_delays_ms])
+            try:
+                embeddings = self.encode_fn([query for query, _, _ in batch])
+            except Exception as e:
+                for _, _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            self.metrics.record(len(batch), queue_delays_ms, (time.perf_counter() - started) * 1000)
+            for (_, _, future), embedding in zip(batch, embeddings):
+                future.set_result(embedding)
+
+
+# Global batcher instance
+query_batcher = QueryEmbeddingBatcher(
+    max_batch_size=int(os.getenv("QUERY_BATCH_MAX_SIZE", 32)),
+    max_wait_ms=float(os.getenv("QUERY_BATCH_MAX_WAIT_MS", 2.0))
+)
@@ -1,13 +1,34 @@
 import json
 import hashlib
+import re
+import threading
 import time
+from collections import deque
 from typing import Optional, Dict, List, Any
 from dotenv import load_dotenv
 import os
 import redis
+import redis.asyncio as aioredis
+import numpy as np
+
+from services.embedding_engine import get_embedding_dimension
+from services.query_batcher import query_batcher
+from services.semantic_cache import SemanticCache
 
 load_dotenv()
 
+# answers cached at the /chat entry point, keyed on the normalized query, the conversation context and the corpus version
+CHAT_CACHE_ENABLED = os.getenv("CHAT_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# bumped by every ingestion that changes the stored chunks; part of every response cache key
+CORPUS_VERSION_KEY = "corpus:version"
+
+
+def normalize_query(query: str) -> str:
+    """Lowercase, collapse whitespace and drop trailing punctuation, so trivially different phrasings share a cache entry"""
+    return re.sub(r"\s+", " ", query.lower()).strip().rstrip("?!.,;: ").strip()
+
+
 class RedisService:
     def __init__(self):
         # Redis configuration
@@ -19,6 +40,11 @@ class RedisService:
         # TTL settings
         self.cache_ttl = 3600  # 1 hour for cached responses
         self.conversation_ttl = 86400  # 24 hours for conversation history
+        self.chat_cache_ttl = int(os.getenv("CHAT_CACHE_TTL", self.cache_ttl))
+        self.max_conversation_messages = 20
+
+        # minimum cosine similarity for a semantic cache hit
+        self.semantic_threshold = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.9))
         
         # Initialize Redis connection
         try:
@@ -35,31 +61,105 @@ class RedisService:
             # Test connection
             self.redis_client.ping()
             print("Connected to Redis successfully")
+            # same server for the async request path, connects lazily on first await
+            self.async_redis_client = aioredis.Redis(
+                host=self.redis_host,
+                port=self.redis_port,
+                db=self.redis_db,
+                password=self.redis_password,
+                decode_responses=True,
+                socket_connect_timeout=5,
+                socket_timeout=5,
+                retry_on_timeout=True
+            )
         except Exception as e:
             print(f"Redis connection failed: {e}")
             print("Falling back to in-memory storage")
             self.redis_client = None
+            self.async_redis_client = None
             self._fallback_cache = {}
             self._fallback_conversations = {}
+            self._fallback_summaries = {}
+            self._fallback_chat_cache = {}
+            self._fallback_corpus_version = 0
+            self._fallback_lock = threading.Lock()
+
+        # embedding-indexed response cache, shares the TTL of the exact cache
+        self.semantic_cache = SemanticCache(
+            self.redis_client,
+            ttl=self.cache_ttl,
+            threshold=self.semantic_threshold,
+            dimension=get_embedding_dimension,
+            max_local_entries=int(os.getenv("SEMANTIC_CACHE_MAX_LOCAL_ENTRIES", 500000)),
+            async_redis_client=self.async_redis_client,
+            resync_seconds=float(os.getenv("SEMANTIC_CACHE_RESYNC_SECONDS", 30))
+        )
     
-    def _hash_query(self, query: str) -> str:
-        """Create a hash for the query"""
-        return hashlib.md5(query.encode()).hexdigest()
+    def _hash_query(self, query: str, scope: str = "") -> str:
+        """Create a hash for the query, and the retrieval scope it was answered in (none for the default scope)"""
+        return hashlib.md5((f"{scope}\n{query}" if scope else query).encode()).hexdigest()
     
-    def _get_cache_key(self, query_hash: str) -> str:
+    def _get_cache_key(self, query_hash: str, corpus_version: int = 0) -> str:
         """Get Redis key for cache"""
-        return f"cache:{query_hash}"
+        return f"cache:{corpus_version}:{query_hash}"
+
+    def _get_chat_cache_key(self, query: str, context: str, corpus_version: int, scope: str = "") -> str:
+        """Redis key of a /chat answer: corpus version, then a hash of the normalized query, the context and the retrieval scope"""
+        context_hash = hashlib.sha256(context.encode()).hexdigest()
+        key = f"{normalize_query(query)}\n{context_hash}" + (f"\n{scope}" if scope else "")
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return f"chat:{corpus_version}:{digest}"
     
     def _get_conversation_key(self, session_id: str) -> str:
-        """Get Redis key for conversation"""
+        """Get Redis key for conversation (a list of JSON messages)"""
+        return f"conversation:{session_id}:messages"
+
+    def _get_legacy_conversation_key(self, session_id: str) -> str:
+        """Key of conversations stored before the message list, one JSON document {"messages": [...]}"""
         return f"conversation:{session_id}"
+
+    def _get_summary_key(self, session_id: str) -> str:
+        """Get Redis key for the rolling summary of a conversation's older turns"""
+        return f"conversation:{session_id}:summary"
     
-    def cache_response(self, query: str, response: str, similarity_score: float = 0.0) -> None:
-        """Cache a query-response pair with TTL"""
+    def get_corpus_version(self) -> int:
+        """Current version of the document corpus (0 before the first ingestion)"""
+        try:
+            if self.redis_client:
+                return int(self.redis_client.get(CORPUS_VERSION_KEY) or 0)  # type: ignore
+            return self._fallback_corpus_version
+        except Exception as e:
+            print(f"Corpus version error: {e}")
+            return 0
+
+    def bump_corpus_version(self) -> int:
+        """Start a new corpus version; response cache entries of older versions stop matching"""
         try:
             if self.redis_client:
-                query_hash = self._hash_query(query)
-                cache_key = self._get_cache_key(query_hash)
+                version = int(self.redis_client.incr(CORPUS_VERSION_KEY))  # type: ignore
+            else:
+                with self._fallback_lock:
+                    self._fallback_corpus_version += 1
+                    version = self._fallback_corpus_version
+            print(f"Corpus version is now {version}")
+            return version
+        except Exception as e:
+            print(f"Corpus version error: {e}")
+            return 0
+
+    def cache_response(self, query: str, response: str, similarity_score: float = 0.0, embedding: Optional[np.ndarray] = None,
+                       corpus_version: Optional[int] = None, scope: str = "") -> None:
+        """
+        Cache a query-response pair with TTL, in the exact cache and the semantic cache, under the corpus version.
+
+        Answers of a non-default retrieval scope only go to the exact cache, under a key including the scope.
+        """
+        try:
+            if corpus_version is None:
+                corpus_version = self.get_corpus_version()
+            if self.redis_client:
+                query_hash = self._hash_query(query, scope)
+                cache_key = self._get_cache_key(query_hash, corpus_version)
 
                 cache_data = {
                     "query": query,
@@ -68,181 +168,399 @@ class RedisService:
                     "timestamp": time.time()
                 }
     
-                # Store with TTL
-                self.redis_client.setex(
+                if embedding is None and not scope:
+                    embedding = query_batcher.encode(query)
+
+                # exact and semantic entries written in one pipelined round trip
+                pipe = self.redis_client.pipeline(transaction=False)
+                pipe.setex(
                     cache_key,
                     self.cache_ttl,
                     json.dumps(cache_data)
                 )
+                if not scope:
+                    self.semantic_cache.store(query, response, embedding, similarity_score, pipe=pipe, corpus_version=corpus_version)
+                pipe.execute()
                 
             else:
                 # Fallback to in-memory
-                query_hash = self._hash_query(query)
-                self._fallback_cache[query_hash] = {
+                query_hash = self._hash_query(query, scope)
+                self._fallback_cache[self._get_cache_key(query_hash, corpus_version)] = {
                     "query": query,
                     "response": response,
                     "similarity_score": similarity_score,
                     "timestamp": time.time()
                 }
+
+                if not scope:
+                    if embedding is None:
+                        embedding = query_batcher.encode(query)
+                    self.semantic_cache.store(query, response, embedding, similarity_score, corpus_version=corpus_version)
         except Exception as e:
             print(f"Cache error: {e}")
     
-    def get_cached_response(self, query: str) -> Optional[Dict[str, Any]]:
-        """Get cached response for a query"""
+    def get_cached_response(self, query: str, corpus_version: Optional[int] = None, scope: str = "") -> Optional[Dict[str, Any]]:
+        """Get cached response for a query, answered against the current (or given) corpus version in a retrieval scope"""
         try:
+            if corpus_version is None:
+                corpus_version = self.get_corpus_version()
+            query_hash = self._hash_query(query, scope)
+            cache_key = self._get_cache_key(query_hash, corpus_version)
             if self.redis_client:
-                query_hash = self._hash_query(query)
-                cache_key = self._get_cache_key(query_hash)
-            
                 cached_data = self.redis_client.get(cache_key)
                 if cached_data:
                     return json.loads(str(cached_data))
                 return None
             else:
                 # Fallback to in-memory
-                query_hash = self._hash_query(query)
-                return self._fallback_cache.get(query_hash)
+                return self._fallback_cache.get(cache_key)
         except Exception as e:
             print(f"Get cache error: {e}")
             return None
     
-    def find_similar_cached_queries(self, query: str, threshold: float = 0.8) -> List[Dict[str, Any]]:
-        """Find similar cached queries using simple keyword matching"""
+    def find_similar_cached_queries(self, query: str, threshold: Optional[float] = None, embedding: Optional[np.ndarray] = None,
+                                    corpus_version: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Find cached queries whose embedding is similar to the query, through the semantic cache index"""
         try:
-            if self.redis_client:
-                query_words = set(query.lower().split())
-                similar_queries = []
-                
-                # Get all cache keys
-                cache_keys = self.redis_client.keys("cache:*")
-                
-                for key in list(cache_keys):  # type: ignore
-                    cached_data = self.redis_client.get(key)
-                    if cached_data:
-                        data = json.loads(str(cached_data))
-                        cached_query_words = set(data["query"].lower().split())
-                        intersection = len(query_words.intersection(cached_query_words))
-                        union = len(query_words.union(cached_query_words))
-                        similarity = intersection / union if union > 0 else 0
-                        
-                        if similarity >= threshold:
-                            data_copy = data.copy()
-                            data_copy["similarity"] = similarity
-                            similar_queries.append(data_copy)
-                
-                # Sort by similarity score
-                similar_queries.sort(key=lambda x: x["similarity"], reverse=True)
-                return similar_queries
-            else:
-                # Fallback to in-memory
-                query_words = set(query.lower().split())
-                similar_queries = []
-                
-                for data in self._fallback_cache.values():
-                    cached_query_words = set(data["query"].lower().split())
-                    intersection = len(query_words.intersection(cached_query_words))
-                    union = len(query_words.union(cached_query_words))
-                    similarity = intersection / union if union > 0 else 0
-                    
-                    if similarity >= threshold:
-                        data_copy = data.copy()
-                        data_copy["similarity"] = similarity
-                        similar_queries.append(data_copy)
-                
-                similar_queries.sort(key=lambda x: x["similarity"], reverse=True)
-                return similar_queries
+            if corpus_version is None:
+                corpus_version = self.get_corpus_version()
+            if embedding is None:
+                embedding = query_batcher.encode(query)
+            return self.semantic_cache.lookup(embedding, threshold, corpus_version=corpus_version)
         except Exception as e:
             print(f"Similarity search error: {e}")
             return []
     
     def store_conversation(self, session_id: str, user_query: str, response: str, agent_name: str = "unknown") -> None:
-        """Store conversation in session memory with TTL"""
+        """Append a turn to the session's conversation list, trim it and refresh its TTL in one round trip"""
+        message = {
+            "timestamp": time.time(),
+            "user_query": user_query,
+            "response": response,
+            "agent_name": agent_name
+        }
         try:
             if self.redis_client:
                 conversation_key = self._get_conversation_key(session_id)
-    
-                # get existing conversation
-                existing_data = self.redis_client.get(conversation_key)
-                if existing_data:
-                    conversation = json.loads(str(existing_data))
-                else:
-                    conversation = {"messages": []}
-                
-                # Add new message
-                conversation["messages"].append({
-                    "timestamp": time.time(),
-                    "user_query": user_query,
-                    "response": response,
-                    "agent_name": agent_name
-                })
-                
-                # Keep only last 20 messages
-                if len(conversation["messages"]) > 20:
-                    conversation["messages"] = conversation["messages"][-20:]
-                
-                # Store with TTL
-                self.redis_client.setex(
-                    conversation_key,
-                    self.conversation_ttl,
-                    json.dumps(conversation)
-                )
+
+                # MULTI/EXEC: concurrent turns of one session append atomically instead of overwriting each other
+                pipe = self.redis_client.pipeline(transaction=True)
+                pipe.rpush(conversation_key, json.dumps(message))
+                pipe.ltrim(conversation_key, -self.max_conversation_messages, -1)
+                pipe.expire(conversation_key, self.conversation_ttl)
+                pipe.expire(self._get_summary_key(session_id), self.conversation_ttl)
+                if pipe.execute()[0] == 1:
+                    # first turn under the list key: older ones may still be under the legacy key
+                    self._migrate_legacy_conversation(session_id)
             else:
-                # Fallback to in-memory
-                if session_id not in self._fallback_conversations:
-                    self._fallback_conversations[session_id] = {"messages": []}
-                
-                self._fallback_conversations[session_id]["messages"].append({
-                    "timestamp": time.time(),
-                    "user_query": user_query,
-                    "response": response,
-                    "agent_name": agent_name
-                })
-                
-                # Keep only last 20 messages
-                if len(self._fallback_conversations[session_id]["messages"]) > 20:
-                    self._fallback_conversations[session_id]["messages"] = self._fallback_conversations[session_id]["messages"][-20:]
+                # Fallback to in-memory, same append/trim/TTL semantics
+                with self._fallback_lock:
+                    messages, _ = self._fallback_conversations.get(session_id, (None, 0))
+                    if messages is None or not self._fallback_alive(session_id):
+                        messages = deque(maxlen=self.max_conversation_messages)
+                    messages.append(message)
+                    self._fallback_conversations[session_id] = (messages, time.time() + self.conversation_ttl)
         except Exception as e:
             print(f"Conversation storage error: {e}")
     
-    def get_conversation_history(self, session_id: str) -> List[Dict[str, Any]]:
-        """Get conversation history for a session"""
+    def get_conversation_history(self, session_id: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Get the last `limit` messages (all when None) of a session, oldest first"""
         try:
+            start = -limit if limit else 0
             if self.redis_client:
                 conversation_key = self._get_conversation_key(session_id)
-                conversation_data = self.redis_client.get(conversation_key)
-                
-                if conversation_data:
-                    conversation = json.loads(str(conversation_data))
-                    return conversation.get("messages", [])
-                return []
+                messages = self.redis_client.lrange(conversation_key, start, -1)
+                if not messages and self._migrate_legacy_conversation(session_id):
+                    messages = self.redis_client.lrange(conversation_key, start, -1)
+                return [json.loads(message) for message in messages]  # type: ignore
             else:
                 # Fallback to in-memory
-                conversation = self._fallback_conversations.get(session_id, {"messages": []})
-                return conversation.get("messages", [])  # type: ignore
+                with self._fallback_lock:
+                    if not self._fallback_alive(session_id):
+                        return []
+                    messages = list(self._fallback_conversations[session_id][0])
+                return messages[start:]
         except Exception as e:
             print(f"Conversation retrieval error: {e}")
             return []
+
+    def _migrate_legacy_conversation(self, session_id: str) -> bool:
+        """Move a conversation from the legacy key to the head of the message list; True when there was one"""
+        legacy_key = self._get_legacy_conversation_key(session_id)
+        try:
+            with self.redis_client.pipeline(transaction=True) as pipe:  # type: ignore
+                pipe.watch(legacy_key)
+                data = pipe.get(legacy_key)
+                if not data:
+                    return False
+                pipe.multi()
+                self._queue_legacy_migration(pipe, session_id, data)
+                pipe.execute()
+        except redis.WatchError:
+            # another request migrated it first
+            pass
+        return True
+
+    async def _amigrate_legacy_conversation(self, session_id: str) -> bool:
+        """Async variant of _migrate_legacy_conversation"""
+        legacy_key = self._get_legacy_conversation_key(session_id)
+        try:
+            async with self.async_redis_client.pipeline(transaction=True) as pipe:  # type: ignore
+                await pipe.watch(legacy_key)
+                data = await pipe.get(legacy_key)
+                if not data:
+                    return False
+                pipe.multi()
+                self._queue_legacy_migration(pipe, session_id, data)
+                await pipe.execute()
+        except redis.WatchError:
+            pass
+        return True
+
+    def _queue_legacy_migration(self, pipe, session_id: str, data: Any) -> None:
+        # legacy turns are older than any turn in the list: LPUSH them newest first
+        conversation_key = self._get_conversation_key(session_id)
+        messages = json.loads(str(data)).get("messages", [])
+        if messages:
+            pipe.lpush(conversation_key, *[json.dumps(message) for message in reversed(messages)])
+            pipe.ltrim(conversation_key, -self.max_conversation_messages, -1)
+            pipe.expire(conversation_key, self.conversation_ttl)
+        pipe.delete(self._get_legacy_conversation_key(session_id))
+
+    def _fallback_alive(self, session_id: str) -> bool:
+        """Whether the in-memory conversation exists and has not expired (callers hold the fallback lock)"""
+        entry = self._fallback_conversations.get(session_id)
+        if entry is None:
+            return False
+        if entry[1] <= time.time():
+            del self._fallback_conversations[session_id]
+            self._fallback_summaries.pop(session_id, None)
+            return False
+        return True
     
+    def get_conversation_summary(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """Stored summary record of a session's older turns (summary, summarized_until, turns), or None"""
+        try:
+            if self.redis_client:
+                data = self.redis_client.get(self._get_summary_key(session_id))
+                return json.loads(str(data)) if data else None
+            with self._fallback_lock:
+                return self._fallback_summaries.get(session_id) if self._fallback_alive(session_id) else None
+        except Exception as e:
+            print(f"Conversation summary retrieval error: {e}")
+            return None
+
     def get_conversation_context(self, session_id: str, max_messages: int = 5) -> str:
         """Get conversation context as a string for the agent"""
         try:
-            messages = self.get_conversation_history(session_id)
-            
-            if not messages:
-                return ""
-            
-            # Get last N messages
-            recent_messages = messages[-max_messages:]
-            
-            context = "Previous conversation:\n"
-            for msg in recent_messages:
-                context += f"User: {msg['user_query']}\n"
-                context += f"Assistant: {msg['response']}\n\n"
-            
-            return context.strip()
+            # only the last N messages are read (LRANGE)
+            recent_messages = self.get_conversation_history(session_id, limit=max_messages)
+            return self._format_context(recent_messages)
         except Exception as e:
             print(f"Context error: {e}")
             return ""
 
-# Global service instance
-redis_service = RedisService() 
\ No newline at end of file
+    # Async variants for the request path; without Redis they use the in-memory fallback directly
+
+    async def aget_corpus_version(self) -> int:
+        """Async variant of get_corpus_version"""
+        if not self.async_redis_client:
+            return self.get_corpus_version()
+        try:
+            return int(await self.async_redis_client.get(CORPUS_VERSION_KEY) or 0)
+        except Exception as e:
+            print(f"Corpus version error: {e}")
+            return 0
+
+    async def acache_response(self, query: str, response: str, similarity_score: float = 0.0, embedding: Optional[np.ndarray] = None,
+                              corpus_version: Optional[int] = None, scope: str = "") -> None:
+        """Async variant of cache_response"""
+        if not self.async_redis_client:
+            if embedding is None and not scope:
+                embedding = await query_batcher.aencode(query)
+            self.cache_response(query, response, similarity_score, embedding, corpus_version, scope)
+            return
+        try:
+            if corpus_version is None:
+                corpus_version = await self.aget_corpus_version()
+            cache_key = self._get_cache_key(self._hash_query(query, scope), corpus_version)
+            cache_data = {
+                "query": query,
+                "response": response,
+                "similarity_score": similarity_score,
+                "timestamp": time.time()
+            }
+            if embedding is None and not scope:
+                embedding = await query_batcher.aencode(query)
+
+            pipe = self.async_redis_client.pipeline(transaction=False)
+            pipe.setex(cache_key, self.cache_ttl, json.dumps(cache_data))
+            if not scope:
+                await self.semantic_cache.astore(query, response, embedding, similarity_score, pipe=pipe, corpus_version=corpus_version)
+            await pipe.execute()
+        except Exception as e:
+            print(f"Cache error: {e}")
+
+    async def aget_cached_response(self, query: str, corpus_version: Optional[int] = None, scope: str = "") -> Optional[Dict[str, Any]]:
+        """Async variant of get_cached_response"""
+        if not self.async_redis_client:
+            return self.get_cached_response(query, corpus_version, scope)
+        try:
+            if corpus_version is None:
+                corpus_version = await self.aget_corpus_version()
+            cached_data = await self.async_redis_client.get(self._get_cache_key(self._hash_query(query, scope), corpus_version))
+            return json.loads(str(cached_data)) if cached_data else None
+        except Exception as e:
+            print(f"Get cache error: {e}")
+            return None
+
+    async def afind_similar_cached_queries(self, query: str, threshold: Optional[float] = None, embedding: Optional[np.ndarray] = None,
+                                           corpus_version: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Async variant of find_similar_cached_queries"""
+        try:
+            if corpus_version is None:
+                corpus_version = await self.aget_corpus_version()
+            if embedding is None:
+                embedding = await query_batcher.aencode(query)
+            return await self.semantic_cache.alookup(embedding, threshold, corpus_version=corpus_version)
+        except Exception as e:
+            print(f"Similarity search error: {e}")
+            return []
+
+    async def aget_chat_response(self, query: str, context: str, corpus_version: int, scope: str = "") -> Optional[Dict[str, Any]]:
+        """Answer cached at the /chat entry point for this query, conversation context and retrieval scope, or None"""
+        if not CHAT_CACHE_ENABLED:
+            return None
+        cache_key = self._get_chat_cache_key(query, context, corpus_version, scope)
+        try:
+            if not self.async_redis_client:
+                with self._fallback_lock:
+                    entry = self._fallback_chat_cache.get(cache_key)
+                    if entry is not None and entry[1] <= time.time():
+                        del self._fallback_chat_cache[cache_key]
+                        entry = None
+                return entry[0] if entry else None
+            cached_data = await self.async_redis_client.get(cache_key)
+            return json.loads(str(cached_data)) if cached_data else None
+        except Exception as e:
+            print(f"Get chat cache error: {e}")
+            return None
+
+    async def acache_chat_response(self, query: str, context: str, corpus_version: int, response: str, agent_name: str,
+                                   scope: str = "") -> None:
+        """Cache a /chat answer for the query, conversation context and retrieval scope it was given under"""
+        if not CHAT_CACHE_ENABLED:
+            return
+        cache_key = self._get_chat_cache_key(query, context, corpus_version, scope)
+        cache_data = {
+            "query": query,
+            "response": response,
+            "agent_used": agent_name,
+            "corpus_version": corpus_version,
+            "timestamp": time.time()
+        }
+        try:
+            if not self.async_redis_client:
+                with self._fallback_lock:
+                    now = time.time()
+                    if len(self._fallback_chat_cache) >= 10000:
+                        self._fallback_chat_cache = {k: v for k, v in self._fallback_chat_cache.items() if v[1] > now}
+                    self._fallback_chat_cache[cache_key] = (cache_data, now + self.chat_cache_ttl)
+                return
+            await self.async_redis_client.setex(cache_key, self.chat_cache_ttl, json.dumps(cache_data))
+        except Exception as e:
+            print(f"Chat cache error: {e}")
+
+    async def astore_conversation(self, session_id: str, user_query: str, response: str, agent_name: str = "unknown") -> None:
+        """Async variant of store_conversation"""
+        if not self.async_redis_client:
+            self.store_conversation(session_id, user_query, response, agent_name)
+            return
+        message = {
+            "timestamp": time.time(),
+            "user_query": user_query,
+            "response": response,
+            "agent_name": agent_name
+        }
+        try:
+            conversation_key = self._get_conversation_key(session_id)
+            pipe = self.async_redis_client.pipeline(transaction=True)
+            pipe.rpush(conversation_key, json.dumps(message))
+            pipe.ltrim(conversation_key, -self.max_conversation_messages, -1)
+            pipe.expire(conversation_key, self.conversation_ttl)
+            pipe.expire(self._get_summary_key(session_id), self.conversation_ttl)
+            if (await pipe.execute())[0] == 1:
+                await self._amigrate_legacy_conversation(session_id)
+        except Exception as e:
+            print(f"Conversation storage error: {e}")
+
+    async def aget_conversation_history(self, session_id: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Async variant of get_conversation_history"""
+        if not self.async_redis_client:
+            return self.get_conversation_history(session_id, limit)
+        try:
+            start = -limit if limit else 0
+            conversation_key = self._get_conversation_key(session_id)
+            messages = await self.async_redis_client.lrange(conversation_key, start, -1)
+            if not messages and await self._amigrate_legacy_conversation(session_id):
+                messages = await self.async_redis_client.lrange(conversation_key, start, -1)
+            return [json.loads(message) for message in messages]
+        except Exception as e:
+            print(f"Conversation retrieval error: {e}")
+            return []
+
+    async def aget_conversation_summary(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """Async variant of get_conversation_summary"""
+        if not self.async_redis_client:
+            return self.get_conversation_summary(session_id)
+        try:
+            data = await self.async_redis_client.get(self._get_summary_key(session_id))
+            return json.loads(str(data)) if data else None
+        except Exception as e:
+            print(f"Conversation summary retrieval error: {e}")
+            return None
+
+    async def astore_conversation_summary(self, session_id: str, record: Dict[str, Any]) -> None:
+        """Replace the summary record of a session, with the conversation TTL"""
+        try:
+            if not self.async_redis_client:
+                with self._fallback_lock:
+                    self._fallback_summaries[session_id] = record
+                return
+            await self.async_redis_client.setex(self._get_summary_key(session_id), self.conversation_ttl, json.dumps(record))
+        except Exception as e:
+            print(f"Conversation summary storage error: {e}")
+
+    async def aget_conversation_context(self, session_id: str, max_messages: int = 5) -> str:
+        """Async variant of get_conversation_context"""
+        recent_messages = await self.aget_conversation_history(session_id, limit=max_messages)
+        return self._format_context(recent_messages)
+
+    @staticmethod
+    def _format_context(recent_messages: List[Dict[str, Any]]) -> str:
+        if not recent_messages:
+            return ""
+        context = "Previous conversation:\n"
+        for msg in recent_messages:
+            context += f"User: {msg['user_query']}\n"
+            context += f"Assistant: {msg['response']}\n\n"
+        return context.strip()
+
+_redis_service: Optional[RedisService] = None
+_redis_service_lock = threading.Lock()
+
+
+def get_redis_service() -> RedisService:
+    """Return the process-wide Redis service, connected (or fallen back to memory) on first use"""
+    global _redis_service
+    if _redis_service is None:
+        with _redis_service_lock:
+            if _redis_service is None:
+                _redis_service = RedisService()
+    return _redis_service
+
+
+def close_redis_service() -> None:
+    """Disconnect the semantic cache's sync client at shutdown, when the service was created"""
+    if _redis_service is not None:
+        _redis_service.semantic_cache.close()
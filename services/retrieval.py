@@ -0,0 +1,123 @@
+import asyncio
+import os
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from dotenv import load_dotenv
+
+from services.corpus_collections import DEFAULT_SCOPE, Scope
+from services.lexical_index import get_lexical_index
+from services.metrics import timed_stage
+from services.vector_store import VectorMatch, get_vector_store
+
+load_dotenv()
+
+# "dense": vector store only; "hybrid": vector store and BM25 ranks fused; "lexical": BM25 only, no vector query
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "dense").lower()
+# candidates taken from each ranking before fusion
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", 20))
+# reciprocal rank fusion constant, damps the weight of the first few ranks
+RRF_K = int(os.getenv("RRF_K", 60))
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[VectorMatch]], top_k: int, k: int = RRF_K) -> List[VectorMatch]:
+    """
+    Fuse rankings by reciprocal rank: a chunk scores the sum of 1 / (k + rank) over the rankings holding it.
+
+    Only ranks count, so BM25 scores and cosine similarities need no normalization. Returns the
+    `top_k` best chunks with their fused score; metadata comes from the first ranking holding them.
+    """
+    scores: Dict[str, float] = {}
+    matches: Dict[str, VectorMatch] = {}
+    for ranking in rankings:
+        for rank, match in enumerate(ranking, start=1):
+            scores[match.id] = scores.get(match.id, 0.0) + 1.0 / (k + rank)
+            matches.setdefault(match.id, match)
+    fused = sorted(scores, key=lambda id: scores[id], reverse=True)[:top_k]
+    return [VectorMatch(id, scores[id], matches[id].metadata) for id in fused]
+
+
+def _merge(results: Sequence[Sequence[VectorMatch]], top_k: int) -> List[VectorMatch]:
+    # similarities of one embedding model are comparable across namespaces
+    return sorted((match for matches in results for match in matches), key=lambda match: match.score, reverse=True)[:top_k]
+
+
+def _dense_namespace(query_embedding: np.ndarray, top_k: int, scope: Scope, namespace: str) -> List[VectorMatch]:
+    with timed_stage("vector_query"):
+        return get_vector_store().query(query_embedding, top_k=top_k, filter=scope.filter, namespace=namespace)
+
+
+def _dense(query_embedding: np.ndarray, top_k: int, scope: Scope) -> List[VectorMatch]:
+    """Vector store query of every namespace of the scope, one after the other"""
+    return _merge([_dense_namespace(query_embedding, top_k, scope, namespace) for namespace in scope.namespaces], top_k)
+
+
+async def _adense(query_embedding: np.ndarray, top_k: int, scope: Scope) -> List[VectorMatch]:
+    """Vector store query of every namespace of the scope, concurrently in the default thread pool"""
+    results = await asyncio.gather(*(
+        asyncio.to_thread(_dense_namespace, query_embedding, top_k, scope, namespace) for namespace in scope.namespaces
+    ))
+    return _merge(results, top_k)
+
+
+def _lexical(query: str, top_k: int, scope: Scope) -> List[VectorMatch]:
+    with timed_stage("lexical_query"):
+        return get_lexical_index().query(query, top_k=top_k, filter=scope.filter, namespaces=scope.namespaces)
+
+
+def retrieve(query: str, query_embedding: Optional[np.ndarray], top_k: int, scope: Scope = DEFAULT_SCOPE,
+             mode: str = RETRIEVAL_MODE) -> List[VectorMatch]:
+    """
+    The `top_k` chunks of the scope's collections (and documents) for a query, best first, by the retrieval mode.
+
+    In hybrid mode a failing vector store query (or a missing query embedding) degrades to the
+    BM25 ranking alone instead of failing the request, and a failing BM25 query to the vector ranking.
+    """
+    if mode == "dense":
+        return _dense(query_embedding, top_k, scope)
+    if mode == "lexical":
+        return _lexical(query, top_k, scope)
+    candidates = max(top_k, HYBRID_CANDIDATES)
+    if query_embedding is None:
+        return _lexical(query, top_k, scope)
+    try:
+        dense = _dense(query_embedding, candidates, scope)
+    except Exception as e:
+        print(f"Vector query failed ({e}), answering from the lexical index")
+        return _lexical(query, top_k, scope)
+    try:
+        lexical = _lexical(query, candidates, scope)
+    except Exception as e:
+        print(f"Lexical query failed ({e}), answering from the vector store")
+        return dense[:top_k]
+    return reciprocal_rank_fusion([dense, lexical], top_k)
+
+
+async def aretrieve(query: str, query_embedding: Optional[np.ndarray], top_k: int, scope: Scope = DEFAULT_SCOPE,
+                    mode: str = RETRIEVAL_MODE, timeout: Optional[float] = None) -> List[VectorMatch]:
+    """
+    Async variant of retrieve: the vector store and BM25 queries run concurrently in the default
+    thread pool, each bounded by `timeout`. In hybrid mode a vector query that times out falls
+    back to the BM25 ranking too.
+    """
+    if mode == "dense":
+        return await asyncio.wait_for(_adense(query_embedding, top_k, scope), timeout)
+    if mode == "lexical":
+        return await asyncio.wait_for(asyncio.to_thread(_lexical, query, top_k, scope), timeout)
+    candidates = max(top_k, HYBRID_CANDIDATES)
+    if query_embedding is None:
+        return await asyncio.wait_for(asyncio.to_thread(_lexical, query, top_k, scope), timeout)
+    dense, lexical = await asyncio.gather(
+        asyncio.wait_for(_adense(query_embedding, candidates, scope), timeout),
+        asyncio.wait_for(asyncio.to_thread(_lexical, query, candidates, scope), timeout),
+        return_exceptions=True
+    )
+    if isinstance(dense, BaseException):
+        if isinstance(lexical, BaseException):
+            raise dense
+        print(f"Vector query failed ({dense!r}), answering from the lexical index")
+        return lexical[:top_k]
+    if isinstance(lexical, BaseException):
+        print(f"Lexical query failed ({lexical!r}), answering from the vector store")
+        return dense[:top_k]
+    return reciprocal_rank_fusion([dense, lexical], top_k)
@@ -0,0 +1,470 @@
+import asyncio
+import hashlib
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import hnswlib
+except ImportError:  # the approximate index is optional
+    hnswlib = None
+
+
+class LocalSemanticIndex:
+    """
+    In-process nearest-neighbour index over cached query embeddings, with per-entry expiry.
+
+    Embeddings are unit length, so cosine similarity is a dot product. Below `ann_min_size`
+    entries (or without hnswlib) lookups are one vectorized scan; above it an HNSW graph keeps
+    lookup cost roughly flat as the cache grows. Expired entries are skipped by lookups and
+    their rows reused by later inserts. When full, the entry closest to expiry is evicted.
+    """
+
+    def __init__(self, max_entries: int = 500000, ann_min_size: int = 20000):
+        self.max_entries = max_entries
+        self.ann_min_size = ann_min_size
+        self._lock = threading.Lock()
+        self._vectors: Optional[np.ndarray] = None
+        self._expires = np.zeros(0)
+        self._keys: List[Optional[str]] = []
+        self._rows: Dict[str, int] = {}
+        self._free: List[int] = []
+        self._ann = None
+
+    def _reserve_row(self, dimension: int, now: float) -> int:
+        if self._vectors is None:
+            self._vectors = np.zeros((1024, dimension), dtype=np.float32)
+            self._expires = np.zeros(1024)
+            self._keys = [None] * 1024
+        if not self._free:
+            self._evict_expired(now)
+        if not self._free and len(self._rows) >= self.max_entries:
+            live = np.fromiter(self._rows.values(), dtype=np.int64)
+            self._remove_row(int(live[np.argmin(self._expires[live])]))
+        if self._free:
+            return self._free.pop()
+
+        row = len(self._rows)
+        if row >= len(self._vectors):
+            capacity = len(self._vectors) * 2
+            vectors = np.zeros((capacity, dimension), dtype=np.float32)
+            vectors[:len(self._vectors)] = self._vectors
+            self._vectors = vectors
+            expires = np.zeros(capacity)
+            expires[:len(self._expires)] = self._expires
+            self._expires = expires
+            self._keys.extend([None] * (capacity - len(self._keys)))
+            if self._ann is not None:
+                self._ann.resize_index(capacity)
+        return row
+
+    def _remove_row(self, row: int) -> None:
+        key = self._keys[row]
+        if key is not None:
+            self._rows.pop(key, None)
+        self._keys[row] = None
+        self._expires[row] = 0.0
+        self._free.append(row)
+        if self._ann is not None:
+            try:
+                self._ann.mark_deleted(row)
+            except RuntimeError:
+                pass
+
+    def _evict_expired(self, now: float) -> None:
+        live = np.fromiter(self._rows.values(), dtype=np.int64)
+        for row in live[self._expires[live] <= now]:
+            self._remove_row(int(row))
+
+    def _ensure_ann(self) -> None:
+        if self._ann is not None or hnswlib is None or len(self._rows) < self.ann_min_size:
+            return
+        ann = hnswlib.Index(space="ip", dim=self._vectors.shape[1])  # type: ignore
+        ann.init_index(max_elements=len(self._vectors), ef_construction=200, M=16, allow_replace_deleted=True)  # type: ignore
+        ann.set_ef(64)
+        rows = np.fromiter(self._rows.values(), dtype=np.int64)
+        ann.add_items(self._vectors[rows], rows)  # type: ignore
+        self._ann = ann
+
+    def add(self, key: str, embedding: np.ndarray, expires_at: float, now: Optional[float] = None) -> None:
+        now = time.time() if now is None else now
+        embedding = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        with self._lock:
+            row = self._rows.get(key)
+            if row is None:
+                row = self._reserve_row(len(embedding), now)
+            self._vectors[row] = embedding  # type: ignore
+            self._expires[row] = expires_at
+            self._keys[row] = key
+            self._rows[key] = row
+            if self._ann is not None:
+                self._ann.add_items(embedding[None, :], [row], replace_deleted=True)
+            else:
+                self._ensure_ann()
+
+    def remove(self, key: str) -> None:
+        with self._lock:
+            row = self._rows.get(key)
+            if row is not None:
+                self._remove_row(row)
+
+    def search(self, embedding: np.ndarray, top_k: int = 1, now: Optional[float] = None) -> List[Tuple[str, float]]:
+        """Most similar live entries as (key, cosine similarity), best first"""
+        now = time.time() if now is None else now
+        query = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        with self._lock:
+            if not self._rows:
+                return []
+            live = self._expires > now
+            k = min(top_k, int(live.sum()))
+            if k == 0:
+                return []
+            if self._ann is not None:
+                try:
+                    labels, distances = self._ann.knn_query(query, k=k, filter=lambda label: bool(live[label]))
+                    return [(self._keys[row], float(1.0 - distance)) for row, distance in zip(labels[0], distances[0])]  # type: ignore
+                except RuntimeError:
+                    pass
+            end = max(self._rows.values()) + 1
+            scores = self._vectors[:end] @ query  # type: ignore
+            scores[~live[:end]] = -np.inf
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(self._keys[row], float(scores[row])) for row in top]  # type: ignore
+
+    def keys(self) -> List[str]:
+        with self._lock:
+            return list(self._rows)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._rows
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+
+class SemanticCache:
+    """
+    Response cache looked up by query embedding similarity.
+
+    Entries are Redis hashes `semcache:<corpus version>:<query hash>` holding the query, response,
+    score, corpus version and embedding, with the cache TTL set on the key. Lookups only match
+    entries of the corpus version they are given, so answers cached before an ingestion stop
+    matching as soon as the version is bumped. When the Redis server has the search module,
+    nearest neighbours come from a server-side HNSW index over those hashes (expired keys
+    drop out of it automatically). Otherwise an in-process LocalSemanticIndex is used. A background
+    thread syncs it from Redis with an incremental SCAN of the corpus version's keys, started by
+    the first lookup and again by a miss once `resync_seconds` have passed since the last sync
+    ended, so it picks up the entries other workers stored; lookups never wait for it. Without Redis at all, entries are kept in memory. `astore`/`alookup` do the same through a redis.asyncio client.
+    """
+
+    PREFIX = "semcache:"
+    # v2 adds the corpus_version field
+    INDEX_NAME = "idx:semcache:v2"
+    # older indexes over the same prefix, dropped so writes are not indexed twice
+    LEGACY_INDEX_NAMES = ("idx:semcache",)
+
+    def __init__(self, redis_client, ttl: int, threshold: float, dimension: Callable[[], int], max_local_entries: int = 500000,
+                 async_redis_client=None, resync_seconds: float = 30.0):
+        self.redis_client = redis_client
+        self.async_redis_client = async_redis_client
+        self.ttl = ttl
+        self.threshold = threshold
+        self.resync_seconds = resync_seconds
+        self._dimension = dimension
+        self.local_index = LocalSemanticIndex(max_entries=max_local_entries)
+        self._local_entries: Dict[str, Dict[str, Any]] = {}
+        self._server_index: Optional[bool] = None
+        self._setup_lock = threading.Lock()
+        # time.monotonic() of the end of the last SCAN sync of the local index, None before the first
+        self._synced_at: Optional[float] = None
+        self._syncing = False
+        # decode_responses=False client for the sync, created on first use
+        self._binary_client = None
+        self._local_version: Optional[int] = None
+
+    @staticmethod
+    def _key_for(query: str, corpus_version: int = 0) -> str:
+        return f"{SemanticCache.PREFIX}{corpus_version}:{hashlib.md5(query.encode()).hexdigest()}"
+
+    def _sync_local_version(self, corpus_version: int) -> None:
+        """Drop local index entries of other corpus versions once a new version shows up"""
+        if self._local_version == corpus_version:
+            return
+        self._local_version = corpus_version
+        prefix = f"{self.PREFIX}{corpus_version}:"
+        for key in self.local_index.keys():
+            if not key.startswith(prefix):
+                self.local_index.remove(key)
+                self._local_entries.pop(key, None)
+
+    def _use_server_index(self) -> bool:
+        """Create the RediSearch index on first use; False when the module is unavailable"""
+        if self._server_index is not None:
+            return self._server_index
+        with self._setup_lock:
+            if self._server_index is not None:
+                return self._server_index
+            try:
+                from redis.commands.search.field import NumericField, TextField, VectorField
+                from redis.commands.search.indexDefinition import IndexDefinition, IndexType
+
+                try:
+                    self.redis_client.ft(self.INDEX_NAME).info()
+                except Exception as e:
+                    if "unknown command" in str(e).lower():
+                        raise
+                    self.redis_client.ft(self.INDEX_NAME).create_index(
+                        [
+                            TextField("query"),
+                            NumericField("timestamp"),
+                            NumericField("corpus_version"),
+                            VectorField("embedding", "HNSW", {"TYPE": "FLOAT32", "DIM": self._dimension(), "DISTANCE_METRIC": "COSINE"}),
+                        ],
+                        definition=IndexDefinition(prefix=[self.PREFIX], index_type=IndexType.HASH)
+                    )
+                self._drop_legacy_indexes()
+                self._server_index = True
+            except Exception as e:
+                print(f"Redis search module unavailable ({e}), using the in-process semantic cache index")
+                self._server_index = False
+        return self._server_index
+
+    def _drop_legacy_indexes(self) -> None:
+        for name in self.LEGACY_INDEX_NAMES:
+            try:
+                # the index only, the hashes are shared with the current one
+                self.redis_client.ft(name).dropindex(delete_documents=False)
+                print(f"Dropped legacy semantic cache index {name}")
+            except Exception as e:
+                if "unknown index" not in str(e).lower() and "no such index" not in str(e).lower():
+                    print(f"Could not drop legacy semantic cache index {name}: {e}")
+
+    def _resync_due(self) -> bool:
+        return not self._syncing and (self._synced_at is None or time.monotonic() - self._synced_at >= self.resync_seconds)
+
+    def _schedule_sync(self, corpus_version: int) -> None:
+        """Start a background sync of the local index when one is due"""
+        if not self._resync_due():
+            return
+        with self._setup_lock:
+            if not self._resync_due():
+                return
+            self._syncing = True
+        threading.Thread(target=self._sync_local_index, args=(corpus_version,), name="semantic-cache-sync", daemon=True).start()
+
+    def _binary(self):
+        # embeddings are raw float32 bytes, read them without response decoding
+        if self._binary_client is None:
+            import redis
+
+            pool = self.redis_client.connection_pool
+            connection_kwargs = {**pool.connection_kwargs, "decode_responses": False}
+            self._binary_client = redis.Redis(connection_pool=redis.ConnectionPool(connection_class=pool.connection_class, **connection_kwargs))
+        return self._binary_client
+
+    def _sync_local_index(self, corpus_version: int) -> None:
+        """Add the corpus version's entries missing from the local index, found with SCAN, which does not block the server like KEYS"""
+        try:
+            binary_client = self._binary()
+            batch: List[bytes] = []
+            for key in binary_client.scan_iter(match=f"{self.PREFIX}{corpus_version}:*", count=1000):
+                if self._local_version != corpus_version:
+                    # lookups moved on to a newer corpus, these entries would be dropped anyway
+                    return
+                if key.decode() in self.local_index:
+                    continue
+                batch.append(key)
+                if len(batch) >= 1000:
+                    self._seed_batch(binary_client, batch, time.time())
+                    batch = []
+            if batch:
+                self._seed_batch(binary_client, batch, time.time())
+        except Exception as e:
+            print(f"Semantic cache sync error: {e}")
+        finally:
+            self._synced_at = time.monotonic()
+            self._syncing = False
+
+    def close(self) -> None:
+        """Disconnect the sync client's connections"""
+        if self._binary_client is not None:
+            self._binary_client.connection_pool.disconnect()
+            self._binary_client = None
+
+    def _seed_batch(self, binary_client, keys: List[bytes], now: float) -> None:
+        pipe = binary_client.pipeline(transaction=False)
+        for key in keys:
+            pipe.hget(key, "embedding")
+            pipe.ttl(key)
+        results = pipe.execute()
+        for key, embedding, ttl in zip(keys, results[0::2], results[1::2]):
+            if embedding and ttl and ttl > 0:
+                self.local_index.add(key.decode(), np.frombuffer(embedding, dtype=np.float32), now + ttl, now=now)
+
+    def _store_local(self, key: str, entry: Dict[str, Any], vector: np.ndarray, now: float) -> None:
+        self._local_entries[key] = entry
+        self.local_index.add(key, vector, now + self.ttl, now=now)
+        if len(self._local_entries) > 2 * len(self.local_index) + 1024:
+            # drop payloads of entries the index has evicted
+            self._local_entries = {k: v for k, v in self._local_entries.items() if k in self.local_index}
+
+    def _lookup_memory(self, vector: np.ndarray, threshold: float, top_k: int) -> List[Dict[str, Any]]:
+        return [
+            {**self._local_entries[key], "similarity": score}
+            for key, score in self.local_index.search(vector, top_k) if score >= threshold and key in self._local_entries
+        ]
+
+    def store(self, query: str, response: str, embedding: np.ndarray, similarity_score: float = 0.0, pipe=None, corpus_version: int = 0) -> None:
+        """Cache a response under its query embedding; with `pipe` the Redis writes join the caller's pipeline"""
+        key = self._key_for(query, corpus_version)
+        now = time.time()
+        vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        entry = {"query": query, "response": response, "similarity_score": similarity_score, "timestamp": now, "corpus_version": corpus_version}
+
+        if self.redis_client is None:
+            self._sync_local_version(corpus_version)
+            self._store_local(key, entry, vector, now)
+            return
+
+        own_pipe = pipe is None
+        if own_pipe:
+            pipe = self.redis_client.pipeline(transaction=True)
+        pipe.hset(key, mapping={**entry, "embedding": vector.tobytes()})
+        pipe.expire(key, self.ttl)
+        if own_pipe:
+            pipe.execute()
+        if not self._use_server_index():
+            self._sync_local_version(corpus_version)
+            self.local_index.add(key, vector, now + self.ttl, now=now)
+
+    async def astore(self, query: str, response: str, embedding: np.ndarray, similarity_score: float = 0.0, pipe=None,
+                     corpus_version: int = 0) -> None:
+        """Async variant of store; `pipe` is a redis.asyncio pipeline"""
+        if self.async_redis_client is None:
+            self.store(query, response, embedding, similarity_score, corpus_version=corpus_version)
+            return
+
+        key = self._key_for(query, corpus_version)
+        now = time.time()
+        vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        entry = {"query": query, "response": response, "similarity_score": similarity_score, "timestamp": now, "corpus_version": corpus_version}
+
+        own_pipe = pipe is None
+        if own_pipe:
+            pipe = self.async_redis_client.pipeline(transaction=True)
+        pipe.hset(key, mapping={**entry, "embedding": vector.tobytes()})
+        pipe.expire(key, self.ttl)
+        if own_pipe:
+            await pipe.execute()
+        if self._server_index is None:
+            await asyncio.to_thread(self._use_server_index)
+        if not self._server_index:
+            self._sync_local_version(corpus_version)
+            self.local_index.add(key, vector, now + self.ttl, now=now)
+
+    def _local_candidates(self, vector: np.ndarray, threshold: float, top_k: int, corpus_version: int) -> List[Tuple[str, float]]:
+        prefix = f"{self.PREFIX}{corpus_version}:"
+        return [(key, score) for key, score in self.local_index.search(vector, top_k) if score >= threshold and key.startswith(prefix)]
+
+    def _hydrate_candidates(self, candidates: List[Tuple[str, float]], values_list: List[List[Any]]) -> List[Dict[str, Any]]:
+        results = []
+        for (key, score), values in zip(candidates, values_list):
+            if values[1] is None:
+                # expired in Redis before the local index noticed
+                self.local_index.remove(key)
+                continue
+            results.append(self._entry(values, score))
+        return results
+
+    def lookup(self, embedding: np.ndarray, threshold: Optional[float] = None, top_k: int = 1, corpus_version: int = 0) -> List[Dict[str, Any]]:
+        """
+        Cached responses of `corpus_version` whose query embedding has cosine similarity >= threshold, best first.
+
+        Each result holds query, response, similarity_score, timestamp and similarity.
+        """
+        threshold = self.threshold if threshold is None else threshold
+        vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+
+        if self.redis_client is None:
+            self._sync_local_version(corpus_version)
+            return self._lookup_memory(vector, threshold, top_k)
+
+        if self._use_server_index():
+            documents = self.redis_client.ft(self.INDEX_NAME).search(
+                self._server_query(top_k, corpus_version), query_params={"vec": vector.tobytes()}
+            ).docs
+            return self._server_results(documents, threshold)
+
+        self._sync_local_version(corpus_version)
+        candidates = self._local_candidates(vector, threshold, top_k, corpus_version)
+        if not candidates:
+            # other workers may have stored a match since the last sync, later lookups will find it
+            self._schedule_sync(corpus_version)
+            return []
+        pipe = self.redis_client.pipeline(transaction=False)
+        for key, _ in candidates:
+            pipe.hmget(key, "query", "response", "similarity_score", "timestamp")
+        return self._hydrate_candidates(candidates, pipe.execute())
+
+    async def alookup(self, embedding: np.ndarray, threshold: Optional[float] = None, top_k: int = 1, corpus_version: int = 0) -> List[Dict[str, Any]]:
+        """Async variant of lookup"""
+        if self.async_redis_client is None:
+            return self.lookup(embedding, threshold, top_k, corpus_version)
+
+        threshold = self.threshold if threshold is None else threshold
+        vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+
+        # one-off index setup runs off the event loop
+        if self._server_index is None:
+            await asyncio.to_thread(self._use_server_index)
+        if self._server_index:
+            result = await self.async_redis_client.ft(self.INDEX_NAME).search(
+                self._server_query(top_k, corpus_version), query_params={"vec": vector.tobytes()}
+            )
+            return self._server_results(result.docs, threshold)
+
+        self._sync_local_version(corpus_version)
+        candidates = self._local_candidates(vector, threshold, top_k, corpus_version)
+        if not candidates:
+            self._schedule_sync(corpus_version)
+            return []
+        pipe = self.async_redis_client.pipeline(transaction=False)
+        for key, _ in candidates:
+            pipe.hmget(key, "query", "response", "similarity_score", "timestamp")
+        return self._hydrate_candidates(candidates, await pipe.execute())
+
+    @staticmethod
+    def _server_query(top_k: int, corpus_version: int = 0):
+        from redis.commands.search.query import Query
+
+        return (
+            Query(f"(@corpus_version:[{int(corpus_version)} {int(corpus_version)}])=>[KNN {top_k} @embedding $vec AS distance]")
+            .sort_by("distance")
+            .return_fields("query", "response", "similarity_score", "timestamp", "distance")
+            .dialect(2)
+        )
+
+    def _server_results(self, documents, threshold: float) -> List[Dict[str, Any]]:
+        results = []
+        for document in documents:
+            similarity = 1.0 - float(document.distance)
+            if similarity >= threshold:
+                results.append(self._entry([document.query, document.response, document.similarity_score, document.timestamp], similarity))
+        return results
+
+    @staticmethod
+    def _entry(values: List[Any], similarity: float) -> Dict[str, Any]:
+        query, response, similarity_score, timestamp = values
+        return {
+            "query": query,
+            "response": response,
+            "similarity_score": float(similarity_score or 0.0),
+            "timestamp": float(timestamp or 0.0),
+            "similarity": similarity
+        }
+
+
+__all__ = ["LocalSemanticIndex", "SemanticCache"]
@@ -0,0 +1,532 @@
+import json
+import os
+import shutil
+import threading
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+from dotenv import load_dotenv
+
+try:
+    import hnswlib
+except ImportError:  # the approximate index is optional
+    hnswlib = None
+
+load_dotenv()
+
+
+@dataclass
+class VectorMatch:
+    id: str
+    score: float
+    metadata: Dict[str, Any] = field(default_factory=dict)
+
+
+class VectorStore(ABC):
+    """
+    Storage and similarity search of chunk embeddings.
+
+    Vectors live in namespaces, separate partitions searched one at a time; "" is the default namespace.
+    """
+
+    @abstractmethod
+    def upsert(self, ids: Sequence[str], vectors: np.ndarray, metadata: Sequence[Dict[str, Any]], namespace: str = "") -> None:
+        """Insert or replace vectors, one id and metadata dict per row of `vectors`"""
+
+    @abstractmethod
+    def query(self, vector: np.ndarray, top_k: int = 5, filter: Optional[Dict[str, Any]] = None, namespace: str = "") -> List[VectorMatch]:
+        """Return the `top_k` most similar vectors of a namespace, best first, optionally restricted by a metadata filter"""
+
+    @abstractmethod
+    def delete(self, ids: Optional[Sequence[str]] = None, filter: Optional[Dict[str, Any]] = None, namespace: str = "",
+               delete_all: bool = False) -> None:
+        """Delete vectors of a namespace by id, by metadata filter, or all of them"""
+
+
+def _compare(value: Any, operator: str, operand: Any) -> bool:
+    if operator == "$eq":
+        return value == operand
+    if operator == "$ne":
+        return value != operand
+    if operator == "$in":
+        return value in operand
+    if operator == "$nin":
+        return value not in operand
+    if operator == "$exists":
+        return (value is not None) == bool(operand)
+    if value is None:
+        return False
+    if operator == "$gt":
+        return value > operand
+    if operator == "$gte":
+        return value >= operand
+    if operator == "$lt":
+        return value < operand
+    if operator == "$lte":
+        return value <= operand
+    raise ValueError(f"Unsupported filter operator: {operator}")
+
+
+def matches_filter(metadata: Dict[str, Any], filter: Optional[Dict[str, Any]]) -> bool:
+    """Evaluate a Pinecone-style metadata filter ($eq, $ne, $in, $nin, $gt(e), $lt(e), $exists, $and, $or)"""
+    if not filter:
+        return True
+    for key, condition in filter.items():
+        if key == "$and":
+            if not all(matches_filter(metadata, sub) for sub in condition):
+                return False
+        elif key == "$or":
+            if not any(matches_filter(metadata, sub) for sub in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = metadata.get(key)
+            if not all(_compare(value, operator, operand) for operator, operand in condition.items()):
+                return False
+        elif metadata.get(key) != condition:
+            return False
+    return True
+
+
+class PineconeVectorStore(VectorStore):
+    """Vectors in a hosted Pinecone index"""
+
+    def __init__(self, api_key: Optional[str] = None, index_name: Optional[str] = None):
+        from pinecone import Pinecone
+
+        api_key = api_key or os.getenv("PINECONE_API_KEY")
+        if not api_key:
+            raise ValueError("PINECONE_API_KEY environment variable is not set")
+
+        index_name = index_name or os.getenv("PINECONE_INDEX_NAME")
+        if not index_name:
+            raise ValueError("PINECONE_INDEX_NAME environment variable is not set")
+
+        self.index = Pinecone(api_key=api_key).Index(index_name)
+
+    def upsert(self, ids: Sequence[str], vectors: np.ndarray, metadata: Sequence[Dict[str, Any]], namespace: str = "") -> None:
+        self.index.upsert(vectors=list(zip(ids, np.asarray(vectors, dtype=np.float32).tolist(), metadata)), namespace=namespace)
+
+    def query(self, vector: np.ndarray, top_k: int = 5, filter: Optional[Dict[str, Any]] = None, namespace: str = "") -> List[VectorMatch]:
+        results = self.index.query(
+            vector=np.asarray(vector, dtype=np.float32).tolist(),
+            top_k=top_k,
+            include_metadata=True,
+            filter=filter,
+            namespace=namespace
+        )
+        return [VectorMatch(match.id, match.score, match.metadata or {}) for match in results.matches]  # type: ignore
+
+    def delete(self, ids: Optional[Sequence[str]] = None, filter: Optional[Dict[str, Any]] = None, namespace: str = "",
+               delete_all: bool = False) -> None:
+        if delete_all:
+            self.index.delete(delete_all=True, namespace=namespace)
+        elif ids:
+            self.index.delete(ids=list(ids), namespace=namespace)
+        elif filter:
+            # delete by metadata is only available on pod-based indexes
+            self.index.delete(filter=filter, namespace=namespace)
+
+
+class LocalVectorStore(VectorStore):
+    """
+    In-process vector store persisted to a directory.
+
+    - vectors.f32: unit-length float32 rows in a memory-mapped file, so cosine similarity is a dot product
+    - metadata.jsonl: append-only log of upserts and deletes, replayed on load
+    - manifest.json: dimension and file capacity
+    - hnsw.bin: optional approximate (HNSW) graph index, used for unfiltered and filtered
+      queries once the store holds `ann_min_size` vectors and hnswlib is installed
+    - namespaces/<name>/: every other namespace is a store of its own in a subdirectory, so a
+      query only scans the vectors of its namespace
+    """
+
+    _initial_capacity = 1024
+
+    def __init__(self, path: str, dimension: Optional[int] = None, use_ann: bool = False,
+                 ann_min_size: int = 50000, ann_ef: int = 64, ann_m: int = 16):
+        self.path = path
+        self.dimension = dimension
+        self.use_ann = use_ann and hnswlib is not None
+        self.ann_min_size = ann_min_size
+        self.ann_ef = ann_ef
+        self.ann_m = ann_m
+
+        self._lock = threading.RLock()
+        self._vectors: Optional[np.memmap] = None
+        self._capacity = 0
+        self._count = 0
+        self._ids: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self._metadata: List[Dict[str, Any]] = []
+        self._alive = np.zeros(0, dtype=bool)
+        # rows per (metadata key, scalar value), narrows equality filters before evaluating them
+        self._postings: Dict[str, Dict[Any, set]] = {}
+        self._ann = None
+        self._ann_rows = 0
+        self._namespaces: Dict[str, "LocalVectorStore"] = {}
+
+        os.makedirs(path, exist_ok=True)
+        self._log_path = os.path.join(path, "metadata.jsonl")
+        self._manifest_path = os.path.join(path, "manifest.json")
+        self._vectors_path = os.path.join(path, "vectors.f32")
+        self._ann_path = os.path.join(path, "hnsw.bin")
+        self._load()
+
+    # -- persistence --
+
+    def _load(self) -> None:
+        if not os.path.exists(self._manifest_path):
+            return
+        with open(self._manifest_path) as f:
+            manifest = json.load(f)
+        self.dimension = manifest["dimension"]
+        self._capacity = manifest["capacity"]
+        self._ann_rows = manifest.get("ann_rows", 0)
+        self._open_vectors()
+
+        if os.path.exists(self._log_path):
+            with open(self._log_path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # blank line or a record torn by a crash mid-write
+                        continue
+                    if entry["op"] == "upsert":
+                        self._apply_upsert(entry["row"], entry["id"], entry["metadata"])
+                    else:
+                        self._apply_delete(entry["row"])
+        self._log = open(self._log_path, "a")
+        self._ensure_ann()
+
+    def _write_manifest(self) -> None:
+        manifest = {"dimension": self.dimension, "capacity": self._capacity, "ann_rows": self._ann_rows}
+        tmp_path = self._manifest_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self._manifest_path)
+
+    def _open_vectors(self) -> None:
+        self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="r+", shape=(self._capacity, self.dimension))
+
+    def _initialize(self, dimension: int) -> None:
+        self.dimension = dimension
+        self._capacity = self._initial_capacity
+        with open(self._vectors_path, "wb") as f:
+            f.truncate(self._capacity * dimension * 4)
+        self._open_vectors()
+        self._write_manifest()
+        self._log = open(self._log_path, "a")
+
+    def _grow(self, needed: int) -> None:
+        capacity = self._capacity
+        while capacity < needed:
+            capacity *= 2
+        if capacity == self._capacity:
+            return
+        self._vectors.flush()  # type: ignore
+        with open(self._vectors_path, "r+b") as f:
+            f.truncate(capacity * self.dimension * 4)  # type: ignore
+        self._capacity = capacity
+        # queries already holding the old mapping keep reading the rows it covers
+        self._open_vectors()
+        self._write_manifest()
+
+    def flush(self) -> None:
+        """Persist vectors, the metadata log and the approximate index, of every namespace"""
+        with self._lock:
+            for store in self._namespaces.values():
+                store.flush()
+            if self._vectors is None:
+                return
+            self._vectors.flush()
+            self._log.flush()
+            os.fsync(self._log.fileno())
+            if self._ann is not None:
+                self._ann.save_index(self._ann_path)
+                self._ann_rows = self._count
+            self._write_manifest()
+
+    # -- bookkeeping --
+
+    def _index_metadata(self, row: int, metadata: Dict[str, Any], add: bool) -> None:
+        for key, value in metadata.items():
+            if isinstance(value, (str, int, float, bool)):
+                rows = self._postings.setdefault(key, {}).setdefault(value, set())
+                if add:
+                    rows.add(row)
+                else:
+                    rows.discard(row)
+
+    def _apply_upsert(self, row: int, id: str, metadata: Dict[str, Any]) -> None:
+        if row < len(self._ids) and self._alive[row]:
+            self._index_metadata(row, self._metadata[row], add=False)
+        if row >= len(self._ids):
+            grow = row + 1 - len(self._ids)
+            self._ids.extend([""] * grow)
+            self._metadata.extend([{}] * grow)
+        if len(self._alive) <= row:
+            alive = np.zeros(max(row + 1, len(self._alive) * 2, 1024), dtype=bool)
+            alive[:len(self._alive)] = self._alive
+            self._alive = alive
+        self._ids[row] = id
+        self._metadata[row] = metadata
+        self._index_metadata(row, metadata, add=True)
+        self._rows[id] = row
+        self._alive[row] = True
+        self._count = max(self._count, row + 1)
+
+    def _apply_delete(self, row: int) -> None:
+        if row < len(self._ids) and self._alive[row]:
+            self._alive[row] = False
+            self._rows.pop(self._ids[row], None)
+            self._index_metadata(row, self._metadata[row], add=False)
+            self._metadata[row] = {}
+
+    # -- approximate index --
+
+    def _ensure_ann(self) -> None:
+        if not self.use_ann or self._ann is not None or self._count < self.ann_min_size:
+            return
+        ann = hnswlib.Index(space="ip", dim=self.dimension)  # type: ignore
+        rows = 0
+        if os.path.exists(self._ann_path) and self._ann_rows:
+            ann.load_index(self._ann_path, max_elements=self._capacity)
+            rows = min(self._ann_rows, self._count)
+            for row in np.flatnonzero(~self._alive[:rows]):
+                try:
+                    ann.mark_deleted(int(row))
+                except RuntimeError:
+                    pass
+        else:
+            ann.init_index(max_elements=self._capacity, ef_construction=200, M=self.ann_m)
+        ann.set_ef(self.ann_ef)
+        live = np.flatnonzero(self._alive[rows:self._count]) + rows
+        if len(live):
+            ann.add_items(np.asarray(self._vectors[live]), live)  # type: ignore
+        self._ann = ann
+
+    # -- namespaces --
+
+    def _namespace_path(self, namespace: str) -> str:
+        return os.path.join(self.path, "namespaces", namespace)
+
+    def _namespace(self, namespace: str, create: bool = True) -> Optional["LocalVectorStore"]:
+        """Store of a namespace other than the default one, None when it does not exist and `create` is false"""
+        with self._lock:
+            store = self._namespaces.get(namespace)
+            if store is None and (create or os.path.exists(self._namespace_path(namespace))):
+                store = self._namespaces[namespace] = LocalVectorStore(
+                    self._namespace_path(namespace), use_ann=self.use_ann, ann_min_size=self.ann_min_size, ann_ef=self.ann_ef, ann_m=self.ann_m
+                )
+            return store
+
+    def _drop_namespace(self, namespace: str) -> None:
+        with self._lock:
+            store = self._namespaces.pop(namespace, None)
+            if store is not None and store._vectors is not None:
+                store._log.close()
+            shutil.rmtree(self._namespace_path(namespace), ignore_errors=True)
+
+    # -- VectorStore --
+
+    def upsert(self, ids: Sequence[str], vectors: np.ndarray, metadata: Sequence[Dict[str, Any]], namespace: str = "") -> None:
+        if namespace:
+            self._namespace(namespace).upsert(ids, vectors, metadata)  # type: ignore
+            return
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim != 2 or len(vectors) != len(ids) or len(ids) != len(metadata):
+            raise ValueError("ids, vectors and metadata must have the same length")
+        if not len(ids):
+            return
+        if len(set(ids)) != len(ids):
+            # an id given twice in one call: the last one wins, as with two upserts, instead of two live rows
+            keep = sorted({id: i for i, id in enumerate(ids)}.values())
+            ids, vectors, metadata = [ids[i] for i in keep], vectors[keep], [metadata[i] for i in keep]
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        vectors = vectors / norms
+
+        with self._lock:
+            if self._vectors is None:
+                self._initialize(vectors.shape[1])
+            if vectors.shape[1] != self.dimension:
+                raise ValueError(f"Vector dimension {vectors.shape[1]} does not match store dimension {self.dimension}")
+
+            rows = []
+            next_row = self._count
+            for id in ids:
+                row = self._rows.get(id)
+                if row is None:
+                    row = next_row
+                    next_row += 1
+                rows.append(row)
+            self._grow(next_row)
+
+            rows_array = np.asarray(rows)
+            self._vectors[rows_array] = vectors  # type: ignore
+            # the log line is the commit record, so it is written after the vectors
+            lines = []
+            for id, row, meta in zip(ids, rows, metadata):
+                self._apply_upsert(row, id, dict(meta))
+                lines.append(json.dumps({"op": "upsert", "row": row, "id": id, "metadata": meta}))
+            self._log.write("\n".join(lines) + "\n")
+            self._log.flush()
+
+            if self._ann is not None:
+                if self._count > self._ann.get_max_elements():
+                    self._ann.resize_index(self._capacity)
+                for row in rows:
+                    try:
+                        self._ann.unmark_deleted(row)
+                    except RuntimeError:
+                        pass
+                self._ann.add_items(vectors, rows_array)
+            else:
+                self._ensure_ann()
+
+    def _equality_rows(self, filter: Dict[str, Any]) -> Optional[set]:
+        """Rows allowed by the top-level equality/$in conditions of a filter, None if it has none"""
+        allowed: Optional[set] = None
+        for key, condition in filter.items():
+            if key.startswith("$"):
+                continue
+            if isinstance(condition, dict):
+                if "$eq" in condition:
+                    values = [condition["$eq"]]
+                elif "$in" in condition:
+                    values = list(condition["$in"])
+                else:
+                    continue
+            else:
+                values = [condition]
+            postings = self._postings.get(key, {})
+            rows = set()
+            for value in values:
+                rows |= postings.get(value, set()) if isinstance(value, (str, int, float, bool)) else set()
+            allowed = rows if allowed is None else allowed & rows
+        return allowed
+
+    def _filter_mask(self, count: int, filter: Optional[Dict[str, Any]]) -> np.ndarray:
+        if not filter:
+            return self._alive[:count].copy()
+        allowed = self._equality_rows(filter)
+        if allowed is None:
+            candidates = np.flatnonzero(self._alive[:count])
+        else:
+            candidates = np.fromiter((row for row in allowed if row < count), dtype=np.int64)
+        mask = np.zeros(count, dtype=bool)
+        for row in candidates:
+            if matches_filter(self._metadata[row], filter):
+                mask[row] = True
+        return mask
+
+    def query(self, vector: np.ndarray, top_k: int = 5, filter: Optional[Dict[str, Any]] = None, namespace: str = "") -> List[VectorMatch]:
+        if namespace:
+            store = self._namespace(namespace, create=False)
+            return store.query(vector, top_k, filter) if store is not None else []
+        query = np.asarray(vector, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+
+        with self._lock:
+            if self._vectors is None or not self._count or top_k <= 0:
+                return []
+            count = self._count
+            vectors = self._vectors
+            mask = self._filter_mask(count, filter)
+            k = min(top_k, int(mask.sum()))
+            if k == 0:
+                return []
+
+            rows = None
+            if self._ann is not None:
+                try:
+                    labels, distances = self._ann.knn_query(
+                        query, k=k, filter=(lambda label: label < count and bool(mask[label])) if filter else None
+                    )
+                    rows = labels[0].astype(np.int64)
+                    scores = 1.0 - distances[0]
+                except RuntimeError:
+                    # too few graph neighbours pass the filter, fall back to the exact scan
+                    rows = None
+
+        if rows is None:
+            all_scores = np.asarray(vectors[:count] @ query)
+            all_scores[~mask] = -np.inf
+            top = np.argpartition(-all_scores, k - 1)[:k]
+            rows = top[np.argsort(-all_scores[top])]
+            scores = all_scores[rows]
+
+        with self._lock:
+            return [VectorMatch(self._ids[row], float(score), dict(self._metadata[row])) for row, score in zip(rows, scores)]
+
+    def delete(self, ids: Optional[Sequence[str]] = None, filter: Optional[Dict[str, Any]] = None, namespace: str = "",
+               delete_all: bool = False) -> None:
+        if namespace:
+            if delete_all:
+                self._drop_namespace(namespace)
+            else:
+                store = self._namespace(namespace, create=False)
+                if store is not None:
+                    store.delete(ids, filter)
+            return
+        with self._lock:
+            if self._vectors is None:
+                return
+            if delete_all:
+                rows: Iterable[int] = np.flatnonzero(self._alive[:self._count]).tolist()
+            elif ids:
+                rows = [self._rows[id] for id in ids if id in self._rows]
+            elif filter:
+                rows = np.flatnonzero(self._filter_mask(self._count, filter)).tolist()
+            else:
+                return
+
+            lines = []
+            for row in rows:
+                self._apply_delete(row)
+                lines.append(json.dumps({"op": "delete", "row": row}))
+                if self._ann is not None:
+                    try:
+                        self._ann.mark_deleted(row)
+                    except RuntimeError:
+                        pass
+            if lines:
+                self._log.write("\n".join(lines) + "\n")
+                self._log.flush()
+
+    def __len__(self) -> int:
+        return int(self._alive[:self._count].sum())
+
+
+_vector_store: Optional[VectorStore] = None
+_vector_store_lock = threading.Lock()
+
+
+def get_vector_store() -> VectorStore:
+    """
+    Return the process-wide vector store, created on first use.
+
+    VECTOR_STORE_BACKEND selects "pinecone" (default) or "local"; the local store lives in
+    LOCAL_VECTOR_STORE_PATH and uses the HNSW index when LOCAL_VECTOR_STORE_ANN is enabled.
+    """
+    global _vector_store
+    if _vector_store is None:
+        with _vector_store_lock:
+            if _vector_store is None:
+                backend = os.getenv("VECTOR_STORE_BACKEND", "pinecone").lower()
+                if backend == "pinecone":
+                    _vector_store = PineconeVectorStore()
+                elif backend == "local":
+                    _vector_store = LocalVectorStore(
+                        os.getenv("LOCAL_VECTOR_STORE_PATH", "data/vector_store"),
+                        use_ann=os.getenv("LOCAL_VECTOR_STORE_ANN", "false").lower() in ("1", "true", "yes"),
+                        ann_min_size=int(os.getenv("LOCAL_VECTOR_STORE_ANN_MIN_SIZE", 50000))
+                    )
+                else:
+                    raise ValueError(f"Unknown VECTOR_STORE_BACKEND: {backend}")
+    return _vector_store
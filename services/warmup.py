@@ -0,0 +1,170 @@
+import asyncio
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Union
+
+from dotenv import load_dotenv
+from sqlalchemy import text
+
+from database.db_conn import get_async_engine, get_engine
+from services.chunk_text import get_tokenizer
+from services.intent_router import INTENT_ROUTER_ENABLED, intent_router
+from services.lexical_index import LEXICAL_INDEX_ENABLED, get_lexical_index
+from services.llm_client import get_llm_client
+from services.query_batcher import query_batcher
+from services.redis_service import get_redis_service
+from services.retrieval import RETRIEVAL_MODE
+from services.vector_store import get_vector_store
+
+load_dotenv()
+
+# "blocking": warm up before the server accepts requests; "background": accept requests (readiness
+# reports 503) while warming up; "off": everything is created on first use
+WARMUP_MODE = os.getenv("WARMUP_MODE", "blocking").lower()
+# pooled connections opened ahead of the first requests, per pool (sync and async)
+WARMUP_DB_CONNECTIONS = int(os.getenv("WARMUP_DB_CONNECTIONS", 2))
+
+
+def _embedding_model() -> None:
+    # loads the model, runs its first forward pass and starts the query batcher's worker thread
+    query_batcher.encode("warmup")
+
+
+def _intent_router() -> None:
+    if INTENT_ROUTER_ENABLED:
+        intent_router.warmup()
+
+
+def _lexical_index() -> None:
+    # loads the snapshot and replays the log
+    if LEXICAL_INDEX_ENABLED or RETRIEVAL_MODE != "dense":
+        get_lexical_index()
+
+
+def _database() -> None:
+    engine = get_engine()
+    connections = [engine.connect() for _ in range(max(1, WARMUP_DB_CONNECTIONS))]
+    try:
+        for conn in connections:
+            conn.execute(text("SELECT 1"))
+    finally:
+        for conn in connections:
+            conn.close()
+
+
+def _agent() -> None:
+    from agent.agent_declare import get_question_answering_agent
+
+    get_question_answering_agent()
+
+
+async def _async_database() -> None:
+    # asyncpg connections belong to the event loop that opened them, so this runs on the server's loop
+    engine = get_async_engine()
+
+    async def ping() -> None:
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
+    await asyncio.gather(*(ping() for _ in range(max(1, WARMUP_DB_CONNECTIONS))))
+
+
+async def _async_redis() -> None:
+    client = get_redis_service().async_redis_client
+    if client is not None:
+        await client.ping()
+
+
+Step = Callable[[], Union[None, Awaitable[None]]]
+
+# blocking steps run concurrently in threads, then the async ones on the event loop
+STEPS: Dict[str, Step] = {
+    "embedding_model": _embedding_model,
+    "tokenizer": get_tokenizer,
+    "intent_router": _intent_router,
+    "database": _database,
+    "redis": get_redis_service,
+    "vector_store": get_vector_store,
+    "lexical_index": _lexical_index,
+    "llm_client": get_llm_client,
+    "agent": _agent,
+    "async_database": _async_database,
+    "async_redis": _async_redis,
+}
+
+# Redis falls back to in-memory storage, the service works without it
+OPTIONAL_STEPS = {"redis", "async_redis"}
+
+
+class Warmup:
+    """
+    Creates the process-wide resources (models, clients, pools) ahead of the first request.
+
+    Every step is timed and its outcome kept for the readiness probe. The service is ready once
+    every required step succeeded; failed steps can be retried with `retry_failed`.
+    """
+
+    def __init__(self, steps: Dict[str, Step] = STEPS, optional: Iterable[str] = OPTIONAL_STEPS):
+        self.steps = steps
+        self.optional = set(optional)
+        self.results: Dict[str, Dict[str, Any]] = {}
+        self.finished = False
+        self.seconds: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run_step(self, name: str) -> None:
+        step = self.steps[name]
+        start = time.perf_counter()
+        try:
+            if asyncio.iscoroutinefunction(step):
+                await step()
+            else:
+                await asyncio.to_thread(step)
+            self.results[name] = {"status": "ok", "seconds": round(time.perf_counter() - start, 3)}
+        except Exception as e:
+            print(f"Warmup step {name} failed: {e}")
+            self.results[name] = {"status": "failed", "seconds": round(time.perf_counter() - start, 3), "error": str(e)}
+
+    async def arun(self, names: Optional[Iterable[str]] = None) -> bool:
+        """Run the given steps (all by default); returns whether the service is ready"""
+        names = list(self.steps) if names is None else list(names)
+        start = time.perf_counter()
+        for name in names:
+            self.results[name] = {"status": "running"}
+        await asyncio.gather(*(self._run_step(name) for name in names if not asyncio.iscoroutinefunction(self.steps[name])))
+        await asyncio.gather(*(self._run_step(name) for name in names if asyncio.iscoroutinefunction(self.steps[name])))
+        self.seconds = round(time.perf_counter() - start, 3)
+        self.finished = True
+        failed = self.failed()
+        print(f"Warmup finished in {self.seconds:.1f}s" + (f", failed: {', '.join(failed)}" if failed else ""))
+        return self.ready
+
+    def start(self) -> None:
+        """Warm up in the background of the running event loop"""
+        self._task = asyncio.create_task(self.arun())
+
+    def skip(self) -> None:
+        self.finished = True
+
+    def failed(self) -> List[str]:
+        return [name for name, result in self.results.items() if result["status"] == "failed"]
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    @property
+    def ready(self) -> bool:
+        return self.finished and all(result["status"] == "ok" for name, result in self.results.items() if name not in self.optional)
+
+    def retry_failed(self) -> None:
+        """Run the failed required steps again in the background, unless a run is in progress"""
+        failed = [name for name in self.failed() if name not in self.optional]
+        if self.finished and failed and not self.running:
+            self._task = asyncio.create_task(self.arun(failed))
+
+    def status(self) -> Dict[str, Any]:
+        return {"mode": WARMUP_MODE, "finished": self.finished, "seconds": self.seconds, "steps": self.results}
+
+
+warmup = Warmup()
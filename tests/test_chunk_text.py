@@ -0,0 +1,100 @@
+import random
+
+import pytest
+
+from benchmarks.bench_chunk_text import legacy_chunk_text_by_tokens
+from services.chunk_text import DEFAULT_TOKENIZER_MODEL, chunk_text_by_tokens, get_tokenizer, iter_chunks_by_tokens
+
+# multi-byte characters, accents the uncased tokenizer strips, and words split into subwords
+WORDS = ["the", "interview", "playing", "replayed", "café", "naïve", "Kathmandu", "日本", "☕", "2024", "résumé", "INV-0042", "tokenization"]
+VOCAB = [
+    "[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", "the", "interview", "play", "##ing", "re", "##play", "##ed", "cafe", "naive",
+    "kat", "##hman", "##du", "日", "本", "☕", "20", "##24", "resume", "in", "##v", "-", "00", "##42", "token", "##ization",
+]
+
+# (chunk_size, overlap): tiny windows put many boundaries on [CLS], [SEP] and subword edges
+WINDOWS = [(8, 3), (5, 0), (6, 5), (200, 50)]
+
+
+@pytest.fixture(scope="module")
+def word_piece_model(tmp_path_factory):
+    """A small uncased WordPiece tokenizer saved to disk, so the test needs no model download"""
+    from transformers import BertTokenizerFast
+
+    path = tmp_path_factory.mktemp("tokenizer")
+    vocab = path / "vocab.txt"
+    vocab.write_text("\n".join(VOCAB) + "\n", encoding="utf-8")
+    BertTokenizerFast(vocab_file=str(vocab), do_lower_case=True).save_pretrained(str(path))
+    return str(path)
+
+
+@pytest.fixture(scope="module", params=["word_piece", "default"])
+def model(request, word_piece_model):
+    if request.param == "word_piece":
+        return word_piece_model
+    try:
+        get_tokenizer(DEFAULT_TOKENIZER_MODEL)
+    except OSError:
+        pytest.skip(f"{DEFAULT_TOKENIZER_MODEL} is not in the Hugging Face cache")
+    return DEFAULT_TOKENIZER_MODEL
+
+
+def make_text(n_words, seed):
+    rng = random.Random(seed)
+    words = [rng.choice(WORDS) for _ in range(n_words)]
+    # single and double spaces, line breaks
+    return "".join(word + rng.choice([" ", " ", "  ", "\n"]) for word in words).rstrip()
+
+
+def legacy_windows(text, model, chunk_size, overlap):
+    """The legacy chunker's windows over encode(text), [CLS] and [SEP] included, as the original text they cover"""
+    tokenizer = get_tokenizer(model)
+    encoding = tokenizer(text, return_offsets_mapping=True, return_special_tokens_mask=True, verbose=False)
+    tokens = list(zip(encoding["input_ids"], encoding["offset_mapping"], encoding["special_tokens_mask"]))
+    windows = []
+    for i in range(0, len(tokens), chunk_size - overlap):
+        window = tokens[i:i + chunk_size]
+        content = [offsets for _, offsets, special in window if not special]
+        windows.append((text[content[0][0]:content[-1][1]] if content else None, [id for id, _, _ in window]))
+    return windows
+
+
+CORPUS = [(n_words, seed) for n_words in range(1, 40) for seed in range(2)] + [(2000, 0)]
+
+
+@pytest.mark.parametrize("chunk_size,overlap", WINDOWS)
+def test_chunks_match_legacy_windows(model, chunk_size, overlap):
+    tokenizer = get_tokenizer(model)
+    for n_words, seed in CORPUS:
+        text = make_text(n_words, seed)
+        windows = legacy_windows(text, model, chunk_size, overlap)
+        chunks = chunk_text_by_tokens(text, model=model, chunk_size=chunk_size, overlap=overlap)
+        legacy = legacy_chunk_text_by_tokens(text, model, chunk_size=chunk_size, overlap=overlap)
+        assert len(legacy) == len(windows)
+
+        # windows holding only [CLS] or [SEP] have no text and are skipped
+        expected = [window for window, _ in windows if window is not None]
+        assert chunks == expected, (n_words, seed)
+        for (window, ids), decoded in zip(windows, legacy):
+            if window is None:
+                assert decoded.strip() in ("[CLS]", "[SEP]", "[CLS] [SEP]")
+            elif not tokenizer.convert_ids_to_tokens(ids[0]).startswith("##"):
+                # the same tokens as the legacy chunk, which decoded them back to (normalized) text
+                content = tokenizer(window, add_special_tokens=False, verbose=False)["input_ids"]
+                assert tokenizer.decode(content) == tokenizer.decode(ids, skip_special_tokens=True)
+
+
+def test_streamed_pieces_match_whole_text(model):
+    text = make_text(600, 3)
+    rng = random.Random(0)
+    cuts = sorted(rng.sample(range(1, len(text)), 40))
+    # pieces split anywhere, mid-word and inside multi-byte runs included
+    pieces = [text[start:end] for start, end in zip([0] + cuts, cuts + [len(text)])]
+    for chunk_size, overlap in WINDOWS:
+        assert list(iter_chunks_by_tokens(pieces, model=model, chunk_size=chunk_size, overlap=overlap)) == \
+            chunk_text_by_tokens(text, model=model, chunk_size=chunk_size, overlap=overlap)
+
+
+def test_overlap_must_be_smaller_than_chunk_size(word_piece_model):
+    with pytest.raises(ValueError):
+        chunk_text_by_tokens("the interview", model=word_piece_model, chunk_size=4, overlap=4)
@@ -0,0 +1,114 @@
+import asyncio
+import re
+import time
+
+import pytest
+
+import services.conversation_context as conversation_context
+from services.conversation_context import RECENT_HEADER, SUMMARY_HEADER, ConversationContextBuilder
+
+
+class WordBuilder(ConversationContextBuilder):
+    """Builder counting whitespace-separated words as tokens, so the tests need no tokenizer download"""
+
+    def _encode(self, text):
+        offsets = [match.span() for match in re.finditer(r"\S+", text)]
+        return {"input_ids": list(range(len(offsets))), "offset_mapping": offsets}
+
+
+def turn(i, words=3):
+    return {"user_query": f"question {i}", "response": " ".join([f"answer{i}"] * words) + ".", "timestamp": float(i)}
+
+
+def builder(**kwargs):
+    options = {"token_budget": 100, "summary_tokens": 20, "recent_turns": 5, "summary_mode": "extractive"}
+    options.update(kwargs)
+    return WordBuilder(**options)
+
+
+def test_split_keeps_recent_turns_within_budget():
+    # 7 words per formatted turn and 100 - 20 - 6 header words = 74 for the window: the turn limit applies first
+    older, recent = builder().split([turn(i) for i in range(10)])
+    assert [message["timestamp"] for message in older] == [float(i) for i in range(5)]
+    assert len(recent) == 5
+    assert recent[-1].startswith("User: question 9")
+
+
+def test_split_drops_turns_over_budget():
+    older, recent = builder(token_budget=60).split([turn(i) for i in range(10)])
+    # 60 - 20 - 6 = 34 tokens: four 7-word turns fit, a fifth does not
+    assert len(recent) == 4
+    assert len(older) == 6
+    assert recent[0].startswith("User: question 6")
+
+
+def test_split_cuts_an_oversized_latest_turn():
+    older, recent = builder(token_budget=40).split([turn(0), turn(1, words=50)])
+    # 40 - 20 - 6 = 14 tokens, the beginning of the latest turn only
+    assert [message["timestamp"] for message in older] == [0.0]
+    assert recent == ["User: question 1\nAssistant: " + " ".join(["answer1"] * 10)]
+
+
+def test_compose_condenses_turns_not_summarized_yet():
+    context_builder = builder(recent_turns=2)
+    messages = [turn(i) for i in range(4)]
+    context = context_builder.compose(messages, {"summary": "Earlier things.", "summarized_until": 0.0})
+    summary, recent = context.split("\n\n" + RECENT_HEADER + "\n")
+    assert summary.startswith(SUMMARY_HEADER)
+    # turn 0 is covered by the stored summary, turn 1 is condensed on the fly
+    assert "Earlier things." in summary
+    assert "question 0" not in summary
+    assert "User asked: question 1 Assistant answered: answer1 answer1 answer1." in summary
+    assert recent.startswith("User: question 2")
+
+
+def test_compose_keeps_the_newest_end_of_a_long_summary():
+    context_builder = builder(recent_turns=1, summary_tokens=10)
+    context = context_builder.compose([turn(0), turn(1)], {"summary": " ".join(f"w{i}" for i in range(30)), "summarized_until": 0.0})
+    summary = context.split("\n\n")[0]
+    assert context_builder.count_tokens(summary) == 10 + len(SUMMARY_HEADER.split())
+    assert summary.endswith("w29")
+
+
+def test_compose_without_messages_is_empty():
+    assert builder().compose([], {"summary": "anything"}) == ""
+
+
+def test_fold_advances_past_the_pending_turns():
+    context_builder = builder(recent_turns=2)
+    messages = [turn(i) for i in range(5)]
+    record = asyncio.run(context_builder.afold(messages, {"summary": "", "summarized_until": 0.0, "turns": 1}))
+    assert record["summarized_until"] == 2.0
+    assert record["turns"] == 3
+    assert "question 1" in record["summary"] and "question 2" in record["summary"]
+    assert "question 0" not in record["summary"]
+    # nothing left to fold once the record caught up
+    assert asyncio.run(context_builder.afold(messages, record)) is None
+
+
+class SlowRedis:
+    def __init__(self, delay):
+        self.delay = delay
+
+    async def aget_conversation_history(self, session_id):
+        await asyncio.sleep(self.delay)
+        return [turn(0)]
+
+    async def aget_conversation_summary(self, session_id):
+        return None
+
+
+class SlowBuilder(WordBuilder):
+    def compose(self, messages, record=None):
+        # a cold tokenizer load
+        time.sleep(0.2)
+        return super().compose(messages, record)
+
+
+def test_build_timeout_bounds_only_the_redis_reads(monkeypatch):
+    monkeypatch.setattr(conversation_context, "get_redis_service", lambda: SlowRedis(0.0))
+    assert "question 0" in asyncio.run(SlowBuilder(summary_mode="extractive").abuild("s", timeout=0.1))
+
+    monkeypatch.setattr(conversation_context, "get_redis_service", lambda: SlowRedis(1.0))
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(SlowBuilder(summary_mode="extractive").abuild("s", timeout=0.1))
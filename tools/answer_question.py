@@ -1,141 +1,239 @@
 import os
 import time
-import smtplib
-from langchain.tools import tool
-from email.mime.text import MIMEText
-from database.db_conn import SessionLocal, Booking
+import asyncio
+from langchain_core.tools import StructuredTool
+from database.db_conn import Booking, ensure_outbox_table, get_session
+from services.chunk_hydration import ahydrate_matches, hydrate_matches
+from services.corpus_collections import Scope, current_scope
 from dotenv import load_dotenv
+from typing import Any, Awaitable, List, Optional, Tuple
 import numpy as np
-from sentence_transformers import SentenceTransformer
-from typing import List, Tuple
-from pinecone import Pinecone
-from services.redis_service import redis_service
-from langchain_google_genai import ChatGoogleGenerativeAI
-from pydantic import SecretStr
+from services.redis_service import get_redis_service
+from services.query_batcher import query_batcher
+from services.retrieval import aretrieve, retrieve
+from services.vector_store import VectorMatch
+from services.llm_client import get_llm_client, message_text
+from services.metrics import record_cache, timed_stage
+from services.mailer import BOOKING_NOTIFY_EMAIL, enqueue_email, notify_mailer
 
 load_dotenv()
 
-# Initialize the same model used for embeddings
-model = SentenceTransformer('all-MiniLM-L6-v2')
+# per-stage timeouts of the async request path, in seconds
+REDIS_TIMEOUT_SECONDS = float(os.getenv("REDIS_TIMEOUT_SECONDS", 2))
+EMBEDDING_TIMEOUT_SECONDS = float(os.getenv("EMBEDDING_TIMEOUT_SECONDS", 10))
+VECTOR_QUERY_TIMEOUT_SECONDS = float(os.getenv("VECTOR_QUERY_TIMEOUT_SECONDS", 10))
+DB_TIMEOUT_SECONDS = float(os.getenv("DB_TIMEOUT_SECONDS", 5))
+# the LLM call is bounded by the LLM client (LLM_TIMEOUT_SECONDS per attempt)
 
-# Pinecone setup
-pinecone_api_key = os.getenv("PINECONE_API_KEY")
-if not pinecone_api_key:
-    raise ValueError("PINECONE_API_KEY environment variable is not set")
+# tag of the answer generation LLM run, lets the streaming route forward its tokens
+ANSWER_LLM_TAG = "document_answer"
 
-pinecone_index_name = os.getenv("PINECONE_INDEX_NAME")
-if not pinecone_index_name:
-    raise ValueError("PINECONE_INDEX_NAME environment variable is not set")
+# corpus version of a request whose version read timed out: cache entries cannot be checked against it, the caches are skipped
+UNKNOWN_CORPUS_VERSION = -1
 
-pc= Pinecone(api_key=pinecone_api_key)
-index= pc.Index(pinecone_index_name)
+TIMEOUT_RESPONSE = "Sorry, answering your question took too long. Please try again."
+ERROR_RESPONSE_PREFIX = "Sorry, I encountered an error while trying to answer your question"
 
-# db variables validation
-db_host = os.getenv("DB_HOST")
-db_port = os.getenv("DB_PORT")
-db_name = os.getenv("DB_NAME")
-db_user = os.getenv("DB_USER")
-db_password = os.getenv("DB_PASSWORD")
+NO_MATCHES_RESPONSE = "I couldn't find any relevant information to answer your question. Please make sure you have uploaded some documents first."
 
-if not all([db_host, db_port, db_name, db_user, db_password]):
-    raise ValueError("Database environment variables (DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASSWORD) are not set")
+# markers of answers served from the exact and semantic caches
+CACHED_MARKERS = ("[CACHED] ", "[SIMILAR CACHED] ")
 
 
-def retrieve_and_answer(query: str, top_k: int = 2, session_id: str = "default") -> str:
+def is_failed_response(response: str) -> bool:
+    """Whether an answer is the timeout or error message, also when it was served from a cache"""
+    for marker in CACHED_MARKERS:
+        if response.startswith(marker):
+            response = response[len(marker):]
+            break
+    return response == TIMEOUT_RESPONSE or response.startswith(ERROR_RESPONSE_PREFIX)
+
+
+def _build_prompt(query: str, chunk_text: str) -> str:
+    # Create a prompt for the LLM to generate a proper response
+    return f"""
+        Based on the following information retrieved from documents, please provide a helpful and accurate answer to the user's question.
+        
+        User's question: {query}
+        
+        Retrieved information: {chunk_text}
+        
+        Please provide a clear, helpful response that directly addresses the user's question using the retrieved information. 
+        """
+
+
+def retrieve_and_answer(query: str, top_k: int = 2, session_id: str = "default", scope: Optional[Scope] = None) -> str:
     """
-    Query embedding and similarity search in pinecone, retrieve chunk_id, use chunk_id to retrieve full text from postgres with Redis caching for improved performance.
+    Query embedding and similarity search in the vector store (and/or the BM25 index, by RETRIEVAL_MODE), retrieve the top_k chunk ids, use them to retrieve full texts (in-process cache, then one postgres query) with Redis caching for improved performance.
     
     Args:
         query: The user's question
         top_k: Number of top chunks to retrieve
         session_id: id for each user or session
+        scope: collections (and documents) searched, the request's scope when not given
         
     Returns:
-        Answer to the question based on the retrieved chunk from postgres and llm 
+        Answer to the question based on the retrieved chunks from postgres and llm 
     """
     
+    redis_service = get_redis_service()
+    if scope is None:
+        scope = current_scope()
+    corpus_version = None
     try:
+        # cache entries are only valid for the corpus they were answered from
+        with timed_stage("corpus_version"):
+            corpus_version = redis_service.get_corpus_version()
+
         # check in redis
-        cached_response = redis_service.get_cached_response(query)
+        with timed_stage("cache_exact"):
+            cached_response = redis_service.get_cached_response(query, corpus_version, scope=scope.key)
+        record_cache("exact", hits=int(bool(cached_response)), misses=int(not cached_response))
         if cached_response:
             return f"[CACHED] {cached_response['response']}"
         
-        # Check for similar cached queries
-        similar_responses = redis_service.find_similar_cached_queries(query, threshold=0.85)
-        if similar_responses:
-            best_similar = similar_responses[0]
-            if best_similar['similarity'] > 0.9:
+        # Compute query embedding, batched with concurrent queries
+        with timed_stage("embed_query"):
+            query_embedding = query_batcher.encode(query)
+
+        # Check for similar cached queries (semantic cache, same embedding); it only holds answers of the default scope
+        if not scope.key:
+            with timed_stage("cache_semantic"):
+                similar_responses = redis_service.find_similar_cached_queries(query, embedding=query_embedding, corpus_version=corpus_version)
+            record_cache("semantic", hits=int(bool(similar_responses)), misses=int(not similar_responses))
+            if similar_responses:
+                best_similar = similar_responses[0]
                 return f"[SIMILAR CACHED] {best_similar['response']}"
         
-        # Compute query embedding
-        query_embedding = model.encode([query])[0]
-        
-        results = index.query(
-            vector=query_embedding.tolist(),
-            top_k=top_k,
-            include_metadata=True
-        )
-
-        print("Search results: ", results)
+        # vector store, BM25 or both fused, by RETRIEVAL_MODE
+        matches = retrieve(query, query_embedding, top_k, scope=scope)
         
-        if not results.matches:  # type: ignore
-            response = "I couldn't find any relevant information to answer your question. Please make sure you have uploaded some documents first."
-            redis_service.cache_response(query, response, 0.0)
+        if not matches:
+            response = NO_MATCHES_RESPONSE
+            redis_service.cache_response(query, response, 0.0, embedding=query_embedding, corpus_version=corpus_version, scope=scope.key)
             return response
         
-        # Get the best match
-        best_match = results.matches[0]  # type: ignore
-        similarity_score = best_match.score
-        chunk_id = best_match.metadata.get('chunk_uuid', '')
+        # similarity of the best match
+        similarity_score = matches[0].score
 
-        # Log the similarity score and chunk id
-        print(f"Similarity score={similarity_score:.2f}")
-        print(f"Chunk id: {chunk_id}")
+        # Log the similarity scores and chunk ids
+        for match in matches:
+            print(f"Similarity score={match.score:.2f} chunk id: {match.id}")
 
-        # retrieve chunk from postgres data
-        chunk_text = get_full_text_chunk(chunk_id)
+        # text of all top_k chunks: in-process cache first, then one postgres query for the rest
+        with timed_stage("hydrate"):
+            hydrated = hydrate_matches(matches)
+        chunk_text = "\n\n---\n\n".join(text for _, text in hydrated)
         
-        api_key = os.getenv("GEMINI_API_KEY")
-        if not api_key:
-            raise ValueError("GEMINI_API_KEY environment variable is not set")
-        
-        llm = ChatGoogleGenerativeAI(
-            model="gemini-1.5-pro",
-            temperature=0.7,
-            api_key=SecretStr(api_key)
-        )
-        
-        # Create a prompt for the LLM to generate a proper response
-        prompt = f"""
-        Based on the following information retrieved from documents, please provide a helpful and accurate answer to the user's question.
-        
-        User's question: {query}
-        
-        Retrieved information: {chunk_text}
-        
-        Please provide a clear, helpful response that directly addresses the user's question using the retrieved information. 
-        """
-        
-        # Generate response using LLM
-        llm_response = llm.invoke(prompt)
-        response_content = llm_response.content if hasattr(llm_response, 'content') else str(llm_response)
-        
-        # Ensure response is a string
-        if isinstance(response_content, list):
-            response = " ".join(str(item) for item in response_content)
-        else:
-            response = str(response_content)
+        # Generate response using LLM (timed as "llm" by the client's callback)
+        response = message_text(get_llm_client().invoke(_build_prompt(query, chunk_text)))
         
         # Cache the response
-        redis_service.cache_response(query, response, similarity_score)
+        with timed_stage("cache_store"):
+            redis_service.cache_response(query, response, similarity_score, embedding=query_embedding, corpus_version=corpus_version,
+                                         scope=scope.key)
         
         # print(f"Response generated in: {time.time() - start_time:.3f}s")
         return response
         
     except Exception as e:
-        error_response = f"Sorry, I encountered an error while trying to answer your question: {str(e)}"
-        redis_service.cache_response(query, error_response, 0.0)
-        return error_response
+        # not cached, the error may be transient
+        return f"{ERROR_RESPONSE_PREFIX}: {str(e)}"
+
+async def _aread_cache(read: Awaitable[Any], stage: str) -> Any:
+    """Result of a Redis read within REDIS_TIMEOUT_SECONDS, None when it timed out: Redis is optional, a slow read is a miss"""
+    try:
+        with timed_stage(stage):
+            return await asyncio.wait_for(read, REDIS_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        print(f"Redis read ({stage}) timed out, treating it as a miss")
+        return None
+
+async def _acache_answer(query: str, response: str, similarity_score: float, query_embedding: Optional[np.ndarray],
+                         corpus_version: int, scope: Scope) -> None:
+    """Cache an answer within REDIS_TIMEOUT_SECONDS; the answer is ready, a slow or failing write must not replace it"""
+    if corpus_version == UNKNOWN_CORPUS_VERSION:
+        return
+    try:
+        await asyncio.wait_for(
+            get_redis_service().acache_response(query, response, similarity_score, embedding=query_embedding, corpus_version=corpus_version,
+                                                scope=scope.key),
+            REDIS_TIMEOUT_SECONDS
+        )
+    except asyncio.TimeoutError:
+        print("Response cache write timed out")
+    except Exception as e:
+        print(f"Response cache write failed: {e}")
+
+async def aretrieve_and_answer(query: str, top_k: int = 2, session_id: str = "default", query_embedding: Optional[np.ndarray] = None,
+                              corpus_version: Optional[int] = None, scope: Optional[Scope] = None) -> str:
+    """
+    Async variant of retrieve_and_answer for the /chat path.
+
+    Redis, embedding, the chunk text query and the LLM call are awaited; the vector store and
+    BM25 queries run in the default thread pool. Every stage has its own timeout, so a stalled dependency
+    fails one request instead of holding the event loop; a timed out Redis read is a cache miss
+    (without a corpus version the caches are skipped) and the answer is still retrieved. `query_embedding` skips embedding the
+    query again when the caller (the intent router) already has it, `corpus_version` reading the
+    corpus version again when the caller read it at the start of the request. `scope` defaults to
+    the request's scope.
+    """
+    redis_service = get_redis_service()
+    if scope is None:
+        scope = current_scope()
+    try:
+        if corpus_version is None:
+            corpus_version = await _aread_cache(redis_service.aget_corpus_version(), "corpus_version")
+            if corpus_version is None:
+                corpus_version = UNKNOWN_CORPUS_VERSION
+        use_cache = corpus_version != UNKNOWN_CORPUS_VERSION
+
+        if use_cache:
+            cached_response = await _aread_cache(redis_service.aget_cached_response(query, corpus_version, scope=scope.key), "cache_exact")
+            record_cache("exact", hits=int(bool(cached_response)), misses=int(not cached_response))
+            if cached_response:
+                return f"[CACHED] {cached_response['response']}"
+
+        if query_embedding is None:
+            with timed_stage("embed_query"):
+                query_embedding = await asyncio.wait_for(query_batcher.aencode(query), EMBEDDING_TIMEOUT_SECONDS)
+
+        if use_cache and not scope.key:
+            similar_responses = await _aread_cache(
+                redis_service.afind_similar_cached_queries(query, embedding=query_embedding, corpus_version=corpus_version), "cache_semantic"
+            )
+            record_cache("semantic", hits=int(bool(similar_responses)), misses=int(not similar_responses))
+            if similar_responses:
+                return f"[SIMILAR CACHED] {similar_responses[0]['response']}"
+
+        matches = await aretrieve(query, query_embedding, top_k, scope=scope, timeout=VECTOR_QUERY_TIMEOUT_SECONDS)
+
+        if not matches:
+            await _acache_answer(query, NO_MATCHES_RESPONSE, 0.0, query_embedding, corpus_version, scope)
+            return NO_MATCHES_RESPONSE
+
+        similarity_score = matches[0].score
+        for match in matches:
+            print(f"Similarity score={match.score:.2f} chunk id: {match.id}")
+
+        with timed_stage("hydrate"):
+            hydrated = await asyncio.wait_for(ahydrate_matches(matches), DB_TIMEOUT_SECONDS)
+        chunk_text = "\n\n---\n\n".join(text for _, text in hydrated)
+
+        # timed as "llm" by the client's callback
+        llm_response = await get_llm_client().ainvoke(_build_prompt(query, chunk_text), config={"tags": [ANSWER_LLM_TAG]})
+        response = message_text(llm_response)
+
+    except asyncio.TimeoutError:
+        # not cached: the next attempt may well succeed
+        return TIMEOUT_RESPONSE
+    except Exception as e:
+        # not cached either, the error may be transient
+        return f"{ERROR_RESPONSE_PREFIX}: {str(e)}"
+
+    with timed_stage("cache_store"):
+        await _acache_answer(query, response, similarity_score, query_embedding, corpus_version, scope)
+    return response
 
 def get_full_text_chunk(chunk_uuid: str) -> str:
     """
@@ -149,39 +247,22 @@ def get_full_text_chunk(chunk_uuid: str) -> str:
     """
 
     try:
-        import psycopg2
-        conn = psycopg2.connect(
-            dbname=db_name,
-            user=db_user,
-            password=db_password,
-            host=db_host,
-            port=db_port
-        )
-
-        cursor = conn.cursor()
-        
-        cursor.execute(
-            "SELECT chunk_text FROM chunks WHERE chunk_id = %s",
-            (chunk_uuid,)
-        )
-        
-        result = cursor.fetchone()
-        cursor.close()
-        conn.close()
-        
-        return result[0] if result else ""
+        # served from the chunk text cache when possible
+        hydrated = hydrate_matches([VectorMatch(chunk_uuid, 0.0, {"chunk_uuid": chunk_uuid})])
+        return hydrated[0][1] if hydrated else ""
         
     except Exception as e:
         print(f"Error retrieving full text from PostgreSQL: {e}")
         return ""
 
-@tool
-def answer_from_documents(user_query: str, session_id: str = "default") -> str:
+def _answer_from_documents(user_query: str, session_id: str = "default") -> str:
     """Answer a question from the documents by retrieving the most relevant documents and returning the answer"""
     return retrieve_and_answer(user_query, session_id=session_id)
 
-@tool
-def book_interview(name, email, date, time):
+async def _aanswer_from_documents(user_query: str, session_id: str = "default") -> str:
+    return await aretrieve_and_answer(user_query, session_id=session_id)
+
+def _book_interview(name, email, date, time):
     """ Book an interview
 
     Args:
@@ -193,31 +274,46 @@ def book_interview(name, email, date, time):
     Returns:
         A confirmation message that the booking was successful
     """
-    # Check environment variables
-    smtp_email = os.getenv("SMTP_EMAIL")
-    smtp_password = os.getenv("SMTP_PASSWORD")
-    
-    if not smtp_email or not smtp_password:
-        raise ValueError("SMTP_EMAIL and SMTP_PASSWORD environment variables must be set")
-    
-    # Store to database
-    session = SessionLocal()
-    booking = Booking(name=name, email=email, date=date, time=time)
-    session.add(booking)
-    session.commit()
-    session.close()
-
-    # Send email
-    msg = MIMEText(f"Booking confirmed for {name} on {date} at {time}.")
-    msg["Subject"] = "Booking Confirmation"
-    msg["From"] = smtp_email
-    msg["To"] = smtp_email
-
-    with smtplib.SMTP("smtp.gmail.com", 587) as server:
-        server.starttls()
-        server.login(smtp_email, smtp_password)
-        server.sendmail(msg["From"], msg["To"], msg.as_string())
-
-    return "Booking confirmed and email sent."
+    ensure_outbox_table()
+
+    # the booking and its confirmation email are committed together; the mailer sends the email
+    session = get_session()
+    try:
+        booking = Booking(name=name, email=email, date=date, time=time)
+        session.add(booking)
+        session.flush()
+        enqueue_email(
+            session,
+            f"booking-confirmation:{booking.id}",
+            "Booking Confirmation",
+            f"Booking confirmed for {name} on {date} at {time}.",
+            recipient=BOOKING_NOTIFY_EMAIL
+        )
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+    notify_mailer()
+    return "Booking confirmed, a confirmation email will be sent shortly."
+
+async def _abook_interview(name, email, date, time):
+    # the SQLAlchemy session is blocking, keep it off the event loop
+    return await asyncio.to_thread(_book_interview, name, email, date, time)
+
+# tools with both entry points: the agent's ainvoke awaits the coroutine, invoke calls the function
+answer_from_documents = StructuredTool.from_function(
+    func=_answer_from_documents,
+    coroutine=_aanswer_from_documents,
+    name="answer_from_documents"
+)
+
+book_interview = StructuredTool.from_function(
+    func=_book_interview,
+    coroutine=_abook_interview,
+    name="book_interview"
+)
 
 __all__ = ["book_interview", "answer_from_documents"]
\ No newline at end of file